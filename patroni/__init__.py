@@ -5,11 +5,10 @@ import time
 import yaml
 
 from patroni.api import RestApiServer
-from patroni.etcd import Etcd
+from patroni.dcs import get_dcs
 from patroni.ha import Ha
 from patroni.postgresql import Postgresql
 from patroni.utils import setup_signal_handlers, reap_children
-from patroni.zookeeper import ZooKeeper
 from .version import __version__
 
 logger = logging.getLogger(__name__)
@@ -42,11 +41,7 @@ class Patroni(object):
 
     @staticmethod
     def get_dcs(name, config):
-        if 'etcd' in config:
-            return Etcd(name, config['etcd'])
-        if 'zookeeper' in config:
-            return ZooKeeper(name, config['zookeeper'])
-        raise Exception('Can not find suitable configuration of distributed configuration store')
+        return get_dcs(name, config)
 
     def schedule_next_run(self):
         self.next_run += self.nap_time
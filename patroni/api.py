@@ -2,7 +2,9 @@ import base64
 import fcntl
 import json
 import logging
+import os
 import psycopg2
+import select
 import socket
 import time
 import dateutil
@@ -10,10 +12,14 @@ import datetime
 import pytz
 
 from patroni.exceptions import PostgresConnectionException
+from patroni.metrics import PrometheusText
 from patroni.utils import Retry, RetryFailedError
 from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
-from six.moves.socketserver import ThreadingMixIn
-from threading import Thread
+from collections import deque
+from six.moves.queue import Empty, Full, Queue
+from six.moves.urllib_parse import parse_qsl, urlparse
+from multiprocessing.pool import ThreadPool
+from threading import Condition, Event, Lock, Thread
 
 logger = logging.getLogger(__name__)
 
@@ -32,16 +38,58 @@ def check_auth(func):
     return wrapper
 
 
+def run_in_lane(name):
+    """Decorator function which moves processing of the request from the workers of `RestApiServer`
+    to the threads of the `RequestLane` with the given name, see `RestApiServer.complete_request`.
+
+    Usage example:
+    @run_in_lane('control')
+    def do_POST_foo():
+        pass
+    """
+    def decorator(func):
+        def wrapper(handler):
+            if handler.lane and handler.lane.name == name:
+                return func(handler)
+            handler.handover = (handler.server.lanes[name], func)
+        return wrapper
+    return decorator
+
+
 class RestApiHandler(BaseHTTPRequestHandler):
 
-    def send_auth_request(self, body):
-        self.send_response(401)
-        self.send_header('WWW-Authenticate', 'Basic realm=\"Patroni\"')
-        self.send_header('Content-type', 'text/html')
+    """Speaks HTTP/1.1 and keeps connections alive. Every response must have a `Content-Length`, therefore
+    all of them are sent with `write_response`. The handler serves requests which have already arrived over
+    the connection and then returns, the idle connection is given back to the `RestApiServer`."""
+
+    protocol_version = 'HTTP/1.1'
+    FAILOVER_TIMEOUT = 15  # seconds to wait for the result of manual failover
+    detached = False  # the connection was passed to someone else, i.e. `EventStream`, and must stay open
+    handover = None  # tuple(`RequestLane`, function) which must process the request, set by `run_in_lane` decorator
+    lane = None  # `RequestLane` in which thread the handler is running
+
+    def __init__(self, request, client_address, server, served=0):
+        self.served = served  # number of requests served over this connection, including previous handlers
+        BaseHTTPRequestHandler.__init__(self, request, client_address, server)
+
+    def write_response(self, status_code, body, content_type='text/html', headers=None):
+        self.send_response(status_code)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', len(body))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
         self.end_headers()
-        self.wfile.write(body.encode('utf-8'))
+        self.wfile.write(body)
+
+    def send_auth_request(self, body):
+        self.write_response(401, body.encode('utf-8'), headers={'WWW-Authenticate': 'Basic realm="Patroni"'})
 
     def finish(self, *args, **kwargs):
+        if self.detached or self.handover:
+            return
         try:
             if not self.wfile.closed:
                 self.wfile.flush()
@@ -61,48 +109,179 @@ class RestApiHandler(BaseHTTPRequestHandler):
     def do_GET(self, options=False):
         """Default method for processing all GET requests which can not be routed to other methods"""
 
-        path = '/master' if self.path == '/' else self.path
-        response = self.get_postgresql_status()
-        response.update(self.get_tags())
+        url = urlparse(self.path)
+        path = '/master' if url.path == '/' else url.path
+        # `GET /read-only` accepts both the master and replicas
+        roles = ('master', 'replica') if path.startswith('/read-only') else\
+            [role for role in ('master', 'replica') if role in path]
+        # health checks are answered from memory, see `PostgresStatusSampler`
+        response, body = self.server.status.get()
 
         patroni = self.server.patroni
         cluster = patroni.dcs.cluster
         if cluster:  # dcs available
             if cluster.leader and cluster.leader.name == patroni.postgresql.name:  # is_leader
-                status_code = 200 if 'master' in path else 503
+                status_code = 200 if 'master' in roles else 503
             elif 'role' not in response:
                 status_code = 503
             elif response['role'] == 'master':  # running as master but without leader lock!!!!
                 status_code = 503
-            elif response['role'] in path:
+            elif response['role'] in roles:
                 status_code = 200
             else:
                 status_code = 503
-        elif 'role' in response and response['role'] in path:
+        elif 'role' in response and response['role'] in roles:
             status_code = 200
-        elif patroni.ha.restart_scheduled() and patroni.postgresql.role == 'master' and 'master' in path:
+        elif patroni.ha.restart_scheduled() and patroni.postgresql.role == 'master' and 'master' in roles:
             # exceptional case for master node when the postgres is being restarted via API
             status_code = 200
         else:
             status_code = 503
 
-        self.send_response(status_code)
-        if not options:
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps(response).encode('utf-8'))
+        if status_code == 200 and response.get('role') == 'replica' and \
+                self.replica_is_lagging(response['xlog'], cluster, dict(parse_qsl(url.query))):
+            status_code = 503
+
+        if options:
+            self.write_response(status_code, b'', None)
+        else:
+            self.write_response(status_code, body, 'application/json')
+
+    @staticmethod
+    def leader_location(cluster):
+        """The last known xlog location of the leader: the optime key, or the `xlog_location` from the member
+        key of the leader if the optime isn't known (ZooKeeper reads the optime key only when the leader
+        doesn't have the member key)"""
+
+        if cluster.last_leader_operation:
+            return cluster.last_leader_operation
+        location = cluster.leader and cluster.leader.member.data.get('xlog_location')
+        return int(location) if location is not None else None
+
+    def replica_is_lagging(self, xlog, cluster, params):
+        """Checks the replica against the maximum lag in bytes behind the last leader operation in DCS
+        and the maximum delay of replay in seconds. The limits are taken from the query parameters `lag`
+        and `replay_delay` or from the configuration. The lag can't be checked if DCS is not accessible
+        or the location of the leader is unknown.
 
+        :returns: `!True` if any of the limits is exceeded"""
+
+        max_lag = params.get('lag', self.server.maximum_lag)
+        max_delay = params.get('replay_delay', self.server.maximum_replay_delay)
+        try:
+            max_lag = None if max_lag is None else int(max_lag)
+            max_delay = None if max_delay is None else float(max_delay)
+        except ValueError:
+            return True
+
+        replayed = xlog.get('replayed_location') or 0
+        leader_location = cluster and self.leader_location(cluster)
+        if max_lag is not None and leader_location is not None and leader_location - replayed > max_lag:
+            return True
+
+        # when the replica has replayed everything it has received, the last replayed transaction may be old
+        # just because there were no writes on the master
+        received = xlog.get('received_location')
+        if max_delay is not None and xlog.get('replayed_timestamp') and (received is None or replayed < received):
+            delay = datetime.datetime.now(pytz.utc) - dateutil.parser.parse(xlog['replayed_timestamp'])
+            return delay.total_seconds() > max_delay
+        return False
+
+    @run_in_lane('status')
     def do_GET_patroni(self):
         response = self.get_postgresql_status(True)
         response.update(self.get_tags())
         response['patroni'] = {'version': self.server.patroni.version, 'scope': self.server.patroni.postgresql.scope}
 
+        self.write_response(200, json.dumps(response).encode('utf-8'), 'application/json')
+
+    def do_GET_dcs(self):
+        response = self.server.patroni.dcs.get_metrics()
+
+        self.write_response(200, json.dumps(response).encode('utf-8'), 'application/json')
+
+    def do_GET_metrics(self):
+        """Exports metrics in the text format of Prometheus. Everything is taken from memory: the status of
+        Postgres from `PostgresStatusSampler`, the rest from the last DCS snapshot and counters. Like health checks
+        it is answered by workers, so that a scrape doesn't wait behind `GET /cluster` in the `status` lane."""
+
+        patroni = self.server.patroni
+        postgresql = patroni.postgresql
+        status = self.server.status.get()[0]
+        metrics = PrometheusText()
+
+        metrics.add('patroni_info', 'Patroni version, scope and name of the member', 1,
+                    {'version': patroni.version, 'scope': postgresql.scope, 'name': postgresql.name})
+        metrics.add('patroni_postgres_role', 'Role of PostgreSQL', 1, {'role': status.get('role', postgresql.role)})
+        metrics.add('patroni_postgres_state', 'State of PostgreSQL', 1, {'state': status['state']})
+
+        xlog = status.get('xlog', {})
+        metrics.add('patroni_xlog_location', 'Current xlog location of the master', xlog.get('location'))
+        metrics.add('patroni_xlog_received_location', 'Last xlog location received by the replica',
+                    xlog.get('received_location'))
+        metrics.add('patroni_xlog_replayed_location', 'Last xlog location replayed by the replica',
+                    xlog.get('replayed_location'))
+        if xlog.get('replayed_timestamp'):
+            lag = datetime.datetime.now(pytz.utc) - dateutil.parser.parse(xlog['replayed_timestamp'])
+            metrics.add('patroni_xlog_replay_lag_seconds', 'Time since the last replayed transaction was committed',
+                        max(lag.total_seconds(), 0.0))
+        if 'paused' in xlog:
+            metrics.add('patroni_xlog_replay_paused', 'Replay of xlog is paused on the replica', xlog['paused'])
+
+        cluster = patroni.dcs.cluster
+        metrics.add('patroni_leader', 'This member holds the leader lock',
+                    bool(cluster and cluster.leader and cluster.leader.name == postgresql.name))
+
+        action, busy = patroni.ha.async_action()
+        metrics.add('patroni_async_action_in_progress', 'Long running action (restart, reinitialize...) is running',
+                    busy, {'action': action or ''})
+        for event, count in sorted(postgresql.events.items()):
+            metrics.add('patroni_postgres_{0}_total'.format(event),
+                        'Number of PostgreSQL {0} since the start of Patroni'.format(event.replace('_', ' ')),
+                        count, metric_type='counter')
+        metrics.add_histogram('patroni_ha_cycle_duration_seconds', 'Duration of HA cycles',
+                              patroni.ha.cycle_duration.snapshot())
+
+        dcs = patroni.dcs.get_metrics()
+        metrics.add('patroni_dcs_last_seen_timestamp_seconds', 'Time of the last successful read of the cluster',
+                    dcs['last_seen'] or 0.0)
+        for operation, stats in sorted(dcs['operations'].items()):
+            labels = {'operation': operation}
+            metrics.add_histogram('patroni_dcs_operation_duration_seconds', 'Duration of DCS operations', stats, labels)
+            for name, description in (('errors', 'DCS operations which raised an exception'),
+                                      ('failures', 'DCS operations which returned False'),
+                                      ('retries', 'Retried DCS requests'),
+                                      ('bytes_sent', 'Bytes sent to DCS'),
+                                      ('bytes_received', 'Bytes received from DCS')):
+                metrics.add('patroni_dcs_{0}_total'.format(name), description, stats[name], labels, 'counter')
+
+        self.write_response(200, metrics.render(), PrometheusText.CONTENT_TYPE)
+
+    def do_GET_events(self):
+        """Long-lived stream of Server-Sent Events: `member` (role and state of this node), `leader` and `failover`.
+        The response has no length, it ends when the connection is closed"""
+
+        self.close_connection = True
         self.send_response(200)
-        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
         self.end_headers()
-        self.wfile.write(json.dumps(response).encode('utf-8'))
+        self.wfile.flush()
+        self.server.events.subscribe(self.connection)
+        self.detached = True
+
+    @run_in_lane('status')
+    def do_GET_cluster(self):
+        """The status of every member of the cluster, see `RestApiServer.get_cluster_status`"""
+        body = self.server.cluster_status.get() or self.server.get_stale_cluster_status()
+        if body:
+            self.write_response(200, body, 'application/json')
+        else:
+            self.write_response(503, b'DCS is not accessible')
 
     @check_auth
+    @run_in_lane('control')
     def do_POST_restart(self):
         status_code = 500
         data = b'restart failed'
@@ -113,16 +292,14 @@ class RestApiHandler(BaseHTTPRequestHandler):
         except Exception:
             logger.exception('Exception during restart')
 
-        self.send_response(status_code)
-        self.send_header('Content-Type', 'text/html')
-        self.end_headers()
-        self.wfile.write(data)
+        self.write_response(status_code, data)
 
     @check_auth
+    @run_in_lane('control')
     def do_POST_reinitialize(self):
         ha = self.server.patroni.ha
-        cluster = ha.dcs.get_cluster()
-        if cluster.is_unlocked():
+        cluster = ha.dcs.cluster
+        if not cluster or cluster.is_unlocked():
             status_code = 503
             data = b'Cluster has no leader, can not reinitialize'
         elif cluster.leader.name == ha.state_handler.name:
@@ -137,35 +314,48 @@ class RestApiHandler(BaseHTTPRequestHandler):
                 status_code = 200
                 data = b'reinitialize scheduled'
 
-        self.send_response(status_code)
-        self.send_header('Content-Type', 'text/html')
-        self.end_headers()
-        self.wfile.write(data)
+        self.write_response(status_code, data)
 
     def poll_failover_result(self, leader, candidate):
-        for _ in range(0, 15):
-            time.sleep(1)
-            try:
-                cluster = self.server.patroni.dcs.get_cluster()
-                if cluster.leader and cluster.leader.name != leader:
-                    if not candidate or candidate == cluster.leader.name:
-                        return 200, ('Successfully failed over to ' + cluster.leader.name).encode('utf-8')
-                    else:
-                        return 200, 'Failed over to "{0}" instead of "{1}"'.format(cluster.leader.name,
-                                                                                   candidate).encode('utf-8')
-                if not cluster.failover:
-                    return 503, b'Failover failed'
-            except Exception as e:
-                logger.debug('Exception occured during polling failover result: %s', e)
+        """Waits for new snapshots of the cluster published by the HA loop (it reacts on watch events from DCS),
+        we never query DCS from the API thread. Returns as soon as the leader has changed or the failover key
+        has disappeared. The first snapshots might have been loaded before the key was written, therefore
+        its absence means failure only after some snapshot has shown the key.
+
+        :returns: tuple(status code, message with the duration of failover)"""
+
+        dcs = self.server.patroni.dcs
+        cluster = dcs.cluster
+        start = time.time()
+        end_time = start + self.FAILOVER_TIMEOUT
+        failover_seen = False
+        while time.time() < end_time:
+            cluster = dcs.wait_for_cluster_change(cluster, end_time - time.time())
+            if not cluster:
+                continue
+            duration = time.time() - start
+            if cluster.leader and cluster.leader.name != leader:
+                if not candidate or candidate == cluster.leader.name:
+                    message = 'Successfully failed over to {0}'.format(cluster.leader.name)
+                else:
+                    message = 'Failed over to "{0}" instead of "{1}"'.format(cluster.leader.name, candidate)
+                return 200, '{0} in {1:.2f} seconds'.format(message, duration).encode('utf-8')
+            if cluster.failover:
+                failover_seen = True
+            elif failover_seen:
+                return 503, 'Failover failed after {0:.2f} seconds'.format(duration).encode('utf-8')
         return 503, b'Failover status unknown'
 
     def is_failover_possible(self, cluster, leader, candidate):
+        if not cluster:
+            return b'DCS is not accessible'
         if leader and not cluster.leader or cluster.leader.name != leader:
             return b'leader name does not match'
         if candidate:
-            members = [m for m in cluster.members if m.name == candidate]
-            if not members:
+            member = cluster.get_member(candidate)
+            if not member:
                 return b'candidate does not exists'
+            members = [member]
         else:
             members = [m for m in cluster.members if m.name != cluster.leader.name and m.api_url]
             if not members:
@@ -176,16 +366,16 @@ class RestApiHandler(BaseHTTPRequestHandler):
         return b'failover is not possible: no good candidates have been found'
 
     @check_auth
+    @run_in_lane('control')
     def do_POST_failover(self):
-        content_length = int(self.headers.get('content-length', 0))
         try:
-            request = json.loads(self.rfile.read(content_length).decode('utf-8'))
+            request = json.loads(self.body.decode('utf-8'))
         except ValueError:
             request = {}
         leader = request.get('leader')
         candidate = request.get('candidate') or request.get('member')
         scheduled_at = request.get('scheduled_at')
-        cluster = self.server.patroni.ha.dcs.get_cluster()
+        cluster = self.server.patroni.ha.dcs.cluster
         status_code = 500
 
         logger.info("received failover request with leader=%s candidate=%s scheduled_at=%s",
@@ -222,10 +412,7 @@ class RestApiHandler(BaseHTTPRequestHandler):
             status_code = 400
             data = b'No values given for required parameters leader and candidate'
 
-        self.send_response(status_code)
-        self.send_header('Content-Type', 'text/html')
-        self.end_headers()
-        self.wfile.write(data)
+        self.write_response(status_code, data)
 
     def parse_request(self):
         """Override parse_request method to enrich basic functionality of `BaseHTTPRequestHandler` class
@@ -239,55 +426,82 @@ class RestApiHandler(BaseHTTPRequestHandler):
 
         ret = BaseHTTPRequestHandler.parse_request(self)
         if ret:
-            mname = self.path.lstrip('/').split('/')[0]
+            mname = urlparse(self.path).path.lstrip('/').split('/')[0]
             mname = self.command + ('_' + mname if mname else '')
             if hasattr(self, 'do_' + mname):
                 self.command = mname
+
+            self.served += 1
+            if self.served >= self.server.keepalive_requests or self.headers.get('Transfer-Encoding'):
+                self.close_connection = True
+
+            # the body must be consumed even if it is not used, otherwise it would be taken for the next request
+            try:
+                content_length = int(self.headers.get('Content-Length') or 0)
+            except ValueError:
+                self.send_error(400, 'Bad Content-Length')
+                return False
+            if content_length > self.server.max_body_size:  # the body is not read, the connection is closed
+                self.send_error(413, 'Request Entity Too Large')
+                self.close_connection = True
+                return False
+            self.body = self.rfile.read(content_length) if content_length > 0 else b''
+
+        # the request has been read, the time of its processing is not limited by `request_timeout`
+        self.server.unwatch_request(self.connection)
+        if time.time() > self.deadline:  # the connection was shut down while reading, the request is incomplete
+            self.close_connection = True
+            return False
         return ret
 
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+        self.handle_pending_requests()
+
+    def handle_pending_requests(self):
+        while not (self.close_connection or self.detached or self.handover) and self.request_pending():
+            self.handle_one_request()
+
+    def resume(self, lane, func):
+        """Processes the request handed over to the `lane` in its thread, and then the requests pipelined after it"""
+        self.lane = lane
+        try:
+            func(self)
+            self.wfile.flush()
+            self.handle_pending_requests()
+        except socket.error:
+            self.close_connection = True
+        self.finish()
+
     def handle_one_request(self):
+        # the whole request (request line, headers and body) must arrive within `request_timeout`,
+        # the timeout of the socket limits only the time of every single `recv()`
+        self.deadline = self.server.watch_request(self.connection)
         try:
             BaseHTTPRequestHandler.handle_one_request(self)
         except socket.error:
-            pass
+            self.close_connection = True
+        finally:
+            self.server.unwatch_request(self.connection)
 
-    def query(self, sql, *params, **kwargs):
-        if not kwargs.get('retry', False):
-            return self.server.query(sql, *params)
-        retry = Retry(delay=1, retry_exceptions=PostgresConnectionException)
-        return retry(self.server.query, sql, *params)
+    def request_pending(self):
+        """:returns: `!True` if the next request is already read into the buffer of `rfile` or available
+        on the socket, i.e. it was pipelined by the client. This check doesn't block."""
 
-    def get_postgresql_status(self, retry=False):
+        if not hasattr(self.rfile, 'peek'):  # python 2, socket._fileobject
+            return self.rfile._rbuf.tell() > 0
+        timeout = self.connection.gettimeout()
+        self.connection.settimeout(0)
         try:
-            row = self.query("""SELECT to_char(pg_postmaster_start_time(), 'YYYY-MM-DD HH24:MI:SS.MS TZ'),
-                                       pg_is_in_recovery(),
-                                       CASE WHEN pg_is_in_recovery()
-                                            THEN 0
-                                            ELSE pg_xlog_location_diff(pg_current_xlog_location(), '0/0')::bigint
-                                       END,
-                                       pg_xlog_location_diff(pg_last_xlog_receive_location(), '0/0')::bigint,
-                                       pg_xlog_location_diff(pg_last_xlog_replay_location(), '0/0')::bigint,
-                                       to_char(pg_last_xact_replay_timestamp(), 'YYYY-MM-DD HH24:MI:SS.MS TZ'),
-                                       pg_is_in_recovery() AND pg_is_xlog_replay_paused()""", retry=retry)[0]
-            return {
-                'state': self.server.patroni.postgresql.state,
-                'postmaster_start_time': row[0],
-                'role': 'replica' if row[1] else 'master',
-                'server_version': self.server.patroni.postgresql.server_version,
-                'xlog': ({
-                    'received_location': row[3],
-                    'replayed_location': row[4],
-                    'replayed_timestamp': row[5],
-                    'paused': row[6]} if row[1] else {
-                    'location': row[2]
-                })
-            }
-        except (psycopg2.Error, RetryFailedError, PostgresConnectionException):
-            state = self.server.patroni.postgresql.state
-            if state == 'running':
-                logger.exception('get_postgresql_status')
-                state = 'unknown'
-            return {'state': state}
+            return len(self.rfile.peek(1)) > 0
+        except (socket.error, ValueError):
+            return False
+        finally:
+            self.connection.settimeout(timeout)
+
+    def get_postgresql_status(self, retry=False):
+        return self.server.get_postgresql_status(retry)
 
     def get_tags(self):
         return {'tags': self.server.patroni.tags}
@@ -296,15 +510,54 @@ class RestApiHandler(BaseHTTPRequestHandler):
         logger.debug("API thread: %s - - [%s] %s", self.client_address[0], self.log_date_time_string(), fmt % args)
 
 
-class RestApiServer(ThreadingMixIn, HTTPServer, Thread):
+class RestApiServer(HTTPServer, Thread):
+
+    """All connections are multiplexed by the thread of the server with `poll()`. When a request arrives,
+    the connection is handed over to one of `workers` threads through the queue of `max_queued_requests`.
+    Idle connections don't occupy threads and the number of threads doesn't depend on the load: when the
+    queue is full new requests are rejected by closing their connections.
+
+    Workers answer health checks themselves, other requests are parsed by them and passed to the `RequestLane`
+    of their class: `status` (i.e. `GET /patroni`) or `control` (`POST /restart`, `/reinitialize`, `/failover`).
+    Lanes have their own threads, therefore health checks are never stuck behind slow requests.
+
+    After the response the worker gives a persistent connection back through `_idle` and wakes up `poll()`
+    by writing into the pipe. The connection is closed if it stays idle longer than `keepalive_timeout`
+    or after `keepalive_requests` requests. A worker reads the request for at most `request_timeout` seconds,
+    the connection of slow clients is shut down by the thread of the server."""
+
+    FETCH_TIMEOUT = 2  # seconds to wait for the status of other members
+    FETCH_WORKERS = 8  # threads fetching the status of other members, created with the first `GET /cluster`
+    LANES = {
+        'status': {'workers': 2, 'max_queued_requests': 8, 'queue_timeout': 5},
+        'control': {'workers': 1, 'max_queued_requests': 4, 'queue_timeout': 30}
+    }
 
     def __init__(self, patroni, config):
         self._auth_key = base64.b64encode(config['auth'].encode('utf-8')).decode('utf-8') if 'auth' in config else None
         host, port = config['listen'].split(':')
         HTTPServer.__init__(self, (host, int(port)), RestApiHandler)
-        Thread.__init__(self, target=self.serve_forever)
+        Thread.__init__(self)
         self._set_fd_cloexec(self.socket)
 
+        self._workers = config.get('workers', 4)
+        self._requests = Queue(config.get('max_queued_requests', 32))
+        self._request_timeout = config.get('request_timeout', 5)
+        self._keepalive_timeout = config.get('keepalive_timeout', 30)
+        self.keepalive_requests = config.get('keepalive_requests', 100)
+        self.max_body_size = config.get('max_body_size', 16384)
+        self.maximum_lag = config.get('maximum_lag')
+        self.maximum_replay_delay = config.get('maximum_replay_delay')
+        self._connections = {}  # fd -> tuple(socket, client_address, deadline, number of served requests)
+        self._idle = deque()  # connections given back by workers
+        self._reading = {}  # socket -> deadline, requests which are being read by workers
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        for fd in (self._wakeup_r, self._wakeup_w):
+            self._set_fd_cloexec(fd)
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._shutdown = False
+        self._is_shut_down = Event()
+
         protocol = 'http'
 
         # wrap socket with ssl if 'certfile' is defined in a config.yaml
@@ -312,7 +565,8 @@ class RestApiServer(ThreadingMixIn, HTTPServer, Thread):
         options = {option: config[option] for option in ['certfile', 'keyfile'] if option in config}
         if options.get('certfile'):
             import ssl
-            self.socket = ssl.wrap_socket(self.socket, server_side=True, **options)
+            # the handshake is done by a worker thread when reading the first request
+            self.socket = ssl.wrap_socket(self.socket, server_side=True, do_handshake_on_connect=False, **options)
             protocol = 'https'
 
         self.connection_string = '{0}://{1}/patroni'.format(protocol, config.get('connect_address', config['listen']))
@@ -320,16 +574,286 @@ class RestApiServer(ThreadingMixIn, HTTPServer, Thread):
         self.patroni = patroni
         self.daemon = True
 
-    def query(self, sql, *params):
-        cursor = None
+        interval = max(config.get('status_interval', 1), 0.1)
+        self.status = PostgresStatusSampler(self, interval, config.get('status_max_age', interval * 3))
+        self.events = EventStream()
+        # the status of members doesn't change faster than they publish it, i.e. once per HA cycle
+        loop_wait = patroni.nap_time
+        self.cluster_status = ClusterStatusCache(self.get_cluster_status,
+                                                 max(config.get('cluster_status_ttl', loop_wait), loop_wait))
+        self._fetch_pool = None
+        self._statement_timeout = int(config.get('statement_timeout', 2) * 1000)
+        self.connection_pool = ConnectionPool(self._connect, config.get('pool_size', 2))
+        lanes = config.get('lanes', {})
+        self.lanes = {name: RequestLane(name, **dict(defaults, **lanes.get(name, {})))
+                      for name, defaults in self.LANES.items()}
+
+    def start(self):
+        self.status.start()
+        self.events.start()
+        super(RestApiServer, self).start()
+
+    def run(self):
+        self.serve_forever()
+
+    def serve_forever(self, poll_interval=0.5):
+        for _ in range(self._workers):
+            thread = Thread(target=self._process_requests)
+            thread.daemon = True
+            thread.start()
+        for request_lane in self.lanes.values():
+            request_lane.start()
+
+        self._is_shut_down.clear()
+        poller = select.poll()
+        poller.register(self.socket, select.POLLIN)
+        poller.register(self._wakeup_r, select.POLLIN)
         try:
-            with self.patroni.postgresql.connection().cursor() as cursor:
-                cursor.execute(sql, params)
-                return [r for r in cursor]
-        except psycopg2.Error as e:
-            if cursor and cursor.connection.closed == 0:
-                raise e
-            raise PostgresConnectionException('connection problems')
+            while not self._shutdown:
+                for fd, _ in poller.poll(poll_interval * 1000):
+                    if fd == self.socket.fileno():
+                        self._accept(poller)
+                    elif fd == self._wakeup_r:
+                        self._register_idle(poller)
+                    elif fd in self._connections:
+                        self._dispatch(poller, fd)
+                self._close_idle(poller)
+        finally:
+            while self._idle:
+                self.shutdown_request(self._idle.popleft()[0])
+            for request, _, _, _ in self._connections.values():
+                self.shutdown_request(request)
+            self._connections.clear()
+            for _ in range(self._workers):
+                self._requests.put(None)
+            for request_lane in self.lanes.values():
+                request_lane.stop()
+            self._is_shut_down.set()
+
+    def shutdown(self):
+        self._shutdown = True
+        if self.is_alive():
+            self._is_shut_down.wait()
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.connection_pool.close()
+        if self._fetch_pool:
+            self._fetch_pool.close()
+        os.close(self._wakeup_r)
+        os.close(self._wakeup_w)
+
+    def _watch(self, poller, request, client_address, timeout, served):
+        self._connections[request.fileno()] = (request, client_address, time.time() + timeout, served)
+        poller.register(request, select.POLLIN)
+
+    def _accept(self, poller):
+        try:
+            request, client_address = self.get_request()
+        except socket.error:
+            return
+        self._watch(poller, request, client_address, self._request_timeout, 0)
+
+    def _register_idle(self, poller):
+        try:
+            os.read(self._wakeup_r, 4096)
+        except OSError:
+            pass
+        while self._idle:
+            request, client_address, served = self._idle.popleft()
+            self._watch(poller, request, client_address, self._keepalive_timeout, served)
+
+    def _dispatch(self, poller, fd):
+        """Request has arrived (or the connection was closed by the client), pass it to the workers"""
+        poller.unregister(fd)
+        request, client_address, _, served = self._connections.pop(fd)
+        try:
+            self._requests.put_nowait((request, client_address, served))
+        except Full:
+            logger.warning('API: too many requests, closing connection from %s', client_address[0])
+            self.shutdown_request(request)
+
+    def _close_idle(self, poller):
+        """Close connections, which didn't send the request in time"""
+        now = time.time()
+        for fd, (request, _, deadline, _) in list(self._connections.items()):
+            if deadline < now:
+                poller.unregister(fd)
+                del self._connections[fd]
+                self.shutdown_request(request)
+
+        # the worker is blocked in `recv()`, shutdown wakes it up and it closes the connection
+        for request, deadline in list(self._reading.items()):
+            if deadline < now and self._reading.pop(request, None):
+                try:
+                    request.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+
+    def watch_request(self, request):
+        """:returns: the time until which the worker must read the request from the `request` socket"""
+        deadline = self._reading[request] = time.time() + self._request_timeout
+        return deadline
+
+    def unwatch_request(self, request):
+        self._reading.pop(request, None)
+
+    def _keep_alive(self, request, client_address, served):
+        """Called by a worker, the connection will be watched by `poll()` again"""
+        self._idle.append((request, client_address, served))
+        try:
+            os.write(self._wakeup_w, b'x')
+        except OSError:  # the pipe is full, poll() will wake up anyway
+            pass
+
+    def finish_request(self, request, client_address, served=0):
+        return self.RequestHandlerClass(request, client_address, self, served)
+
+    def complete_request(self, handler):
+        """Called when the handler has returned: passes the request to the lane, keeps the connection alive
+        or closes it. If the lane is busy the request is rejected in the current thread."""
+
+        if handler.handover:
+            request_lane, func = handler.handover
+            handler.handover = None
+            if not request_lane.submit(handler, func):
+                handler.resume(handler.lane, request_lane.reject)
+                self.complete_request(handler)
+        elif handler.detached:
+            pass
+        elif not handler.close_connection and not self._shutdown:
+            self._keep_alive(handler.request, handler.client_address, handler.served)
+        else:
+            self.shutdown_request(handler.request)
+
+    def _process_requests(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                break
+            request, client_address, served = item
+            try:
+                request.settimeout(self._request_timeout)
+                self.complete_request(self.finish_request(request, client_address, served))
+                continue
+            except Exception:
+                self.handle_error(request, client_address)
+            self.shutdown_request(request)
+
+    def _query(self, sql, retry):
+        if not retry:
+            return self.query(sql)
+        return Retry(delay=1, retry_exceptions=PostgresConnectionException)(self.query, sql)
+
+    def get_postgresql_status(self, retry=False):
+        try:
+            row = self._query("""SELECT to_char(pg_postmaster_start_time(), 'YYYY-MM-DD HH24:MI:SS.MS TZ'),
+                                        pg_is_in_recovery(),
+                                        CASE WHEN pg_is_in_recovery()
+                                             THEN 0
+                                             ELSE pg_xlog_location_diff(pg_current_xlog_location(), '0/0')::bigint
+                                        END,
+                                        pg_xlog_location_diff(pg_last_xlog_receive_location(), '0/0')::bigint,
+                                        pg_xlog_location_diff(pg_last_xlog_replay_location(), '0/0')::bigint,
+                                        to_char(pg_last_xact_replay_timestamp(), 'YYYY-MM-DD HH24:MI:SS.MS TZ'),
+                                        pg_is_in_recovery() AND pg_is_xlog_replay_paused()""", retry)[0]
+            return {
+                'state': self.patroni.postgresql.state,
+                'postmaster_start_time': row[0],
+                'role': 'replica' if row[1] else 'master',
+                'server_version': self.patroni.postgresql.server_version,
+                'xlog': ({
+                    'received_location': row[3],
+                    'replayed_location': row[4],
+                    'replayed_timestamp': row[5],
+                    'paused': row[6]} if row[1] else {
+                    'location': row[2]
+                })
+            }
+        except (psycopg2.Error, RetryFailedError, PostgresConnectionException):
+            state = self.patroni.postgresql.state
+            if state == 'running':
+                logger.exception('get_postgresql_status')
+                state = 'unknown'
+            return {'state': state}
+
+    def get_status(self):
+        """:returns: status of Postgres together with tags, what is returned by health checks"""
+        status = self.get_postgresql_status()
+        status['tags'] = self.patroni.tags
+        return status
+
+    def fetch_member_status(self, member):
+        """:returns: the status of the member from its REST API or `!None` if it is not reachable"""
+        if member.name == self.patroni.postgresql.name:
+            return self.status.get()[0]
+        if member.api_url:
+            import requests  # see `Ha.fetch_node_status`
+
+            # the body of health checks is the status sampled in the background, the member doesn't run any SQL
+            # to answer it (unlike `GET /patroni`). The status code doesn't matter here.
+            url = urlparse(member.api_url)._replace(path='/read-only', query='').geturl()
+            try:
+                return requests.get(url, timeout=self.FETCH_TIMEOUT, verify=False).json()
+            except Exception:
+                logger.warning('API: can not fetch the status of %s from %s', member.name, member.api_url)
+
+    def get_cluster_status(self):
+        """Queries all members of the cluster known from the DCS snapshot in parallel, by at most `FETCH_WORKERS`
+        threads. `ClusterStatusCache` runs one fan-out at a time, therefore the pool is created without locking.
+
+        :returns: JSON with the leader, the failover key and the status of every member or `!None`
+            if DCS is not accessible"""
+
+        cluster = self.patroni.dcs.cluster
+        if not cluster:
+            return None
+        if not self._fetch_pool:
+            self._fetch_pool = ThreadPool(self.FETCH_WORKERS)
+        statuses = self._fetch_pool.map(self.fetch_member_status, cluster.members, 1)
+        return self.format_cluster_status(cluster, statuses)
+
+    def get_stale_cluster_status(self):
+        """Until the first successful read from DCS `GET /cluster` shows the state from the local snapshot
+        (see `ClusterSnapshot`), marked as stale. Members are not contacted and their reachability is unknown.
+
+        :returns: JSON or `!None` if the cluster has been read from DCS or there is no snapshot"""
+
+        dcs = self.patroni.dcs
+        if dcs.last_seen is None and dcs.cached_cluster:
+            return self.format_cluster_status(dcs.cached_cluster, None)
+
+    def format_cluster_status(self, cluster, statuses):
+        """:param statuses: list with the status of every member of `cluster` or `!None` if `cluster`
+            is the stale state from the local snapshot"""
+
+        leader = cluster.leader and cluster.leader.name
+        result = []
+        for member, status in zip(cluster.members, statuses or [None] * len(cluster.members)):
+            data = {'name': member.name, 'api_url': member.api_url, 'leader': member.name == leader,
+                    'reachable': None if statuses is None else status is not None, 'role': member.data.get('role'),
+                    'state': member.data.get('state'), 'tags': member.data.get('tags', {})}
+            if status:
+                data.update((k, status[k]) for k in ('role', 'state', 'xlog', 'tags') if k in status)
+                replayed = data.get('xlog', {}).get('replayed_location')
+                if data['role'] == 'replica' and replayed is not None and cluster.last_leader_operation:
+                    data['lag'] = max(cluster.last_leader_operation - replayed, 0)
+            result.append(data)
+
+        failover = cluster.failover
+        return json.dumps({
+            'scope': self.patroni.postgresql.scope, 'leader': leader, 'stale': statuses is None,
+            'last_leader_operation': cluster.last_leader_operation,
+            'failover': failover and {'leader': failover.leader, 'candidate': failover.candidate,
+                                      'scheduled_at': failover.scheduled_at and failover.scheduled_at.isoformat()},
+            'members': result}).encode('utf-8')
+
+    def _connect(self):
+        return self.patroni.postgresql.connect(application_name='Patroni REST API',
+                                               options='-c statement_timeout={0}'.format(self._statement_timeout))
+
+    def query(self, sql, *params):
+        return self.connection_pool.query(sql, *params)
 
     @staticmethod
     def _set_fd_cloexec(fd):
@@ -345,3 +869,273 @@ class RestApiServer(ThreadingMixIn, HTTPServer, Thread):
                 return 'no auth header received'
             if not auth_header.startswith('Basic ') or not self.check_basic_auth_key(auth_header[6:]):
                 return 'not authenticated'
+
+
+class PostgresStatusSampler(Thread):
+
+    """Queries the status of Postgres every `interval` seconds and keeps the last result in memory, together with
+    its JSON representation. Health checks (`GET /master`, `GET /replica`, `OPTIONS`) are served from it without
+    running any SQL. Requests never query Postgres themselves: if the snapshot is older than `max_age` seconds
+    (the sampler is stuck on a query) the state is `unknown`, so that health checks return 503."""
+
+    UNKNOWN = ({'state': 'unknown'}, json.dumps({'state': 'unknown'}).encode('utf-8'))
+
+    def __init__(self, server, interval, max_age):
+        super(PostgresStatusSampler, self).__init__()
+        self.daemon = True
+        self._server = server
+        self.interval = interval
+        self.max_age = max_age
+        self._snapshot = None  # tuple(time, status, JSON), replaced with a single assignment
+
+    def sample(self):
+        status = self._server.get_status()
+        self._snapshot = (time.time(), status, json.dumps(status).encode('utf-8'))
+        return self._snapshot
+
+    def get(self):
+        """:returns: tuple(status, JSON), neither of them may be modified"""
+        snapshot = self._snapshot
+        if not snapshot or time.time() - snapshot[0] > self.max_age:
+            return self.UNKNOWN
+        return snapshot[1:]
+
+    def run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception:
+                logger.exception('PostgresStatusSampler')
+            time.sleep(self.interval)
+
+
+class EventStream(Thread):
+
+    """Delivers Server-Sent Events to the clients of `GET /events`. The HA loop `publish`es the current value of
+    every kind of event after each cycle, this never blocks. The thread of the stream drops values which didn't
+    change and sends the rest to all subscribers. New subscribers receive the last value of every kind of event
+    first. A comment is sent to idle subscribers every `KEEPALIVE_INTERVAL` seconds, subscribers which can't
+    receive data within `SEND_TIMEOUT` seconds (i.e. they are gone) are disconnected."""
+
+    KEEPALIVE_INTERVAL = 15
+    SEND_TIMEOUT = 1
+
+    def __init__(self):
+        super(EventStream, self).__init__()
+        self.daemon = True
+        self._queue = Queue()
+        self._subscribers = []
+        self._last = {}  # event -> tuple(data, message)
+        self._id = 0
+
+    def publish(self, event, data):
+        """:param data: JSON-serializable object, the event is sent only if it differs from the previous one"""
+        self._queue.put((event, data))
+
+    def subscribe(self, request):
+        """Takes ownership over the connection, the response headers must be already sent"""
+        self._queue.put((None, request))
+
+    def _send(self, request, message):
+        try:
+            request.sendall(message)
+            return True
+        except (socket.error, ValueError):
+            logger.debug('API: events subscriber has gone')
+            try:
+                request.close()
+            except socket.error:
+                pass
+
+    def _broadcast(self, message):
+        self._subscribers = [s for s in self._subscribers if self._send(s, message)]
+
+    def _process(self, event, data):
+        if event is None:  # new subscriber
+            data.settimeout(self.SEND_TIMEOUT)
+            if self._send(data, b''.join(message for _, message in self._last.values()) or b': ok\n\n'):
+                self._subscribers.append(data)
+        elif event not in self._last or self._last[event][0] != data:
+            self._id += 1
+            message = 'id: {0}\nevent: {1}\ndata: {2}\n\n'.format(self._id, event, json.dumps(data))
+            self._last[event] = (data, message.encode('utf-8'))
+            self._broadcast(self._last[event][1])
+
+    def run(self):
+        while True:
+            try:
+                self._process(*self._queue.get(timeout=self.KEEPALIVE_INTERVAL))
+            except Empty:
+                self._broadcast(b': keepalive\n\n')
+
+
+class RequestLane(object):
+
+    """Processes requests of one class with its own `workers` threads. At most `max_queued_requests` requests wait
+    for a free thread, when the queue is full or the request has waited longer than `queue_timeout` seconds it is
+    answered with 503 and `Retry-After` header."""
+
+    def __init__(self, name, workers, max_queued_requests, queue_timeout):
+        self.name = name
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self._queue = Queue(max_queued_requests)
+
+    def start(self):
+        for _ in range(self.workers):
+            thread = Thread(target=self._process)
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        for _ in range(self.workers):
+            self._queue.put(None)
+
+    def submit(self, handler, func):
+        """:returns: `!False` if the queue is full"""
+        try:
+            self._queue.put_nowait((time.time(), handler, func))
+            return True
+        except Full:
+            logger.warning('API: too many %s requests, rejecting request from %s', self.name, handler.client_address[0])
+            return False
+
+    def reject(self, handler):
+        handler.write_response(503, 'Too many {0} requests'.format(self.name).encode('utf-8'),
+                               headers={'Retry-After': 1})
+
+    def _process(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            queued_at, handler, func = item
+            if time.time() - queued_at > self.queue_timeout:
+                logger.warning('API: %s request from %s has waited too long', self.name, handler.client_address[0])
+                func = self.reject
+            try:
+                handler.resume(self, func)
+                handler.server.complete_request(handler)
+            except Exception:
+                handler.server.handle_error(handler.request, handler.client_address)
+                handler.server.shutdown_request(handler.request)
+
+
+class ClusterStatusCache(object):
+
+    """Keeps the result of the last fan-out to members of the cluster (see `RestApiServer.get_cluster_status`)
+    for `ttl` seconds, what also limits the rate of fan-outs. Concurrent callers share one fan-out in flight:
+    the first of them executes it, the rest wait for its result."""
+
+    def __init__(self, fan_out, ttl):
+        self._fan_out = fan_out
+        self.ttl = ttl
+        self._lock = Lock()
+        self._result = None  # tuple(time, result)
+        self._in_flight = None  # `Event` which is set when the fan-out in flight finishes
+
+    def get(self):
+        with self._lock:
+            if self._result and time.time() - self._result[0] < self.ttl:
+                return self._result[1]
+            in_flight = self._in_flight
+            if not in_flight:
+                self._in_flight = Event()
+
+        if in_flight:
+            in_flight.wait()
+            return self._result and self._result[1]
+
+        try:
+            result = self._fan_out()
+            self._result = (time.time(), result)
+            return result
+        finally:
+            with self._lock:
+                in_flight, self._in_flight = self._in_flight, None
+            in_flight.set()
+
+
+class ConnectionPool(object):
+
+    """Connections to Postgres used only by the REST API, so that API requests never share the connection
+    (and its lock) with the HA loop. At most `size` connections are open at the same time, a query which can't
+    get one within `WAIT_TIMEOUT` seconds fails as if Postgres wasn't accessible.
+
+    Connections are checked before use and closed connections are replaced with new ones. If a query fails
+    because the connection which was idle in the pool is broken (i.e. Postgres has been restarted), all idle
+    connections are dropped and the query is repeated once on a new connection."""
+
+    WAIT_TIMEOUT = 5
+
+    def __init__(self, connect, size):
+        self._connect = connect
+        self.size = size
+        self._cond = Condition()
+        self._idle = deque()
+        self._open = 0  # number of connections in use and idle
+
+    def _checkout(self):
+        """:returns: tuple(connection, whether it was taken from the pool)"""
+        end_time = time.time() + self.WAIT_TIMEOUT
+        with self._cond:
+            while not self._idle and self._open >= self.size:
+                remaining = end_time - time.time()
+                if remaining <= 0:
+                    raise PostgresConnectionException('no free connection in the pool')
+                self._cond.wait(remaining)
+            conn = self._idle.pop() if self._idle else None
+            if not conn:
+                self._open += 1
+
+        if conn and conn.closed == 0:
+            return conn, True
+
+        try:
+            return self._connect(), False
+        except psycopg2.Error:
+            self._release(None)
+            raise PostgresConnectionException('connection problems')
+
+    def _release(self, conn):
+        """Gives the connection back to the pool, `None` means that the connection was closed"""
+        with self._cond:
+            if conn and conn.closed == 0:
+                self._idle.append(conn)
+            else:
+                self._open -= 1
+            self._cond.notify()
+
+    def _execute(self, conn, sql, params):
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, params)
+                return [r for r in cursor]
+        except psycopg2.Error as e:
+            if conn.closed == 0:
+                raise e
+            raise PostgresConnectionException('connection problems')
+        finally:
+            self._release(conn)
+
+    def query(self, sql, *params):
+        conn, reused = self._checkout()
+        try:
+            return self._execute(conn, sql, params)
+        except PostgresConnectionException:
+            if not reused:
+                raise
+        self.close()
+        return self._execute(self._checkout()[0], sql, params)
+
+    def close(self):
+        """Closes idle connections, connections in use are given back to the pool as usual"""
+        with self._cond:
+            idle, self._idle = self._idle, deque()
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
@@ -0,0 +1,241 @@
+from __future__ import absolute_import
+import base64
+import json
+import logging
+import requests
+import time
+
+from patroni.dcs import AbstractDCS, Cluster, Leader, Member
+from patroni.exceptions import DCSError
+from requests.exceptions import RequestException
+
+logger = logging.getLogger(__name__)
+
+
+class ConsulError(DCSError):
+    pass
+
+
+class ConsulInternalError(Exception):
+    """An internal error occured on the Consul server"""
+
+
+def catch_consul_errors(func):
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except (RequestException, ConsulInternalError):
+            logger.exception('%s', func.__name__)
+            return False
+    return wrapper
+
+
+class Consul(AbstractDCS):
+
+    """Consul implementation of `AbstractDCS`.
+
+    All keys of the cluster are read with a single recursive request. Member keys and the leader key
+    are acquired with the Consul session of this Patroni instance. The session has behavior `delete`
+    and lock-delay = 0, therefore when the session expires (Patroni is dead or can't renew it in time)
+    all keys held by it disappear and other members could immediately acquire the leader lock.
+
+    The session is renewed once per HA cycle, when the cluster is loaded. If it has expired, a new one is
+    created by the next write, but the leader lock is lost with the old session: `update_leader` succeeds
+    only if the leader key read in this cycle is held by the current session. It doesn't write the key,
+    because every write would wake up the `watch` of all replicas.
+
+    Replicas `watch` the leader key with a blocking query and react on its change immediately."""
+
+    def __init__(self, name, config):
+        super(Consul, self).__init__(name, config)
+        self._base_path = self._base_path.lstrip('/')  # consul keys don't start with '/'
+        self._base_url = 'http://{0}/v1/'.format(config.get('host', '127.0.0.1:8500'))
+        self.ttl = config.get('ttl', 30)
+        # Consul may invalidate the session only after 2 x TTL, minimal allowed TTL is 10s
+        self._session_ttl = max(10, self.ttl // 2)
+        self._timeout = 5
+        self._session = None
+        self._http = requests.Session()
+
+    @property
+    def endpoint(self):
+        return self._base_url
+
+    def _request(self, method, path, params=None, data=None, timeout=None):
+        response = self._http.request(method, self._base_url + path, params=params,
+                                      data=data, timeout=timeout or self._timeout)
+        self.metrics.add_bytes(len(data or ''), len(response.content))
+        if response.status_code >= 500:
+            raise ConsulInternalError('{0} {1}: {2} {3}'.format(method, path, response.status_code, response.text))
+        return response
+
+    def _kv_get(self, key, timeout=None, **params):
+        """:returns: tuple(X-Consul-Index, list of nodes). Values of nodes are decoded"""
+        response = self._request('GET', 'kv/' + key, params, timeout=timeout)
+        index = int(response.headers.get('X-Consul-Index', 0))
+        if response.status_code == 404:
+            return index, []
+        response.raise_for_status()
+        nodes = response.json()
+        for node in nodes:
+            node['Value'] = base64.b64decode(node['Value']).decode('utf-8') if node.get('Value') else ''
+        return index, nodes
+
+    def _kv_put(self, key, value, **params):
+        response = self._request('PUT', 'kv/' + key, params, value.encode('utf-8'))
+        response.raise_for_status()
+        return response.text.strip() == 'true'
+
+    def _kv_delete(self, key, **params):
+        response = self._request('DELETE', 'kv/' + key, params)
+        response.raise_for_status()
+        return response.text.strip() != 'false'
+
+    def create_session(self):
+        data = {'Name': self._name, 'TTL': '{0}s'.format(self._session_ttl), 'LockDelay': '0s', 'Behavior': 'delete'}
+        response = self._request('PUT', 'session/create', data=json.dumps(data))
+        response.raise_for_status()
+        self._session = response.json()['ID']
+        logger.info('Created new consul session %s', self._session)
+
+    def renew_session(self):
+        """:returns: `!True` if the session exists and has been renewed"""
+        if self._session:
+            if self._request('PUT', 'session/renew/' + self._session).status_code == 200:
+                return True
+            logger.warning('Consul session %s has expired', self._session)
+            self._session = None
+        return False
+
+    def ensure_session(self):
+        if not self._session:
+            self.create_session()
+
+    def _cluster_from_nodes(self, nodes, node_cache):
+        """:param nodes: dict key relative to the cluster root -> node"""
+
+        # get initialize flag
+        initialize = nodes.get(self._INITIALIZE)
+        initialize = initialize and initialize['Value']
+
+        # get last leader operation
+        last_leader_operation = nodes.get(self._LEADER_OPTIME)
+        last_leader_operation = int(last_leader_operation['Value']) if last_leader_operation else 0
+
+        # get list of members
+        statuses = {k[len(self._STATUS):]: n['Value'] for k, n in nodes.items()
+                    if k.startswith(self._STATUS) and k.count('/') == 1}
+        members = node_cache.members(((n['ModifyIndex'], k[len(self._MEMBERS):], n.get('Session'), n['Value'])
+                                      for k, n in nodes.items()
+                                      if k.startswith(self._MEMBERS) and k.count('/') == 1), statuses)
+
+        # get leader, the key is valid only if it is held by some session
+        leader = nodes.get(self._LEADER)
+        if leader and leader.get('Session') and leader['Value']:
+            leader = Leader(leader['ModifyIndex'], leader['Session'], Member(-1, leader['Value'], None, {}))
+        else:
+            leader = None
+
+        # failover key
+        failover = nodes.get(self._FAILOVER)
+        if failover:
+            failover = node_cache.failover(failover['ModifyIndex'], failover['Value'])
+
+        return Cluster(initialize, leader, last_leader_operation, members, failover)
+
+    def _load_cluster(self):
+        try:
+            self.renew_session()
+            path = self.client_path('')
+            self._cluster_index, result = self._kv_get(path, recurse=1)
+            nodes = {node['Key'][len(path):]: node for node in result}
+            self._cluster = self._cluster_from_nodes(nodes, self._node_cache)
+        except:
+            logger.exception('get_cluster')
+            raise ConsulError('Consul is not responding properly')
+
+    def _load_clusters(self, scopes):
+        try:
+            path = self._namespace.lstrip('/') + '/'
+            nodes = {scope: {} for scope in scopes}
+            for node in self._kv_get(path, recurse=1)[1]:
+                scope, _, key = node['Key'][len(path):].partition('/')
+                if scope in nodes:
+                    nodes[scope][key] = node
+            return {scope: self._cluster_from_nodes(n, self._get_node_cache(scope)) for scope, n in nodes.items()}
+        except:
+            logger.exception('get_clusters')
+            raise ConsulError('Consul is not responding properly')
+
+    @catch_consul_errors
+    def touch_member(self, connection_string, ttl=None):
+        self.ensure_session()
+        return self._kv_put(self.member_path, connection_string, acquire=self._session)
+
+    @catch_consul_errors
+    def touch_member_status(self, value):
+        self.ensure_session()
+        return self._kv_put(self.status_path, value, acquire=self._session)
+
+    @catch_consul_errors
+    def attempt_to_acquire_leader(self):
+        self.ensure_session()
+        ret = self._kv_put(self.leader_path, self._name, acquire=self._session)
+        if not ret:
+            logger.info('Could not take out TTL lock')
+        return ret
+
+    def take_leader(self):
+        return self.attempt_to_acquire_leader()
+
+    @catch_consul_errors
+    def set_failover_value(self, value, index=None):
+        return self._kv_put(self.failover_path, value, **({'cas': index} if index else {}))
+
+    @catch_consul_errors
+    def write_leader_optime(self, last_operation):
+        return self._kv_put(self.leader_optime_path, last_operation)
+
+    def update_leader(self):
+        # the session has been renewed by `_load_cluster`. It might have been replaced after expiration,
+        # the lock was released together with the old one
+        leader = self.cluster and self.cluster.leader
+        return bool(self._session and leader and leader.name == self._name and leader.session == self._session)
+
+    @catch_consul_errors
+    def initialize(self, create_new=True, sysid=''):
+        return self._kv_put(self.initialize_path, sysid, **({'cas': 0} if create_new else {}))
+
+    @catch_consul_errors
+    def delete_leader(self):
+        return bool(self._session) and self._kv_put(self.leader_path, self._name, release=self._session)
+
+    @catch_consul_errors
+    def cancel_initialization(self):
+        return self._kv_delete(self.initialize_path)
+
+    @catch_consul_errors
+    def delete_cluster(self):
+        return self._kv_delete(self.client_path(''), recurse=1)
+
+    def watch(self, timeout):
+        cluster = self.cluster
+        # watch on leader key changes if it is defined and current node is not lock owner
+        if cluster and cluster.leader and cluster.leader.name != self._name and timeout >= 1:
+            end_time = time.time() + timeout
+            index = cluster.leader.index
+            try:
+                # Consul adds a random jitter up to wait / 16 to the wait time of blocking queries
+                new_index, _ = self._kv_get(self.leader_path, index=index, wait='{0}ms'.format(int(timeout * 1000)),
+                                            timeout=timeout * 1.1 + 1)
+                if new_index != index:
+                    return True
+            except (RequestException, ConsulInternalError):
+                logger.exception('watch')
+
+            timeout = end_time - time.time()
+
+        try:
+            return super(Consul, self).watch(max(timeout, 0))
+        finally:
+            self.event.clear()
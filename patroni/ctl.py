@@ -9,7 +9,6 @@ import json
 import time
 import psycopg2
 import random
-import requests
 import datetime
 from prettytable import PrettyTable
 from six.moves.urllib_parse import urlparse
@@ -17,8 +16,7 @@ import logging
 import dateutil
 import tzlocal
 
-from .etcd import Etcd
-from .zookeeper import ZooKeeper
+from .dcs import ClusterSnapshot, get_dcs_class
 from .exceptions import PatroniCtlException
 from .postgresql import parseurl
 
@@ -103,19 +101,24 @@ def ctl(ctx):
 def get_dcs(config, scope):
     scheme, hostname, port = map(config.get('dcs', {}).get, ('scheme', 'hostname', 'port'))
 
-    if scheme == 'etcd':
-        return Etcd(name=scope, config={'scope': scope, 'host': '{0}:{1}'.format(hostname, port)})
-
     if scheme == 'zookeeper':
-        return ZooKeeper(name=scope, config={'scope': scope, 'hosts': [hostname], 'port': port})
+        dcs_config = {'hosts': [hostname], 'port': port}
+    elif scheme == 'exhibitor':
+        scheme, dcs_config = 'zookeeper', {'exhibitor': {'hosts': [hostname], 'port': port}}
+    else:  # etcd and all other implementations are configured with host:port
+        dcs_config = {'host': '{0}:{1}'.format(hostname, port)}
 
-    if scheme == 'exhibitor':
-        return ZooKeeper(name=scope, config={'scope': scope, 'exhibitor': {'hosts': [hostname], 'port': port}})
+    dcs_class = scheme and get_dcs_class(scheme)
+    if not dcs_class:
+        raise PatroniCtlException('Can not find suitable configuration of distributed configuration store')
 
-    raise PatroniCtlException('Can not find suitable configuration of distributed configuration store')
+    dcs_config['scope'] = scope
+    return dcs_class(scope, dcs_config)
 
 
 def post_patroni(member, endpoint, content, headers=None):
+    import requests  # see `Ha.fetch_node_status`
+
     url = urlparse(member.api_url)
     logging.debug(url)
     return requests.post('{0}://{1}/{2}'.format(url.scheme, url.netloc, endpoint),
@@ -202,10 +205,11 @@ def get_all_members(cluster, role='master'):
 
 
 def get_any_member(cluster, role='master', member=None):
-    members = get_all_members(cluster=cluster, role=role)
-    for m in members:
-        if member is None or m.name == member:
-            return m
+    if member is not None:
+        return cluster.get_member(member)
+
+    for m in get_all_members(cluster=cluster, role=role):
+        return m
 
     return None
 
@@ -398,16 +402,12 @@ def wait_for_leader(dcs, timeout=30):
 
 
 def empty_post_to_members(cluster, member_names, force, endpoint):
-    candidates = dict()
-    for m in cluster.members:
-        candidates[m.name] = m
-
     if not member_names:
         member_names = [click.prompt('Which member do you want to {0} [{1}]?'.format(endpoint,
-                        ', '.join(candidates.keys())), type=str, default='')]
+                        ', '.join(m.name for m in cluster.members)), type=str, default='')]
 
     for mn in member_names:
-        if mn not in candidates.keys():
+        if not cluster.has_member(mn):
             raise PatroniCtlException('{0} is not a member of cluster'.format(mn))
 
     if not force:
@@ -416,7 +416,7 @@ def empty_post_to_members(cluster, member_names, force, endpoint):
             raise PatroniCtlException('Aborted {0}'.format(endpoint))
 
     for mn in member_names:
-        r = post_patroni(candidates[mn], endpoint, '')
+        r = post_patroni(cluster.get_member(mn), endpoint, '')
         if r.status_code != 200:
             click.echo('{0} failed for member {1}, status code={2}, ({3})'.format(endpoint, mn, r.status_code, r.text))
         else:
@@ -614,6 +614,16 @@ def output_members(cluster, name=None, fmt='pretty'):
     print_output(columns, rows, alignment, fmt)
 
 
+def load_cached_cluster(config, scope):
+    snapshot = ClusterSnapshot.from_config(config, scope)
+    if not snapshot:
+        raise PatroniCtlException('snapshot_dir is not defined in the configuration file')
+    cluster = snapshot.load()[1]
+    if not cluster:
+        logging.warning('Cluster snapshot %s is not available, reading from DCS', snapshot.path)
+    return cluster
+
+
 @ctl.command('list', help='List the Patroni members for a given Patroni')
 @click.argument('cluster_names', nargs=-1)
 @option_config_file
@@ -621,17 +631,29 @@ def output_members(cluster, name=None, fmt='pretty'):
 @option_watch
 @option_watchrefresh
 @option_dcs
-def members(config_file, cluster_names, fmt, watch, w, dcs):
+@click.option('--cached', is_flag=True, help='Use the local snapshot of the cluster state instead of reading from DCS')
+def members(config_file, cluster_names, fmt, watch, w, dcs, cached):
     if not cluster_names:
         logging.warning('Listing members: No cluster names were provided')
         return
 
     config = load_config(config_file, dcs)
-    for cn in cluster_names:
-        dcs = get_dcs(config, cn)
-
-        for _ in watching(w, watch):
-            output_members(dcs.get_cluster(), name=cn, fmt=fmt)
+    dcs = None
+    # snapshots are used only for the first output, all subsequent refreshes are reading from DCS
+    clusters = {cn: load_cached_cluster(config, cn) for cn in cluster_names} if cached else {}
+
+    for _ in watching(w, watch):
+        missing = [cn for cn in cluster_names if not clusters.get(cn)]
+        if missing:
+            # all clusters are read over one connection, usually with a single request
+            dcs = dcs or get_dcs(config, missing[0])
+            try:
+                clusters.update(dcs.get_clusters(missing))
+            except NotImplementedError:  # DCS implementation doesn't support it, read clusters one by one
+                clusters.update((cn, get_dcs(config, cn).get_cluster()) for cn in missing)
+        for cn in cluster_names:
+            output_members(clusters[cn], name=cn, fmt=fmt)
+        clusters = {}
 
 
 def timestamp(precision=6):
@@ -1,11 +1,80 @@
 import abc
-import dateutil
+import dateutil.parser
+import functools
+import importlib
 import json
+import logging
+import os
 import six
+import tempfile
+import time
 
 from collections import namedtuple
+from patroni.metrics import OperationMetrics
 from six.moves.urllib_parse import urlparse, urlunparse, parse_qsl
-from threading import Event, Lock
+from threading import Condition, Event, Lock
+
+logger = logging.getLogger(__name__)
+
+
+DCS_ENTRY_POINT_GROUP = 'patroni.dcs'
+
+# Built-in implementations, in the order of preference. Modules are imported only when they are actually needed,
+# because each of them pulls a lot of dependencies (python-etcd, urllib3, dnspython, kazoo, etc...)
+DCS_IMPLEMENTATIONS = [
+    ('etcd', 'patroni.etcd', 'Etcd'),
+    ('zookeeper', 'patroni.zookeeper', 'ZooKeeper'),
+    ('consul', 'patroni.consul', 'Consul'),
+    ('sqlite', 'patroni.sqlite', 'SQLite'),
+]
+
+
+def _iter_dcs_entry_points():
+    """Third-party implementations could be registered via `patroni.dcs` entry point group,
+    where the name of the entry point is the name of configuration section, i.e.:
+        entry_points={'patroni.dcs': ['mydcs = mypackage.mydcs:MyDCS']}"""
+    try:
+        import pkg_resources
+    except ImportError:
+        return []
+    return pkg_resources.iter_entry_points(DCS_ENTRY_POINT_GROUP)
+
+
+def get_dcs_class(key):
+    """:returns: class implementing `AbstractDCS` for configuration section `key` or `!None`"""
+
+    for name, module, cls in DCS_IMPLEMENTATIONS:
+        if name == key:
+            return getattr(importlib.import_module(module), cls)
+
+    for entry_point in _iter_dcs_entry_points():
+        if entry_point.name == key:
+            return entry_point.load()
+
+
+def _get_dcs_config(config, key):
+    """:returns: the section `key` of `config` with the options which are shared with `patronictl` and
+    therefore are defined at the top level of the configuration"""
+    return dict(config[key], snapshot_dir=config.get('snapshot_dir'))
+
+
+def get_dcs(name, config):
+    """Instantiate the DCS implementation which has its section in `config`.
+
+    Only the module of selected implementation is imported.
+
+    :param name: name of current instance
+    :param config: dict with configuration, i.e. `{'etcd': {'scope': 'foo', ...}, 'postgresql': ...}`"""
+
+    for key, _, _ in DCS_IMPLEMENTATIONS:
+        if key in config:
+            return get_dcs_class(key)(name, _get_dcs_config(config, key))
+
+    for entry_point in _iter_dcs_entry_points():
+        if entry_point.name in config:
+            return entry_point.load()(name, _get_dcs_config(config, entry_point.name))
+
+    raise Exception('Can not find suitable configuration of distributed configuration store')
 
 
 def parse_connection_string(value):
@@ -38,13 +107,44 @@ class Member(namedtuple('Member', 'index,name,session,data')):
     conn_url: connection string containing host, user and password which could be used to access this member.
     api_url: REST API url of patroni instance"""
 
+    # Frequently changing fields. With `compact_member_data` they are stored in the `/status/<name>` key
+    # in the compact form produced by `encode_status`, and the member key contains only the rest.
+    STATUS_FIELDS = ('state', 'role', 'xlog_location')
+    STATUS_VERSION = 1
+
+    @staticmethod
+    def encode_status(data):
+        """
+        >>> Member.encode_status({'conn_url': '', 'state': 'running', 'role': 'master', 'xlog_location': 1})
+        '[1,"running","master",1]'
+        """
+        return json.dumps([Member.STATUS_VERSION] + [data.get(f) for f in Member.STATUS_FIELDS], separators=(',', ':'))
+
     @staticmethod
-    def from_node(index, name, session, data):
+    def decode_status(value):
+        """
+        >>> Member.decode_status('[1,"running","master",null]') == {'state': 'running', 'role': 'master'}
+        True
+        >>> Member.decode_status('[2,"running"]'), Member.decode_status('{')
+        ({}, {})
+        """
+        try:
+            value = json.loads(value)
+            if isinstance(value, list) and value and value[0] == Member.STATUS_VERSION:
+                return {k: v for k, v in zip(Member.STATUS_FIELDS, value[1:]) if v is not None}
+        except (TypeError, ValueError):
+            pass
+        return {}
+
+    @staticmethod
+    def from_node(index, name, session, data, status=None):
         """
         >>> Member.from_node(-1, '', '', '{"conn_url": "postgres://foo@bar/postgres"}') is not None
         True
         >>> Member.from_node(-1, '', '', '{')
         Member(index=-1, name='', session='', data={})
+        >>> Member.from_node(-1, '', '', '{"conn_url": ""}', '[1,null,"replica",2]').data['role']
+        'replica'
         """
         if data.startswith('postgres'):
             conn_url, api_url = parse_connection_string(data)
@@ -54,6 +154,8 @@ class Member(namedtuple('Member', 'index,name,session,data')):
                 data = json.loads(data)
             except (TypeError, ValueError):
                 data = {}
+        if status:
+            data.update(Member.decode_status(status))
         return Member(index, name, session, data)
 
     @property
@@ -130,34 +232,305 @@ class Failover(namedtuple('Failover', 'index,leader,candidate,scheduled_at')):
         return Failover(index, data.get('leader'), data.get('member'), data.get('scheduled_at'))
 
 
+class NodeCache(object):
+
+    """Cache of already parsed `Member` and `Failover` objects.
+
+    Parsing of member and failover values (json, urlparse, dateutil) is relatively expensive and in a steady
+    state the values in DCS are not changing between HA cycles. Objects are immutable, therefore it is safe
+    to return the same instance as long as modification index and raw value of the node are the same.
+
+    >>> cache = NodeCache()
+    >>> m = cache.members([(1, 'foo', 30, '{"conn_url": "postgres://foo@bar/postgres"}')])[0]
+    >>> cache.members([(1, 'foo', 30, '{"conn_url": "postgres://foo@bar/postgres"}')])[0] is m
+    True
+    >>> cache.members([(1, 'foo', 29, '{"conn_url": "postgres://foo@bar/postgres"}')])[0].data is m.data
+    True
+    >>> cache.members([(2, 'foo', 29, '{}')])[0].data
+    {}
+    >>> cache.members([])
+    []
+    >>> len(cache)
+    0
+    >>> f = cache.failover(1, '{"leader": "foo", "scheduled_at": "2016-01-14T10:09:57.1394Z"}')
+    >>> cache.failover(1, '{"leader": "foo", "scheduled_at": "2016-01-14T10:09:57.1394Z"}') is f
+    True
+    >>> cache.failover(2, None) is None
+    True
+    """
+
+    def __init__(self):
+        self._members = {}
+        self._failover = (None, None, None)
+
+    def __len__(self):
+        return len(self._members)
+
+    def member(self, index, name, session, value, status=None):
+        cached = self._members.get(name)
+        if cached and cached[0] == value and cached[1] == status and cached[2].index == index:
+            member = cached[2]
+            if member.session != session:  # etcd reports remaining ttl as a session
+                member = member._replace(session=session)
+                self._members[name] = (value, status, member)
+            return member
+
+        member = Member.from_node(index, name, session, value, status)
+        self._members[name] = (value, status, member)
+        return member
+
+    def members(self, nodes, statuses=None):
+        """Build list of `Member` objects and evict cache entries for members which have disappeared
+
+        :param nodes: iterable of (index, name, session, value) tuples
+        :param statuses: dict, name -> value of the `/status/<name>` key"""
+
+        statuses = statuses or {}
+        members = [self.member(*node, status=statuses.get(node[1])) for node in nodes]
+        if len(members) != len(self._members):
+            names = set(m.name for m in members)
+            self._members = {n: v for n, v in self._members.items() if n in names}
+        return members
+
+    def failover(self, index, value):
+        if self._failover[0] != index or self._failover[1] != value:
+            self._failover = (index, value, Failover.from_node(index, value))
+        return self._failover[2]
+
+
 class Cluster(namedtuple('Cluster', 'initialize,leader,last_leader_operation,members,failover')):
 
     """Immutable object (namedtuple) which represents PostgreSQL cluster.
     Consists of the following fields:
     :param initialize: boolean, shows whether this cluster has initialization key stored in DC or not.
-    :param leader: `Leader` object which represents current leader of the cluster
+    :param leader: `Leader` object which represents current leader of the cluster.
+        If the `Leader.member` is not one of `members` (i.e. just a placeholder built from the leader key value)
+        it will be replaced with the member which has the same name.
     :param last_leader_operation: int or long object containing position of last known leader operation.
         This value is stored in `/optime/leader` key
     :param members: list of Member object, all PostgreSQL cluster members including leader
-    :param failover: reference to `Failover` object"""
+    :param failover: reference to `Failover` object
+
+    Since the object is immutable, the index of members is built only once, when the object is created.
+
+    >>> m1 = Member(1, 'm1', None, {'api_url': 'http://m1', 'tags': {'nofailover': True}})
+    >>> m2 = Member(2, 'm2', None, {'api_url': 'http://m2', 'tags': {'replicatefrom': 'm1'}})
+    >>> cluster = Cluster(True, Leader(3, None, Member(-1, 'm1', None, {})), 0, [m1, m2], None)
+    >>> cluster.leader.member is m1
+    True
+    >>> cluster.has_member('m2'), cluster.has_member('m3')
+    (True, False)
+    >>> cluster.replicas_of('m1') == [m2]
+    True
+    >>> cluster.failover_candidates == [m2]
+    True
+    """
+
+    def __new__(cls, initialize, leader, last_leader_operation, members, failover):
+        members_index = {m.name: m for m in members}
+        if leader:
+            member = members_index.get(leader.name)
+            if member is not None and member is not leader.member:
+                leader = Leader(leader.index, leader.session, member)
+
+        self = super(Cluster, cls).__new__(cls, initialize, leader, last_leader_operation, members, failover)
+
+        self._members_index = members_index
+        self._replicas_of = {}
+        for m in members:
+            if m.replicatefrom:
+                self._replicas_of.setdefault(m.replicatefrom, []).append(m)
+        self._failover_candidates = [m for m in members if not m.nofailover and m.api_url]
+        return self
 
     def is_unlocked(self):
         return not (self.leader and self.leader.name)
 
     def has_member(self, member_name):
-        return any(m for m in self.members if m.name == member_name)
+        return member_name in self._members_index
 
     def get_member(self, member_name):
-        return ([m for m in self.members if m.name == member_name] or [None])[0]
+        return self._members_index.get(member_name)
+
+    def replicas_of(self, member_name):
+        """:returns: list of members which have `replicatefrom` tag set to `member_name`"""
+        return self._replicas_of.get(member_name, [])
+
+    @property
+    def failover_candidates(self):
+        """list of members which are allowed to be promoted and have REST API url"""
+        return self._failover_candidates
+
+
+class ClusterSnapshot(object):
+
+    """Local on-disk copy of the last known `Cluster` state.
+
+    The snapshot is used by `patronictl` and, until the first successful read from DCS, by `GET /cluster` in order
+    to show the cluster topology without accessing DCS. It could be days old, therefore it is never used for
+    health checks or HA decisions.
+
+    Cluster is stored as a compact json array together with the DCS index it has been read at and the identity
+    of its source: the name of the DCS implementation and the system identifier of the cluster.
+    Sessions are not stored, they are meaningless after the restart of Patroni.
+    The file is written atomically (temporary file + rename) and only if the index or the content has changed.
+    If the index of the cluster is slightly smaller than the index of already stored snapshot we assume that
+    the value has been read from lagging DCS node and don't overwrite newer snapshot with it. If the identity
+    has changed or the index dropped by more than `MAX_INDEX_LAG` the DCS has been restored from a backup or
+    replaced, the old snapshot is meaningless and is overwritten."""
+
+    VERSION = 1
+    MAX_INDEX_LAG = 1000
+
+    def __init__(self, path, backend=None):
+        self._path = path
+        self._backend = backend
+        self._identity = None
+        self._index = None
+        self._data = None
+        self._skipped_index = None  # the index of the last skipped older state, it is reported only once
+        self._lock = Lock()
+
+    @classmethod
+    def from_config(cls, config, scope, backend=None):
+        """:returns: `ClusterSnapshot` object if `snapshot_dir` is defined in `config` otherwise `!None`"""
+        snapshot_dir = config.get('snapshot_dir')
+        return cls(os.path.join(snapshot_dir, scope + '.json'), backend) if snapshot_dir else None
+
+    @property
+    def path(self):
+        return self._path
 
+    @staticmethod
+    def serialize(cluster):
+        """
+        >>> m = Member(5, 'foo', 28, {'conn_url': 'postgres://foo@bar/postgres'})
+        >>> ClusterSnapshot.serialize(Cluster('1', Leader(6, 28, m), 10, [m], Failover(7, 'foo', 'bar', None)))
+        ['1', [6, 'foo'], 10, [[5, 'foo', {'conn_url': 'postgres://foo@bar/postgres'}]], [7, 'foo', 'bar', None]]
+        """
+        leader = cluster.leader and [cluster.leader.index, cluster.leader.name]
+        members = [[m.index, m.name, m.data] for m in cluster.members]
+        failover = cluster.failover
+        if failover:
+            scheduled_at = failover.scheduled_at and failover.scheduled_at.isoformat()
+            failover = [failover.index, failover.leader, failover.candidate, scheduled_at]
+        return [cluster.initialize, leader, cluster.last_leader_operation, members, failover]
 
-@six.add_metaclass(abc.ABCMeta)
+    @staticmethod
+    def deserialize(value):
+        """
+        >>> f = [7, None, 'foo', '2016-01-14T10:09:57+00:00']
+        >>> c = ClusterSnapshot.deserialize(['1', [6, 'foo'], 10, [[5, 'foo', {}]], f])
+        >>> c.leader.member is c.members[0], c.failover.scheduled_at.year
+        (True, 2016)
+        """
+        initialize, leader, last_leader_operation, members, failover = value
+        members = [Member(index, name, None, data) for index, name, data in members]
+        if leader:
+            leader = Leader(leader[0], None, Member(-1, leader[1], None, {}))
+        if failover:
+            scheduled_at = failover[3] and dateutil.parser.parse(failover[3])
+            failover = Failover(failover[0], failover[1], failover[2], scheduled_at)
+        return Cluster(initialize, leader, last_leader_operation, members, failover)
+
+    def load(self):
+        """:returns: tuple(index, `Cluster`) or (`!None`, `!None`) if the snapshot doesn't exist or corrupted"""
+        try:
+            with open(self._path, 'r') as f:
+                data = f.read()
+            snapshot = json.loads(data)
+            if snapshot.get('version') != self.VERSION:
+                logger.warning('Ignoring snapshot %s with unsupported version', self._path)
+                return None, None
+            cluster = self.deserialize(snapshot['cluster'])
+            self._identity, self._index, self._data = snapshot.get('identity'), snapshot.get('index'), data
+            return self._index, cluster
+        except (IOError, OSError):
+            pass
+        except Exception:
+            logger.exception('Failed to load cluster snapshot from %s', self._path)
+        return None, None
+
+    def save(self, index, cluster):
+        """Atomically write `cluster` into the snapshot file
+
+        :returns: `!True` if the file has been written"""
+
+        with self._lock:
+            return self._save(index, cluster)
+
+    def _save(self, index, cluster):
+        identity = [self._backend, cluster.initialize]
+        if index is not None and self._index is not None and identity == self._identity:
+            if index == self._index:
+                return False
+            if self._index - self.MAX_INDEX_LAG <= index < self._index:
+                if self._skipped_index != self._index:
+                    logger.warning('Not overwriting cluster snapshot with index %s by an older state with index %s',
+                                   self._index, index)
+                    self._skipped_index = self._index
+                return False
+
+        data = json.dumps({'version': self.VERSION, 'identity': identity, 'index': index,
+                           'cluster': self.serialize(cluster)}, separators=(',', ':'))
+        if data == self._data:
+            return False
+
+        tmpfile = None
+        try:
+            fd, tmpfile = tempfile.mkstemp(prefix='.' + os.path.basename(self._path), dir=os.path.dirname(self._path))
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmpfile, self._path)
+            tmpfile = None
+            self._identity, self._index, self._data = identity, index, data
+            return True
+        except (IOError, OSError):
+            logger.exception('Failed to write cluster snapshot into %s', self._path)
+        finally:
+            if tmpfile:
+                try:
+                    os.unlink(tmpfile)
+                except OSError:
+                    pass
+        return False
+
+
+# Methods of `AbstractDCS` measured in `AbstractDCS.metrics`
+DCS_OPERATIONS = ('get_cluster', 'get_clusters', 'touch_member', 'touch_member_status', 'update_leader',
+                  'attempt_to_acquire_leader', 'take_leader', 'write_leader_optime', 'set_failover_value', 'initialize',
+                  'delete_leader', 'cancel_initialization', 'delete_cluster', 'watch')
+
+
+def _measured(operation, func):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        return self.metrics.measure(operation, func, self, *args, **kwargs)
+    return wrapper
+
+
+class _MeasuredMeta(abc.ABCMeta):
+
+    """Wraps `DCS_OPERATIONS` defined by any `AbstractDCS` subclass, including third-party ones,
+    with `OperationMetrics.measure`, so the implementations don't have to care about it."""
+
+    def __new__(mcs, name, bases, namespace):
+        for operation in DCS_OPERATIONS:
+            if callable(namespace.get(operation)):
+                namespace[operation] = _measured(operation, namespace[operation])
+        return super(_MeasuredMeta, mcs).__new__(mcs, name, bases, namespace)
+
+
+@six.add_metaclass(_MeasuredMeta)
 class AbstractDCS(object):
 
     _INITIALIZE = 'initialize'
     _LEADER = 'leader'
     _FAILOVER = 'failover'
     _MEMBERS = 'members/'
+    _STATUS = 'status/'
     _OPTIME = 'optime'
     _LEADER_OPTIME = _OPTIME + '/' + _LEADER
 
@@ -165,19 +538,55 @@ class AbstractDCS(object):
         """
         :param name: name of current instance (the same value as `~Postgresql.name`)
         :param config: dict, reference to config section of selected DCS.
-            i.e.: `zookeeper` for zookeeper, `etcd` for etcd, etc...
+            i.e.: `zookeeper` for zookeeper, `etcd` for etcd, etc... `get_dcs` adds `snapshot_dir` to it.
         """
         self._name = name
         self._namespace = '/{0}'.format(config.get('namespace', '/service/').strip('/'))
-        self._base_path = '/'.join([self._namespace, config['scope']])
+        self._scope = config['scope']
+        self._base_path = '/'.join([self._namespace, self._scope])
+
+        self._compact_member_data = config.get('compact_member_data', False)
+        if self._compact_member_data and six.get_unbound_function(type(self).touch_member_status) is \
+                six.get_unbound_function(AbstractDCS.touch_member_status):
+            logger.warning('%s does not support compact_member_data, writing the whole member key instead',
+                           type(self).__name__)
+            self._compact_member_data = False
+        self._static_member_data = None
+        self._static_member_written_at = 0
+        # the member key is refreshed by the HA loop, which checks it once per `loop_wait`. With the refresh after
+        # ttl/3 it is rewritten at least twice within ttl as long as `loop_wait` doesn't exceed ttl/2.
+        self._static_member_refresh = (config.get('ttl') or 30) / 3.0
 
         self._cluster = None
+        self._cluster_index = None
         self._cluster_thread_lock = Lock()
+        self._cluster_changed = Condition()
+        self._node_cache = NodeCache()
+        self._scope_node_caches = {}
         self.event = Event()
+        self.metrics = OperationMetrics()
+        self.last_seen = None  # time of the last successful `get_cluster()`
+
+        # the last known state from the local snapshot, served by `GET /cluster` as stale. Never becomes `cluster`
+        self.cached_cluster = None
+        self._snapshot = ClusterSnapshot.from_config(config, config['scope'], type(self).__name__.lower())
+        if self._snapshot:
+            index, self.cached_cluster = self._snapshot.load()
+            if self.cached_cluster:
+                logger.info('Loaded cluster state from snapshot %s (index %s)', self._snapshot.path, index)
 
     def client_path(self, path):
         return '/'.join([self._base_path, path.lstrip('/')])
 
+    @property
+    def endpoint(self):
+        """Address of the DCS server currently used by this instance, if known"""
+
+    def get_metrics(self):
+        """:returns: dict with the endpoint and metrics of every operation executed so far"""
+        return {'backend': type(self).__name__.lower(), 'endpoint': self.endpoint,
+                'last_seen': self.last_seen, 'operations': self.metrics.snapshot()}
+
     @property
     def initialize_path(self):
         return self.client_path(self._INITIALIZE)
@@ -190,6 +599,14 @@ class AbstractDCS(object):
     def member_path(self):
         return self.client_path(self._MEMBERS + self._name)
 
+    @property
+    def statuses_path(self):
+        return self.client_path(self._STATUS)
+
+    @property
+    def status_path(self):
+        return self.client_path(self._STATUS + self._name)
+
     @property
     def leader_path(self):
         return self.client_path(self._LEADER)
@@ -208,27 +625,84 @@ class AbstractDCS(object):
            represents current state and topology of the cluster in DCS.
            this method supposed to be called only by `get_cluster` method.
 
+           The new object must be published by a single assignment to `self._cluster`,
+           because other threads are reading `self._cluster` without any locks.
+           If DCS provides some kind of global modification index, it should be stored
+           in `self._cluster_index`. It is written into the local snapshot of the cluster.
+
            raise `~DCSError` in case of communication or other problems with DCS.
            If the current node was running as a master and exception raised,
            instance would be demoted."""
 
     def get_cluster(self):
+        """Load the current state of the cluster from DCS and publish it as a new snapshot.
+
+        The lock only serializes concurrent loads, readers of the `cluster` property never take it."""
+
         with self._cluster_thread_lock:
             try:
                 self._load_cluster()
             except:
                 self._cluster = None
                 raise
+            finally:  # wake up `wait_for_cluster_change()`
+                with self._cluster_changed:
+                    self._cluster_changed.notify_all()
+            self.last_seen = time.time()
+            cluster, index = self._cluster, self._cluster_index
+
+        # writing of the file must not hold up concurrent loads
+        if self._snapshot:
+            self._snapshot.save(index, cluster)
+        return cluster
+
+    def wait_for_cluster_change(self, cluster, timeout):
+        """Waits until `get_cluster()` publishes a snapshot which is not `cluster` or `timeout` expires.
+
+        :returns: the current snapshot of the cluster"""
+
+        end_time = time.time() + timeout
+        with self._cluster_changed:
+            while self._cluster is cluster and time.time() < end_time:
+                self._cluster_changed.wait(end_time - time.time())
             return self._cluster
 
+    def _load_clusters(self, scopes):
+        """Build `Cluster` objects for the given scopes of the same namespace. Implementations should
+        read all of them with as few requests as possible, e.g. with a single recursive read of the namespace.
+
+        :returns: dict scope -> `Cluster`, empty `Cluster` if the scope doesn't exist in DCS.
+        raise `~DCSError` in case of communication or other problems with DCS."""
+        raise NotImplementedError
+
+    def _get_node_cache(self, scope):
+        # members of different clusters may have the same names, every cluster needs its own cache
+        if scope == self._scope:
+            return self._node_cache
+        return self._scope_node_caches.setdefault(scope, NodeCache())
+
+    def get_clusters(self, scopes):
+        """Load the current state of many clusters from DCS reusing the connection of this instance.
+        If only the cluster of this instance is requested it is the same as `get_cluster`.
+
+        :param scopes: list of cluster names in the same namespace
+        :returns: dict scope -> `Cluster`"""
+
+        scopes = list(scopes)
+        if scopes == [self._scope]:
+            return {self._scope: self.get_cluster()}
+        return self._load_clusters(scopes)
+
     @property
     def cluster(self):
-        with self._cluster_thread_lock:
-            return self._cluster
+        """The last published `Cluster` snapshot (or `!None`), returned without blocking.
+
+        `Cluster` objects are immutable and `_load_cluster` replaces the reference with a single
+        assignment, therefore no locking is required here even if the load is in progress."""
+        return self._cluster
 
     def reset_cluster(self):
-        with self._cluster_thread_lock:
-            self._cluster = None
+        self._cluster = None
 
     @abc.abstractmethod
     def write_leader_optime(self, last_operation):
@@ -282,6 +756,38 @@ class AbstractDCS(object):
         :returns: `!True` on success otherwise `!False`
         """
 
+    def touch_member_status(self, value):
+        """Update `/status/<name>` key in DCS. The key must expire (or disappear) together with the member key.
+        Only DCS implementations supporting the `compact_member_data` option should override this method,
+        for all others the option is ignored and the whole member data is written with `touch_member`.
+
+        :param value: volatile fields of the member encoded with `Member.encode_status`
+        :returns: `!True` on success otherwise `!False`"""
+        raise NotImplementedError
+
+    def publish_member(self, data):
+        """Publish the member data in DCS. Usually it is just written into the member key as JSON.
+
+        With `compact_member_data` only the compact status is written every time. The rest of the data
+        rarely changes and is written into the member key only when it has changed, when the member key
+        has disappeared or when its ttl needs to be refreshed.
+
+        :param data: dict with conn_url, api_url, state, role, tags, etc...
+        :returns: `!True` on success otherwise `!False`"""
+
+        if not self._compact_member_data:
+            return self.touch_member(json.dumps(data, separators=(',', ':')))
+
+        static = json.dumps({k: v for k, v in data.items() if k not in Member.STATUS_FIELDS}, separators=(',', ':'))
+        cluster = self.cluster
+        if static != self._static_member_data or not (cluster and cluster.has_member(self._name)) or\
+                time.time() >= self._static_member_written_at + self._static_member_refresh:
+            if not self.touch_member(static):
+                return False
+            self._static_member_data = static
+            self._static_member_written_at = time.time()
+        return self.touch_member_status(Member.encode_status(data))
+
     @abc.abstractmethod
     def take_leader(self):
         """This method should create leader key with value = `~self._name` and ttl=`~self.ttl`
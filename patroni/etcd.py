@@ -10,11 +10,12 @@ import urllib3
 
 from dns.exception import DNSException
 from dns import resolver
-from patroni.dcs import AbstractDCS, Cluster, Failover, Leader, Member
+from patroni.dcs import AbstractDCS, Cluster, Leader, Member
 from patroni.exceptions import DCSError
 from patroni.utils import Retry, RetryFailedError, sleep
 from requests.exceptions import RequestException
 from six.moves.http_client import HTTPException
+from six.moves.urllib_parse import urlencode
 
 logger = logging.getLogger(__name__)
 
@@ -25,9 +26,10 @@ class EtcdError(DCSError):
 
 class Client(etcd.Client):
 
-    def __init__(self, config):
+    def __init__(self, config, metrics=None):
         super(Client, self).__init__(read_timeout=5)
         self._config = config
+        self.metrics = metrics
         self._load_machines_cache()
         self._allow_reconnect = True
 
@@ -54,6 +56,8 @@ class Client(etcd.Client):
         try:
             response = request_executor(method, url, fields=fields, **kwargs)
             response.data.decode('utf-8')
+            if self.metrics:
+                self.metrics.add_bytes(len(urlencode(fields)) if fields else 0, len(response.data))
             self._check_cluster_id(response)
         except (urllib3.exceptions.HTTPError, HTTPException, socket.error) as e:
             if (isinstance(fields, dict) and fields.get("wait") == "true" and
@@ -199,17 +203,25 @@ class Etcd(AbstractDCS):
                                               etcd.EtcdLeaderElectionInProgress,
                                               etcd.EtcdWatcherCleared,
                                               etcd.EtcdEventIndexCleared))
-        self._client = self.get_etcd_client(config)
+        self._client = self.get_etcd_client(config, self.metrics)
+
+    @property
+    def endpoint(self):
+        return self._client._base_uri
 
     def retry(self, *args, **kwargs):
-        return self._retry.copy()(*args, **kwargs)
+        retry = self._retry.copy()
+        try:
+            return retry(*args, **kwargs)
+        finally:
+            self.metrics.add_retries(retry._attempts)
 
     @staticmethod
-    def get_etcd_client(config):
+    def get_etcd_client(config, metrics=None):
         client = None
         while not client:
             try:
-                client = Client(config)
+                client = Client(config, metrics)
             except etcd.EtcdException:
                 logger.info('waiting on etcd')
                 sleep(5)
@@ -217,47 +229,73 @@ class Etcd(AbstractDCS):
 
     @staticmethod
     def member(node):
-        return Member.from_node(node.modifiedIndex, os.path.basename(node.key), node.ttl, node.value)
+        return (node.modifiedIndex, os.path.basename(node.key), node.ttl, node.value)
 
-    def _load_cluster(self):
-        try:
-            result = self.retry(self._client.read, self.client_path(''), recursive=True)
-            nodes = {os.path.relpath(node.key, result.key): node for node in result.leaves}
+    def _cluster_from_nodes(self, nodes, node_cache):
+        """:param nodes: dict path relative to the cluster root -> `etcd.EtcdResult`"""
 
-            # get initialize flag
-            initialize = nodes.get(self._INITIALIZE)
-            initialize = initialize and initialize.value
+        # get initialize flag
+        initialize = nodes.get(self._INITIALIZE)
+        initialize = initialize and initialize.value
 
-            # get last leader operation
-            last_leader_operation = nodes.get(self._LEADER_OPTIME)
-            last_leader_operation = 0 if last_leader_operation is None else int(last_leader_operation.value)
+        # get last leader operation
+        last_leader_operation = nodes.get(self._LEADER_OPTIME)
+        last_leader_operation = 0 if last_leader_operation is None else int(last_leader_operation.value)
 
-            # get list of members
-            members = [self.member(n) for k, n in nodes.items() if k.startswith(self._MEMBERS) and k.count('/') == 1]
+        # get list of members
+        statuses = {os.path.basename(k): n.value for k, n in nodes.items()
+                    if k.startswith(self._STATUS) and k.count('/') == 1}
+        members = node_cache.members((self.member(n) for k, n in nodes.items()
+                                      if k.startswith(self._MEMBERS) and k.count('/') == 1), statuses)
 
-            # get leader
-            leader = nodes.get(self._LEADER)
-            if leader:
-                member = Member(-1, leader.value, None, {})
-                member = ([m for m in members if m.name == leader.value] or [member])[0]
-                leader = Leader(leader.modifiedIndex, leader.ttl, member)
+        # get leader
+        leader = nodes.get(self._LEADER)
+        if leader:
+            leader = Leader(leader.modifiedIndex, leader.ttl, Member(-1, leader.value, None, {}))
 
-            # failover key
-            failover = nodes.get(self._FAILOVER)
-            if failover:
-                failover = Failover.from_node(failover.modifiedIndex, failover.value)
+        # failover key
+        failover = nodes.get(self._FAILOVER)
+        if failover:
+            failover = node_cache.failover(failover.modifiedIndex, failover.value)
 
-            self._cluster = Cluster(initialize, leader, last_leader_operation, members, failover)
+        return Cluster(initialize, leader, last_leader_operation, members, failover)
+
+    def _load_cluster(self):
+        try:
+            result = self.retry(self._client.read, self.client_path(''), recursive=True)
+            self._cluster_index = getattr(result, 'etcd_index', None)
+            nodes = {os.path.relpath(node.key, result.key): node for node in result.leaves}
+            self._cluster = self._cluster_from_nodes(nodes, self._node_cache)
         except etcd.EtcdKeyNotFound:
             self._cluster = Cluster(False, None, None, [], None)
         except:
             logger.exception('get_cluster')
             raise EtcdError('Etcd is not responding properly')
 
+    def _load_clusters(self, scopes):
+        nodes = {scope: {} for scope in scopes}
+        try:
+            try:
+                result = self.retry(self._client.read, self._namespace, recursive=True)
+                for node in result.leaves:
+                    scope, _, path = os.path.relpath(node.key, result.key).partition('/')
+                    if scope in nodes:
+                        nodes[scope][path] = node
+            except etcd.EtcdKeyNotFound:
+                pass
+            return {scope: self._cluster_from_nodes(n, self._get_node_cache(scope)) for scope, n in nodes.items()}
+        except:
+            logger.exception('get_clusters')
+            raise EtcdError('Etcd is not responding properly')
+
     @catch_etcd_errors
     def touch_member(self, connection_string, ttl=None):
         return self.retry(self._client.set, self.member_path, connection_string, ttl or self.ttl)
 
+    @catch_etcd_errors
+    def touch_member_status(self, value):
+        return self.retry(self._client.set, self.status_path, value, self.ttl)
+
     @catch_etcd_errors
     def take_leader(self):
         return self.retry(self._client.set, self.leader_path, self._name, self.ttl)
@@ -1,14 +1,14 @@
-import json
 import logging
 import psycopg2
-import requests
 import sys
 import datetime
 import pytz
+import time
 
 from multiprocessing.pool import ThreadPool
 from patroni.async_executor import AsyncExecutor
 from patroni.exceptions import DCSError, PostgresConnectionException
+from patroni.metrics import Histogram
 from patroni.utils import sleep
 
 logger = logging.getLogger(__name__)
@@ -24,6 +24,7 @@ class Ha(object):
         self.old_cluster = None
         self.recovering = False
         self._async_executor = AsyncExecutor()
+        self.cycle_duration = Histogram()
 
     def load_cluster_from_dcs(self):
         cluster = self.dcs.get_cluster()
@@ -63,7 +64,7 @@ class Ha(object):
                 data['xlog_location'] = self.state_handler.xlog_position()
             except:
                 pass
-        self.dcs.touch_member(json.dumps(data, separators=(',', ':')))
+        self.dcs.publish_member(data)
 
     def clone(self, clone_member, clone_member_name="leader"):
         if self.state_handler.bootstrap(cluster_initialized=True, clone_member=clone_member):
@@ -78,8 +79,7 @@ class Ha(object):
     def bootstrap(self):
         if not self.cluster.is_unlocked():  # cluster already has leader
             clonefrom = self.patroni.clonefrom
-            clone_member = self.cluster.get_member(clonefrom)\
-                if self.cluster.has_member(clonefrom) else self.cluster.leader
+            clone_member = self.cluster.get_member(clonefrom) or self.cluster.leader
             clone_member_name = 'leader' if clone_member == self.cluster.leader else 'replica \'{0}\''.format(clonefrom)
             self._async_executor.schedule('bootstrap from {0}'.format(clone_member_name))
             self._async_executor.run_async(self.clone, args=(clone_member, clone_member_name))
@@ -126,10 +126,8 @@ class Ha(object):
         # determine the node to follow. If replicatefrom tag is set,
         # try to follow the node mentioned there, otherwise, follow the leader.
 
-        if self.patroni.replicatefrom:
-            node_to_follow = [m for m in self.cluster.members if m.name == self.patroni.replicatefrom]
-            node_to_follow = node_to_follow[0] if node_to_follow else self.cluster.leader
-        else:
+        node_to_follow = self.patroni.replicatefrom and self.cluster.get_member(self.patroni.replicatefrom)
+        if not node_to_follow:
             node_to_follow = self.cluster.leader
         if node_to_follow and node_to_follow.name == self.state_handler.name:
             ret = demote_reason
@@ -158,6 +156,9 @@ class Ha(object):
         tags - dictionary with values of different tags (i.e. nofailover)
         """
 
+        # requests pulls urllib3, it is imported here so `import patroni.ctl` doesn't depend on it
+        import requests
+
         try:
             response = requests.get(member.api_url, timeout=2, verify=False)
             logger.info('Got response from %s %s: %s', member.name, member.api_url, response.content)
@@ -225,9 +226,9 @@ class Ha(object):
                 return True
 
             # find specific node and check that it is healthy
-            members = [m for m in self.cluster.members if m.name == failover.candidate]
-            if members:
-                member, reachable, _, _, tags = self.fetch_node_status(members[0])
+            member = self.cluster.get_member(failover.candidate)
+            if member:
+                member, reachable, _, _, tags = self.fetch_node_status(member)
                 if reachable and not tags.get('nofailover', False):  # node is healthy
                     logger.info('manual failover: to %s, i am %s', member.name, self.state_handler.name)
                     return False
@@ -244,7 +245,8 @@ class Ha(object):
         if failover.leader:
             if self.state_handler.name == failover.leader:  # I was the leader
                 # exclude me and desired member which is unhealthy (failover.candidate can be None)
-                members = [m for m in self.cluster.members if m.name not in (failover.candidate, failover.leader)]
+                members = [m for m in self.cluster.failover_candidates
+                           if m.name not in (failover.candidate, failover.leader)]
                 if self.is_failover_possible(members):  # check that there are healthy members
                     return False
                 else:  # I was the leader and it looks like currently I am the only healthy member
@@ -253,7 +255,7 @@ class Ha(object):
             # at this point we assume that our node is a candidate for a failover among all nodes except former leader
 
         # exclude former leader from the list (failover.leader can be None)
-        members = [m for m in self.cluster.members if m.name != failover.leader]
+        members = [m for m in self.cluster.failover_candidates if m.name != failover.leader]
         return self._is_healthiest_node(members, check_replication_lag=False)
 
     def is_healthiest_node(self):
@@ -310,7 +312,11 @@ class Ha(object):
 
         if not failover.leader or failover.leader == self.state_handler.name:
             if not failover.candidate or failover.candidate != self.state_handler.name:
-                members = [m for m in self.cluster.members if not failover.candidate or m.name == failover.candidate]
+                if failover.candidate:
+                    member = self.cluster.get_member(failover.candidate)
+                    members = [member] if member else []
+                else:
+                    members = self.cluster.failover_candidates
                 if self.is_failover_possible(members):  # check that there are healthy members
                     self._async_executor.schedule('manual failover: demote')
                     self._async_executor.run_async(self.demote)
@@ -368,6 +374,10 @@ class Ha(object):
         with self._async_executor:
             return self._async_executor.schedule(action)
 
+    def async_action(self):
+        """:returns: tuple(name of the scheduled long running action or `!None`, `!True` if it is being executed)"""
+        return self._async_executor.scheduled_action, self._async_executor.busy
+
     def restart_scheduled(self):
         return self._async_executor.scheduled_action == 'restart'
 
@@ -493,6 +503,26 @@ class Ha(object):
         except (psycopg2.Error, PostgresConnectionException):
             logger.exception('Error communicating with PostgreSQL. Will try again later')
 
+    def publish_events(self):
+        """Pushes the state of this node and of the cluster to subscribers of `GET /events`.
+        Only the values which have changed since the previous cycle are actually sent."""
+
+        events = self.patroni.api.events
+        events.publish('member', {'name': self.state_handler.name, 'role': self.state_handler.role,
+                                  'state': self.state_handler.state})
+        cluster = self.cluster
+        if cluster:
+            events.publish('leader', {'leader': cluster.leader and cluster.leader.name})
+            failover = cluster.failover
+            events.publish('failover', failover and {
+                'leader': failover.leader, 'candidate': failover.candidate,
+                'scheduled_at': failover.scheduled_at and failover.scheduled_at.isoformat()})
+
     def run_cycle(self):
         with self._async_executor:
-            return self._run_cycle()
+            start = time.time()
+            try:
+                return self._run_cycle()
+            finally:
+                self.cycle_duration.observe(time.time() - start)
+                self.publish_events()
@@ -0,0 +1,195 @@
+import threading
+import time
+
+from bisect import bisect_left
+
+
+class Histogram(object):
+
+    """Distribution of observed values over fixed buckets, the same way as Prometheus histograms do it.
+
+    >>> h = Histogram((0.1, 1))
+    >>> for value in (0.05, 0.5, 0.5, 5): h.observe(value)
+    >>> s = h.snapshot()
+    >>> s['buckets'], s['count']
+    ([(0.1, 1), (1, 3), ('+Inf', 4)], 4)
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, buckets=None):
+        self._buckets = tuple(buckets or self.BUCKETS)
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0
+
+    def observe(self, value):
+        self._counts[bisect_left(self._buckets, value)] += 1
+        self._sum += value
+
+    def snapshot(self):
+        """:returns: dict with cumulative counts of values less or equal to the upper bound of every bucket"""
+        buckets, total = [], 0
+        for le, count in zip(self._buckets + ('+Inf',), self._counts):
+            total += count
+            buckets.append((le, total))
+        return {'buckets': buckets, 'count': total, 'sum': self._sum}
+
+
+class OperationStats(object):
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.failures = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def snapshot(self):
+        ret = self.latency.snapshot()
+        ret.update(errors=self.errors, failures=self.failures, retries=self.retries,
+                   bytes_sent=self.bytes_sent, bytes_received=self.bytes_received)
+        return ret
+
+
+class OperationMetrics(object):
+
+    """Per-operation latency, errors, retries and transferred bytes.
+
+    Operations are executed with `measure`. Retries and bytes reported while an operation is running
+    in the current thread are accounted to this operation, otherwise to the pseudo-operation `other`.
+    If an operation calls itself (i.e. via `super()`) only the outermost call is measured.
+
+    An operation which raised an exception is counted in `errors`, one which returned `!False` in `failures`.
+    For some operations (`watch`, `attempt_to_acquire_leader`) `!False` is a perfectly normal result.
+
+    >>> m = OperationMetrics()
+    >>> m.measure('get', lambda: m.add_retries(2) or m.measure('get', lambda: False))
+    False
+    >>> m.add_bytes(10, 20)
+    >>> s = m.snapshot()
+    >>> (s['get']['count'], s['get']['retries'], s['get']['failures'], s['other']['bytes_received'])
+    (1, 2, 1, 20)
+    """
+
+    OTHER = 'other'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._operations = {}
+
+    def _stats(self, operation):
+        stats = self._operations.get(operation)
+        if stats is None:
+            with self._lock:
+                stats = self._operations.setdefault(operation, OperationStats())
+        return stats
+
+    @property
+    def _current(self):
+        return getattr(self._local, 'operation', None)
+
+    def measure(self, operation, func, *args, **kwargs):
+        """Executes `func(*args, **kwargs)` as the `operation` and returns its result"""
+
+        parent = self._current
+        if parent == operation:
+            return func(*args, **kwargs)
+
+        stats = self._stats(operation)
+        self._local.operation = operation
+        start = time.time()
+        try:
+            ret = func(*args, **kwargs)
+            if ret is False:
+                stats.failures += 1
+            return ret
+        except:
+            stats.errors += 1
+            raise
+        finally:
+            stats.latency.observe(time.time() - start)
+            self._local.operation = parent
+
+    def add_retries(self, count):
+        if count:
+            self._stats(self._current or self.OTHER).retries += count
+
+    def add_bytes(self, sent, received):
+        stats = self._stats(self._current or self.OTHER)
+        stats.bytes_sent += sent
+        stats.bytes_received += received
+
+    def snapshot(self):
+        """:returns: dict operation -> dict with latency histogram and counters"""
+        with self._lock:
+            operations = list(self._operations.items())
+        return {name: stats.snapshot() for name, stats in operations}
+
+
+class PrometheusText(object):
+
+    """Builds a page in the text exposition format of Prometheus. Samples of the same metric are grouped
+    under one HELP and TYPE line, no matter in which order they were added.
+
+    >>> p = PrometheusText()
+    >>> p.add('patroni_dcs_errors_total', 'Failed requests', 1, {'operation': 'get'}, 'counter')
+    >>> p.add_histogram('patroni_cycle_seconds', 'Cycle duration', {'buckets': [(0.5, 1), ('+Inf', 2)],
+    ...                                                             'count': 2, 'sum': 1.25})
+    >>> p.add('patroni_dcs_errors_total', 'Failed requests', 0, {'operation': 'set "a"'}, 'counter')
+    >>> print(p.render().decode('utf-8').strip())
+    # HELP patroni_dcs_errors_total Failed requests
+    # TYPE patroni_dcs_errors_total counter
+    patroni_dcs_errors_total{operation="get"} 1
+    patroni_dcs_errors_total{operation="set \\"a\\""} 0
+    # HELP patroni_cycle_seconds Cycle duration
+    # TYPE patroni_cycle_seconds histogram
+    patroni_cycle_seconds_bucket{le="0.5"} 1
+    patroni_cycle_seconds_bucket{le="+Inf"} 2
+    patroni_cycle_seconds_sum 1.25
+    patroni_cycle_seconds_count 2
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self._metrics = {}  # name -> list of lines
+        self._order = []
+
+    @staticmethod
+    def _format_value(value):
+        return repr(value) if isinstance(value, float) else str(int(value))
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ''
+        return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')
+                                                 .replace('\n', '\\n')) for k, v in sorted(labels.items())) + '}'
+
+    def _lines(self, name, description, metric_type):
+        if name not in self._metrics:
+            self._order.append(name)
+            self._metrics[name] = ['# HELP {0} {1}'.format(name, description),
+                                   '# TYPE {0} {1}'.format(name, metric_type)]
+        return self._metrics[name]
+
+    def add(self, name, description, value, labels=None, metric_type='gauge'):
+        """Adds a sample of a gauge or a counter. Samples with the value `!None` are skipped"""
+        if value is not None:
+            line = '{0}{1} {2}'.format(name, self._format_labels(labels), self._format_value(value))
+            self._lines(name, description, metric_type).append(line)
+
+    def add_histogram(self, name, description, snapshot, labels=None):
+        """:param snapshot: the result of `Histogram.snapshot()`"""
+        lines = self._lines(name, description, 'histogram')
+        for le, count in snapshot['buckets']:
+            bucket_labels = dict(labels or {}, le=le)
+            lines.append('{0}_bucket{1} {2}'.format(name, self._format_labels(bucket_labels), count))
+        labels = self._format_labels(labels)
+        lines.append('{0}_sum{1} {2}'.format(name, labels, self._format_value(snapshot['sum'])))
+        lines.append('{0}_count{1} {2}'.format(name, labels, snapshot['count']))
+
+    def render(self):
+        return ''.join(line + '\n' for name in self._order for line in self._metrics[name]).encode('utf-8')
@@ -82,6 +82,8 @@ class Postgresql(object):
         self._state_lock = Lock()
         self._role = 'replica'
         self._role_lock = Lock()
+        # number of lifecycle events since the start of Patroni, they are exported by `GET /metrics`
+        self.events = dict.fromkeys(('promotions', 'demotions', 'restarts', 'failed_starts'), 0)
 
         if self.is_running():
             self._state = 'running'
@@ -137,10 +139,17 @@ class Postgresql(object):
             r['password'] = self.superuser['password']
         return r
 
+    def connect(self, **kwargs):
+        """Opens a new autocommit connection to the local Postgres, `kwargs` override the connection parameters"""
+        connect_kwargs = self._connect_kwargs
+        connect_kwargs.update(kwargs)
+        conn = psycopg2.connect(**connect_kwargs)
+        conn.autocommit = True
+        return conn
+
     def connection(self):
         if not self._connection or self._connection.closed != 0:
-            self._connection = psycopg2.connect(**self._connect_kwargs)
-            self._connection.autocommit = True
+            self._connection = self.connect()
             self.server_version = self._connection.server_version
         return self._connection
 
@@ -347,6 +356,10 @@ class Postgresql(object):
         with self._state_lock:
             self._state = value
 
+    def count_event(self, event):
+        with self._state_lock:
+            self.events[event] += 1
+
     def start(self, block_callbacks=False):
         if self.is_running():
             logger.error('Cannot start PostgreSQL because one is already running.')
@@ -366,6 +379,8 @@ class Postgresql(object):
         ret = subprocess.call(self._pg_ctl + ['start', '-o', self.server_options()], env=env, preexec_fn=os.setsid) == 0
 
         self.set_state('running' if ret else 'start failed')
+        if not ret:
+            self.count_event('failed_starts')
 
         self.schedule_load_slots = ret and self.use_slots
         self.save_configuration_files()
@@ -424,6 +439,7 @@ class Postgresql(object):
 
     def restart(self):
         self.set_state('restarting')
+        self.count_event('restarts')
         ret = self.stop(block_callbacks=True) and self.start(block_callbacks=True)
         if ret:
             self.call_nowait(ACTION_ON_RESTART)
@@ -599,6 +615,7 @@ recovery_target_timeline = 'latest'
         else:  # do not rewind until the leader becomes available
             ret = self.restart()
         if change_role and ret:
+            self.count_event('demotions')
             self.call_nowait(ACTION_ON_ROLE_CHANGE)
         return ret
 
@@ -630,6 +647,7 @@ recovery_target_timeline = 'latest'
         ret = subprocess.call(self._pg_ctl + ['promote']) == 0
         if ret:
             self.set_role('master')
+            self.count_event('promotions')
             logger.info("cleared rewind flag after becoming the leader")
             self._need_rewind = False
             self.call_nowait(ACTION_ON_ROLE_CHANGE)
@@ -681,8 +699,7 @@ $$""".format(name, options), name, password, password)
                               not cluster.has_member(m.replicatefrom))]
                 else:
                     # only manage slots for replicas that replicate from this one, except for the leader among them
-                    slots = [m.name for m in cluster.members if m.replicatefrom == self.name and
-                             m.name != cluster.leader.name]
+                    slots = [m.name for m in cluster.replicas_of(self.name) if m.name != cluster.leader.name]
                 # drop unused slots
                 for slot in set(self.replication_slots) - set(slots):
                     self.query("""SELECT pg_drop_replication_slot(%s)
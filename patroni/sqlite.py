@@ -0,0 +1,254 @@
+from __future__ import absolute_import
+import logging
+import os
+import sqlite3
+import time
+
+from patroni.dcs import AbstractDCS, Cluster, Leader, Member
+from patroni.exceptions import DCSError
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteError(DCSError):
+    pass
+
+
+def catch_sqlite_errors(func):
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except sqlite3.Error:
+            logger.exception('%s', func.__name__)
+            return False
+    return wrapper
+
+
+class SQLite(AbstractDCS):
+
+    """DCS stored in a local SQLite database in WAL mode. It could be shared only by Patroni instances
+    running on the same host and is meant for development, CI and benchmarks, where one wants to run
+    many instances without etcd or ZooKeeper.
+
+    Every key has a `modify_index`, which is taken from the global counter incremented by every write,
+    and optionally the time when it `expires`. Expired keys are treated as non-existent and are removed
+    by the next write. All writes are executed in `BEGIN IMMEDIATE` transactions, what makes
+    compare-and-set operations atomic across processes. `watch` polls the leader key, because there is
+    no way to get notifications about changes made by other processes."""
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, name, config):
+        super(SQLite, self).__init__(name, config)
+        self.ttl = config.get('ttl', 30)
+        self._lock = Lock()
+        self._path = config.get('path', 'patroni.sqlite')
+        self._conn = sqlite3.connect(self._path, timeout=5,
+                                     isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._transaction() as cursor:
+            cursor.execute('CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                           'modify_index INTEGER NOT NULL, expires REAL)')
+            cursor.execute('CREATE TABLE IF NOT EXISTS counter (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)')
+            cursor.execute('INSERT OR IGNORE INTO counter VALUES (0, 0)')
+
+    @property
+    def endpoint(self):
+        return self._path
+
+    def _transaction(self, immediate=True):
+        return _Transaction(self._lock, self._conn, immediate)
+
+    def _read(self, cursor, key):
+        cursor.execute('SELECT value, modify_index, expires FROM kv WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                       (key, time.time()))
+        return cursor.fetchone()
+
+    def _set(self, key, value, ttl=None, prev_exist=None, prev_value=None, prev_index=None):
+        """Sets the value of the key if all given conditions hold.
+
+        :param prev_exist: `!True` - the key must exist, `!False` - the key must not exist
+        :param prev_value: the current value of the key must be equal to it
+        :param prev_index: the current `modify_index` of the key must be equal to it
+        :returns: `!True` if the value was set"""
+
+        with self._transaction() as cursor:
+            node = self._read(cursor, key)
+            if prev_exist is not None and bool(node) != prev_exist or\
+                    prev_value is not None and (not node or node[0] != prev_value) or\
+                    prev_index is not None and (not node or node[1] != prev_index):
+                return False
+            cursor.execute('DELETE FROM kv WHERE expires <= ?', (time.time(),))
+            cursor.execute('UPDATE counter SET value = value + 1')
+            cursor.execute('INSERT OR REPLACE INTO kv SELECT ?, ?, value, ? FROM counter',
+                           (key, str(value), ttl and time.time() + ttl))
+            return True
+
+    def _delete(self, key, prev_value=None, recursive=False):
+        with self._transaction() as cursor:
+            if prev_value is not None:
+                node = self._read(cursor, key)
+                if not node or node[0] != prev_value:
+                    return False
+            cursor.execute('UPDATE counter SET value = value + 1')
+            if recursive:
+                cursor.execute("DELETE FROM kv WHERE substr(key, 1, ?) = ?", (len(key), key))
+            else:
+                cursor.execute('DELETE FROM kv WHERE key = ?', (key,))
+            return True
+
+    def _read_tree(self, path):
+        """:returns: tuple(global index, dict key relative to the `path` -> tuple(value, modify_index, ttl))"""
+        with self._transaction(False) as cursor:
+            cursor.execute('SELECT value FROM counter')
+            index = cursor.fetchone()[0]
+            now = time.time()
+            cursor.execute('SELECT key, value, modify_index, expires FROM kv WHERE substr(key, 1, ?) = ? '
+                           'AND (expires IS NULL OR expires > ?)', (len(path), path, now))
+            return index, {key[len(path):]: (value, modify_index, expires and int(expires - now))
+                           for key, value, modify_index, expires in cursor.fetchall()}
+
+    def _cluster_from_nodes(self, nodes, node_cache):
+        # get initialize flag
+        initialize = nodes.get(self._INITIALIZE)
+        initialize = initialize and initialize[0]
+
+        # get last leader operation
+        last_leader_operation = nodes.get(self._LEADER_OPTIME)
+        last_leader_operation = int(last_leader_operation[0]) if last_leader_operation else 0
+
+        # get list of members
+        statuses = {os.path.basename(k): n[0] for k, n in nodes.items()
+                    if k.startswith(self._STATUS) and k.count('/') == 1}
+        members = node_cache.members(((index, os.path.basename(k), ttl, value)
+                                      for k, (value, index, ttl) in nodes.items()
+                                      if k.startswith(self._MEMBERS) and k.count('/') == 1), statuses)
+
+        # get leader
+        leader = nodes.get(self._LEADER)
+        if leader:
+            leader = Leader(leader[1], leader[2], Member(-1, leader[0], None, {}))
+
+        # failover key
+        failover = nodes.get(self._FAILOVER)
+        if failover:
+            failover = node_cache.failover(failover[1], failover[0])
+
+        return Cluster(initialize, leader, last_leader_operation, members, failover)
+
+    def _load_cluster(self):
+        try:
+            self._cluster_index, nodes = self._read_tree(self.client_path(''))
+            self._cluster = self._cluster_from_nodes(nodes, self._node_cache)
+        except:
+            logger.exception('get_cluster')
+            raise SQLiteError('SQLite is not responding properly')
+
+    def _load_clusters(self, scopes):
+        try:
+            nodes = {scope: {} for scope in scopes}
+            for key, node in self._read_tree(self._namespace + '/')[1].items():
+                scope, _, key = key.partition('/')
+                if scope in nodes:
+                    nodes[scope][key] = node
+            return {scope: self._cluster_from_nodes(n, self._get_node_cache(scope)) for scope, n in nodes.items()}
+        except:
+            logger.exception('get_clusters')
+            raise SQLiteError('SQLite is not responding properly')
+
+    @catch_sqlite_errors
+    def touch_member(self, connection_string, ttl=None):
+        return self._set(self.member_path, connection_string, ttl or self.ttl)
+
+    @catch_sqlite_errors
+    def touch_member_status(self, value):
+        return self._set(self.status_path, value, self.ttl)
+
+    @catch_sqlite_errors
+    def take_leader(self):
+        return self._set(self.leader_path, self._name, self.ttl)
+
+    @catch_sqlite_errors
+    def attempt_to_acquire_leader(self):
+        ret = self._set(self.leader_path, self._name, self.ttl, prev_exist=False)
+        if not ret:
+            logger.info('Could not take out TTL lock')
+        return ret
+
+    @catch_sqlite_errors
+    def set_failover_value(self, value, index=None):
+        return self._set(self.failover_path, value, prev_index=index)
+
+    @catch_sqlite_errors
+    def write_leader_optime(self, last_operation):
+        return self._set(self.leader_optime_path, last_operation)
+
+    @catch_sqlite_errors
+    def update_leader(self):
+        return self._set(self.leader_path, self._name, self.ttl, prev_value=self._name)
+
+    @catch_sqlite_errors
+    def initialize(self, create_new=True, sysid=''):
+        return self._set(self.initialize_path, sysid, prev_exist=(not create_new))
+
+    @catch_sqlite_errors
+    def delete_leader(self):
+        return self._delete(self.leader_path, prev_value=self._name)
+
+    @catch_sqlite_errors
+    def cancel_initialization(self):
+        return self._delete(self.initialize_path)
+
+    @catch_sqlite_errors
+    def delete_cluster(self):
+        return self._delete(self.client_path(''), recursive=True)
+
+    def watch(self, timeout):
+        cluster = self.cluster
+        # watch on leader key changes if it is defined and current node is not lock owner
+        if cluster and cluster.leader and cluster.leader.name != self._name:
+            end_time = time.time() + timeout
+            try:
+                while not self.event.is_set() and time.time() < end_time:
+                    with self._transaction(False) as cursor:
+                        node = self._read(cursor, self.leader_path)
+                    if not node or node[1] != cluster.leader.index:
+                        return True
+                    self.event.wait(min(self.POLL_INTERVAL, max(end_time - time.time(), 0)))
+            except sqlite3.Error:
+                logger.exception('watch')
+            timeout = end_time - time.time()
+
+        try:
+            return super(SQLite, self).watch(max(timeout, 0))
+        finally:
+            self.event.clear()
+
+
+class _Transaction(object):
+
+    """Serializes access to the connection from different threads and runs statements in a transaction,
+    which is committed on success and rolled back on exception. Transactions which are going to write
+    should be `immediate`: they take the write lock on the database at the beginning."""
+
+    def __init__(self, lock, conn, immediate):
+        self._lock = lock
+        self._conn = conn
+        self._begin = 'BEGIN IMMEDIATE' if immediate else 'BEGIN'
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            self._cursor = self._conn.cursor()
+            self._cursor.execute(self._begin)
+        except:
+            self._lock.release()
+            raise
+        return self._cursor
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self._conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self._lock.release()
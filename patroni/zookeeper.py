@@ -1,14 +1,15 @@
 import logging
-import random
 import requests
 import time
 
 from kazoo.client import KazooClient, KazooState
-from kazoo.exceptions import NoNodeError, NodeExistsError
-from patroni.dcs import AbstractDCS, Cluster, Failover, Leader, Member
+from kazoo.exceptions import BadVersionError, NoNodeError, NodeExistsError
+from patroni.dcs import AbstractDCS, Cluster, Leader, Member
 from patroni.exceptions import DCSError
 from patroni.utils import sleep
 from requests.exceptions import RequestException
+from six.moves.queue import Queue
+from threading import Lock, Thread
 
 logger = logging.getLogger(__name__)
 
@@ -17,11 +18,19 @@ class ZooKeeperError(DCSError):
     pass
 
 
-class ExhibitorEnsembleProvider(object):
+class ExhibitorEnsembleProvider(Thread):
+
+    """Discovers the list of ZooKeeper servers from Exhibitor. Only the initial discovery is done
+    synchronously, afterwards Exhibitors are polled by the background thread and the `on_change`
+    callback is called with the new connection string when the list of ZooKeeper servers changes."""
 
     TIMEOUT = 3.1
+    RETRY_INTERVAL = 5
 
     def __init__(self, hosts, port, uri_path='/exhibitor/v1/cluster/list', poll_interval=300):
+        super(ExhibitorEnsembleProvider, self).__init__()
+        self.daemon = True
+        self.on_change = None
         self._exhibitor_port = port
         self._uri_path = uri_path
         self._poll_interval = poll_interval
@@ -31,7 +40,7 @@ class ExhibitorEnsembleProvider(object):
         self._next_poll = None
         while not self.poll():
             logger.info('waiting on exhibitor')
-            sleep(5)
+            sleep(self.RETRY_INTERVAL)
 
     def poll(self):
         if self._next_poll and self._next_poll > time.time():
@@ -51,17 +60,33 @@ class ExhibitorEnsembleProvider(object):
                 return True
         return False
 
+    def _query_exhibitor(self, host, results):
+        uri = 'http://{0}:{1}{2}'.format(host, self._exhibitor_port, self._uri_path)
+        try:
+            results.put(requests.get(uri, timeout=self.TIMEOUT).json())
+        except (RequestException, ValueError):
+            results.put(None)
+
     def _query_exhibitors(self, exhibitors):
-        random.shuffle(exhibitors)
+        """Queries all exhibitors in parallel and returns the first successful response"""
+        results = Queue()
         for host in exhibitors:
-            uri = 'http://{0}:{1}{2}'.format(host, self._exhibitor_port, self._uri_path)
-            try:
-                response = requests.get(uri, timeout=self.TIMEOUT)
-                return response.json()
-            except RequestException:
-                pass
+            thread = Thread(target=self._query_exhibitor, args=(host, results))
+            thread.daemon = True
+            thread.start()
+
+        for _ in exhibitors:
+            json = results.get()
+            if json:
+                return json
         return None
 
+    def run(self):
+        while True:
+            sleep(max(self._next_poll - time.time(), self.RETRY_INTERVAL))
+            if self.poll() and self.on_change:
+                self.on_change(self._zookeeper_hosts)
+
     @property
     def zookeeper_hosts(self):
         return self._zookeeper_hosts
@@ -92,98 +117,241 @@ class ZooKeeper(AbstractDCS):
                                    connection_retry={'max_delay': 1, 'max_tries': -1})
         self._client.add_listener(self.session_listener)
 
+        if self.exhibitor:
+            self.exhibitor.on_change = self._client.set_hosts
+            self.exhibitor.start()
+
         self._my_member_data = None
+        self._pending_writes = {}
         self._fetch_cluster = True
-        self._last_leader_operation = 0
+        self._fetch_optime = False
+        # the value of the optime znode (bytes) known to this instance and the leader it belongs to. It survives
+        # loads of the cluster, otherwise the leader would rewrite the optime after every change of any znode.
+        self._last_leader_operation = None
+        self._optime_leader = None
+
+        # Local mirror of the cluster tree: absolute path of the znode -> tuple(value, ZnodeStat).
+        # It is maintained by data watches on every znode and by child watches on the cluster root and members.
+        # Watchers only put path of the changed znode into `_dirty` and the next `_load_cluster` re-reads it.
+        self._tree = {}
+        self._dirty = set()
+        self._dirty_lock = Lock()
 
         self._client.start(None)
 
     def session_listener(self, state):
+        # watches are not reliable anymore, the whole tree must be read again
         if state in [KazooState.SUSPENDED, KazooState.LOST]:
-            self.cluster_watcher(None)
+            self._fetch_cluster = True
+            self.event.set()
+
+    def node_watcher(self, event):
+        with self._dirty_lock:
+            self._dirty.add(event.path)
 
     def cluster_watcher(self, event):
-        self._fetch_cluster = True
+        self.node_watcher(event)
         self.event.set()
 
-    def get_node(self, key, watch=None):
+    @property
+    def endpoint(self):
+        # kazoo doesn't expose the address of the server it is connected to
+        return ','.join('{0}:{1}'.format(*host) for host in self._client.hosts)
+
+    def retry(self, func, *args, **kwargs):
+        """The same as `KazooClient.retry`, but the number of retries is reported to `metrics`"""
+        retry = self._client.retry.copy()
         try:
-            ret = self._client.get(key, watch)
+            return retry(func, *args, **kwargs)
+        finally:
+            self.metrics.add_retries(retry._attempts)
+
+    def _node_result(self, async_result):
+        try:
+            ret = async_result.get()
+            self.metrics.add_bytes(0, len(ret[0]))
             return (ret[0].decode('utf-8'), ret[1])
         except NoNodeError:
             return None
 
     @staticmethod
-    def member(name, value, znode):
-        return Member.from_node(znode.version, name, znode.ephemeralOwner, value)
-
-    def get_children(self, key, watch=None):
+    def _children_result(async_result):
         try:
-            return self._client.get_children(key, watch)
+            return async_result.get()
         except NoNodeError:
             return []
 
-    def load_members(self):
-        members = []
-        for member in self.get_children(self.members_path, self.cluster_watcher):
-            data = self.get_node(self.members_path + member)
-            if data is not None:
-                members.append(self.member(member, *data))
-        return members
+    def get_node(self, key, watch=None):
+        return self._node_result(self._client.get_async(key, watch))
+
+    @staticmethod
+    def member(name, value, znode):
+        return (znode.version, name, znode.ephemeralOwner, value)
 
-    def _inner_load_cluster(self):
-        self._fetch_cluster = False
-        self.event.clear()
-        nodes = set(self.get_children(self.client_path(''), self.cluster_watcher))
-        if not nodes:
-            self._fetch_cluster = True
+    def get_children(self, key, watch=None):
+        return self._children_result(self._client.get_children_async(key, watch))
+
+    def _get_watched_node_async(self, path):
+        # Changes of member, leader and initialize keys are noticed by the next run of the HA loop, like before.
+        # Changes of the list of children and of the failover key are waking up the HA loop immediately.
+        watcher = self.cluster_watcher if path == self.failover_path else self.node_watcher
+        return self._client.get_async(path, watcher)
+
+    def _update_tree(self, dirty):
+        """Re-reads changed znodes and lists of children. Requests are pipelined: all of them are sent
+        before waiting for the first response, therefore one (when only data of some znodes has changed)
+        or two (when lists of children have changed) round trips to ZooKeeper are necessary.
+
+        :returns: `!False` if the cluster root doesn't exist"""
+
+        # kazoo drops the trailing slash from paths of events, therefore all paths are compared without it
+        dirty = set(path.rstrip('/') for path in dirty)
+        root, members_path, statuses_path = (path.rstrip('/') for path in
+                                             (self.client_path(''), self.members_path, self.statuses_path))
+        if root in dirty:  # `members` and `status` znodes might have been (re)created
+            dirty.update((members_path, statuses_path))
+
+        children = {path: self._client.get_children_async(path, self.cluster_watcher)
+                    for path in (root, members_path, statuses_path) if path in dirty}
+        nodes = {path: self._get_watched_node_async(path) for path in dirty if path not in children}
+
+        ret = True
+        for path, async_result in children.items():
+            names = self._children_result(async_result)
+            if path == root:
+                ret = bool(names)
+                listed = set(self.client_path(n) for n in (self._INITIALIZE, self._LEADER, self._FAILOVER)
+                             if n in names)
+                known = set((self.initialize_path, self.leader_path, self.failover_path)).intersection(self._tree)
+            else:
+                listed = set(path + '/' + n for n in names)
+                known = set(p for p in self._tree if p.startswith(path + '/'))
+            for p in known - listed:
+                del self._tree[p]
+            for p in listed - known - set(nodes):
+                nodes[p] = self._get_watched_node_async(p)
+
+        for path, async_result in nodes.items():
+            node = self._node_result(async_result)
+            if node:
+                self._tree[path] = node
+            else:
+                self._tree.pop(path, None)
+        return ret
+
+    def _cluster_from_tree(self, tree, path, node_cache, last_leader_operation=0):
+        """:param tree: dict absolute path of the znode -> tuple(value, ZnodeStat)
+        :param path: root of the cluster, ends with '/'"""
 
         # get initialize flag
-        initialize = (self.get_node(self.initialize_path) or [None])[0] if self._INITIALIZE in nodes else None
+        initialize = tree.get(path + self._INITIALIZE)
+        initialize = initialize and initialize[0]
 
         # get list of members
-        members = self.load_members() if self._MEMBERS[:-1] in nodes else []
+        members_path, statuses_path = path + self._MEMBERS, path + self._STATUS
+        statuses = {p[len(statuses_path):]: node[0] for p, node in tree.items() if p.startswith(statuses_path)}
+        members = node_cache.members((self.member(p[len(members_path):], *node)
+                                      for p, node in tree.items() if p.startswith(members_path)), statuses)
 
         # get leader
-        leader = self.get_node(self.leader_path) if self._LEADER in nodes else None
+        leader = tree.get(path + self._LEADER)
         if leader:
-            client_id = self._client.client_id
-            if leader[0] == self._name and client_id is not None and client_id[0] != leader[1].ephemeralOwner:
-                logger.info('I am leader but not owner of the session. Removing leader node')
-                self._client.delete(self.leader_path)
-                leader = None
-
-            if leader:
-                member = Member(-1, leader[0], None, {})
-                member = ([m for m in members if m.name == leader[0]] or [member])[0]
-                leader = Leader(leader[1].version, leader[1].ephemeralOwner, member)
-                self._fetch_cluster = member.index == -1
+            leader = Leader(leader[1].version, leader[1].ephemeralOwner, Member(-1, leader[0], None, {}))
 
         # failover key
-        failover = self.get_node(self.failover_path, watch=self.cluster_watcher) if self._FAILOVER in nodes else None
+        failover = tree.get(path + self._FAILOVER)
         if failover:
-            failover = Failover.from_node(failover[1].version, failover[0])
+            failover = node_cache.failover(failover[1].version, failover[0])
 
-        # get last leader operation
-        optime = self.get_node(self.leader_optime_path) if self._OPTIME in nodes and self._fetch_cluster else None
-        self._last_leader_operation = 0 if optime is None else int(optime[0])
-        self._cluster = Cluster(initialize, leader, self._last_leader_operation, members, failover)
+        return Cluster(initialize, leader, last_leader_operation, members, failover)
 
-    def _load_cluster(self):
-        if self.exhibitor and self.exhibitor.poll():
-            self._client.set_hosts(self.exhibitor.zookeeper_hosts)
+    def _inner_load_cluster(self):
+        self.event.clear()
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+            if self._fetch_cluster:
+                self._fetch_cluster = False
+                self._tree.clear()
+                dirty = set([self.client_path('')])
+
+        try:
+            if not self._update_tree(dirty):  # there are no watches when the cluster doesn't exist
+                self._fetch_cluster = True
+        except Exception:
+            self._fetch_cluster = True  # when retried the whole tree will be read
+            raise
+
+        # our leader znode owned by another session (i.e. the previous one) must be removed
+        leader = self._tree.get(self.leader_path)
+        client_id = self._client.client_id
+        if leader and leader[0] == self._name and client_id is not None and client_id[0] != leader[1].ephemeralOwner:
+            logger.info('I am leader but not owner of the session. Removing leader node')
+            self._client.delete(self.leader_path)
+            self._tree.pop(self.leader_path)
+
+        cluster = self._cluster_from_tree(self._tree, self.client_path(''), self._node_cache)
+
+        # the optime written by another leader is unknown
+        leader = cluster.leader and cluster.leader.name
+        if leader != self._optime_leader:
+            self._last_leader_operation, self._optime_leader = None, leader
+
+        # leader doesn't have a member key yet, optime isn't watched and is read only in this case
+        self._fetch_optime = bool(cluster.leader and cluster.leader.member.index == -1)
+        if self._fetch_optime:
+            # get last leader operation
+            optime = self.get_node(self.leader_optime_path)
+            if optime is not None:
+                self._last_leader_operation = optime[0].encode('utf-8')
+                cluster = Cluster(cluster.initialize, cluster.leader, int(optime[0]), cluster.members, cluster.failover)
+        self._cluster_index = self._client.last_zxid
+        self._cluster = cluster
 
-        if self._fetch_cluster or self._cluster is None:
+    def _load_cluster(self):
+        if self._fetch_cluster or self._dirty or self._fetch_optime or self._cluster is None:
             try:
-                self._client.retry(self._inner_load_cluster)
+                self.retry(self._inner_load_cluster)
             except:
                 logger.exception('get_cluster')
                 self.session_listener(KazooState.LOST)
                 raise ZooKeeperError('ZooKeeper in not responding properly')
 
+    def _inner_load_clusters(self, scopes):
+        roots = {scope: '/'.join([self._namespace, scope, '']) for scope in scopes}
+        children = {path: self._client.get_children_async(path) for root in roots.values()
+                    for path in (root, root + self._MEMBERS, root + self._STATUS)}
+
+        nodes = {}
+        for root in roots.values():
+            names = self._children_result(children[root])
+            paths = [root + n for n in (self._INITIALIZE, self._LEADER, self._FAILOVER) if n in names]
+            if self._OPTIME in names:
+                paths.append(root + self._LEADER_OPTIME)
+            for path in (root + self._MEMBERS, root + self._STATUS):
+                paths.extend(path + n for n in self._children_result(children[path]))
+            nodes[root] = {path: self._client.get_async(path) for path in paths}
+
+        ret = {}
+        for scope, root in roots.items():
+            tree = {path: self._node_result(async_result) for path, async_result in nodes[root].items()}
+            tree = {path: node for path, node in tree.items() if node}
+            optime = tree.get(root + self._LEADER_OPTIME)
+            optime = int(optime[0]) if optime else 0
+            ret[scope] = self._cluster_from_tree(tree, root, self._get_node_cache(scope), optime)
+        return ret
+
+    def _load_clusters(self, scopes):
+        """All clusters are read with pipelined requests over the session of this instance: the first round trip
+        gets lists of children of cluster roots, `members` and `status`, the second one reads all found znodes."""
+        try:
+            return self.retry(self._inner_load_clusters, scopes)
+        except:
+            logger.exception('get_clusters')
+            raise ZooKeeperError('ZooKeeper in not responding properly')
+
     def _create(self, path, value, **kwargs):
         try:
-            self._client.retry(self._client.create, path, value.encode('utf-8'), **kwargs)
+            self.retry(self._client.create, path, value.encode('utf-8'), **kwargs)
             return True
         except:
             return False
@@ -196,7 +364,7 @@ class ZooKeeper(AbstractDCS):
 
     def set_failover_value(self, value, index=None):
         try:
-            self._client.retry(self._client.set, self.failover_path, value.encode('utf-8'), version=index or -1)
+            self.retry(self._client.set, self.failover_path, value.encode('utf-8'), version=index or -1)
             return True
         except NoNodeError:
             return value == '' or (not index and self._create(self.failover_path, value))
@@ -206,68 +374,144 @@ class ZooKeeper(AbstractDCS):
 
     def initialize(self, create_new=True, sysid=""):
         return self._create(self.initialize_path, sysid, makepath=True) if create_new \
-            else self._client.retry(self._client.set, self.initialize_path,  sysid.encode("utf-8"))
+            else self.retry(self._client.set, self.initialize_path,  sysid.encode("utf-8"))
 
-    def touch_member(self, data, ttl=None):
-        cluster = self.cluster
-        me = cluster and ([m for m in cluster.members if m.name == self._name] or [None])[0]
-        path = self.member_path
-        data = data.encode('utf-8')
-        create = not me
-        if me and self._client.client_id is not None and me.session != self._client.client_id[0]:
+    def _write_ephemeral(self, path, data, create):
+        self.metrics.add_bytes(len(data), 0)
+        try:
+            if create:
+                self.retry(self._client.create, path, data, makepath=True, ephemeral=True)
+            else:
+                self.retry(self._client.set, path, data)
+        except NodeExistsError:
+            try:
+                self.retry(self._client.set, path, data)
+            except:
+                logger.exception('touch_member')
+                return False
+        except:
+            logger.exception('touch_member')
+            return False
+        if path == self.member_path:
+            self._my_member_data = data
+        return True
+
+    def _touch(self, path, data, session, written=None):
+        """Creates or updates the ephemeral znode, which must be owned by our session.
+
+        :param session: the owner of the existing znode or `!None` if it doesn't exist
+        :param written: the data written into the znode by us the last time"""
+
+        create = session is None
+        if not create and self._client.client_id is not None and session != self._client.client_id[0]:
             try:
-                self._client.retry(self._client.delete, path)
+                self.retry(self._client.delete, path)
             except NoNodeError:
                 pass
             except:
                 return False
             create = True
 
-        if not create and data == self._my_member_data:
+        if not create and data == written:
             return True
 
-        try:
-            if create:
-                self._client.retry(self._client.create, path, data, makepath=True, ephemeral=True)
-            else:
-                self._client.retry(self._client.set, path, data)
-            self._my_member_data = data
+        cluster = self.cluster
+        if cluster and cluster.leader and cluster.leader.name == self._name:
+            # the leader writes its member keys together with the optime, see `write_leader_optime`
+            self._pending_writes[path] = (data, create)
             return True
-        except NodeExistsError:
+
+        return self._write_ephemeral(path, data, create)
+
+    def touch_member(self, data, ttl=None):
+        cluster = self.cluster
+        me = cluster and cluster.get_member(self._name)
+        return self._touch(self.member_path, data.encode('utf-8'), me.session if me else None, self._my_member_data)
+
+    def touch_member_status(self, value):
+        node = self._tree.get(self.status_path)
+        return self._touch(self.status_path, value.encode('utf-8'), node[1].ephemeralOwner if node else None)
+
+    def _flush_pending_writes(self):
+        for path, (data, create) in self._pending_writes.items():
+            self._write_ephemeral(path, data, create)
+        self._pending_writes.clear()
+
+    def take_leader(self):
+        return self.attempt_to_acquire_leader()
+
+    def _write_leader_optime(self, last_operation):
+        self._last_leader_operation = last_operation
+        path = self.leader_optime_path
+        try:
+            self.retry(self._client.set, path, last_operation)
+        except NoNodeError:
             try:
-                self._client.retry(self._client.set, path, data)
-                self._my_member_data = data
-                return True
+                self.retry(self._client.create, path, last_operation, makepath=True)
             except:
-                logger.exception('touch_member')
+                logger.exception('Failed to create %s', path)
         except:
-            logger.exception('touch_member')
-        return False
+            logger.exception('Failed to update %s', path)
 
-    def take_leader(self):
-        return self.attempt_to_acquire_leader()
+    def _commit(self, last_operation):
+        """Writes pending member keys and the optime in a single multi-op request.
+
+        :returns: `!False` if the transaction has failed (e.g. one of znodes doesn't exist yet)"""
+
+        writes = dict(self._pending_writes)
+
+        def commit():
+            transaction = self._client.transaction()
+            for path, (data, create) in writes.items():
+                if create:
+                    transaction.create(path, data, ephemeral=True)
+                else:
+                    transaction.set_data(path, data)
+            transaction.set_data(self.leader_optime_path, last_operation)
+            return transaction.commit()
+
+        self.metrics.add_bytes(sum(len(data) for data, _ in writes.values()) + len(last_operation), 0)
+
+        try:
+            if not any(isinstance(result, Exception) for result in self.retry(commit)):
+                self._pending_writes.clear()
+                if self.member_path in writes:
+                    self._my_member_data = writes[self.member_path][0]
+                self._last_leader_operation = last_operation
+                return True
+        except:
+            logger.exception('commit')
+        return False
 
     def write_leader_optime(self, last_operation):
         last_operation = last_operation.encode('utf-8')
         if last_operation != self._last_leader_operation:
-            self._last_leader_operation = last_operation
-            path = self.leader_optime_path
-            try:
-                self._client.retry(self._client.set, path, last_operation)
-            except NoNodeError:
-                try:
-                    self._client.retry(self._client.create, path, last_operation, makepath=True)
-                except:
-                    logger.exception('Failed to create %s', path)
-            except:
-                logger.exception('Failed to update %s', path)
+            if self._pending_writes and self._commit(last_operation):
+                return
+            # separate requests know how to create missing znodes
+            self._write_leader_optime(last_operation)
+        self._flush_pending_writes()
 
     def update_leader(self):
         return True
 
+    def _delete_leader(self):
+        leader = self.get_node(self.leader_path)
+        client_id = self._client.client_id
+        if leader and leader[0] == self._name and client_id is not None and client_id[0] == leader[1].ephemeralOwner:
+            self._client.delete(self.leader_path, version=leader[1].version)
+
     def delete_leader(self):
-        self._client.restart()
-        self._my_member_data = None
+        """Removes the leader znode owned by our session. The session is restarted (what removes all our
+        ephemeral znodes) only if we failed to delete the leader znode and can't be sure that it is gone."""
+        try:
+            self.retry(self._delete_leader)
+        except (NoNodeError, BadVersionError):  # it is already not our leader znode
+            pass
+        except:
+            logger.exception('Unable to delete leader znode, restarting the session')
+            self._client.restart()
+            self._my_member_data = None
         return True
 
     def _cancel_initialization(self):
@@ -277,17 +521,17 @@ class ZooKeeper(AbstractDCS):
 
     def cancel_initialization(self):
         try:
-            self._client.retry(self._cancel_initialization)
+            self.retry(self._cancel_initialization)
         except:
             logger.exception("Unable to delete initialize key")
 
     def delete_cluster(self):
         try:
-            return self._client.retry(self._client.delete, self.client_path(''), recursive=True)
+            return self.retry(self._client.delete, self.client_path(''), recursive=True)
         except NoNodeError:
             return True
 
     def watch(self, timeout):
-        if super(ZooKeeper, self).watch(timeout):
-            self._fetch_cluster = True
-        return self._fetch_cluster
+        # member keys of the leader are still not written if `write_leader_optime` wasn't called during this cycle
+        self._flush_pending_writes()
+        return super(ZooKeeper, self).watch(timeout) or self._fetch_cluster
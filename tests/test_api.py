@@ -1,14 +1,27 @@
+import json
 import psycopg2
+import time
 import unittest
 
+from kazoo.protocol.states import ZnodeStat
 from mock import Mock, patch
-from patroni.api import RestApiHandler, RestApiServer
-from patroni.dcs import Member
+from patroni.api import ClusterStatusCache, ConnectionPool, EventStream, PostgresStatusSampler, RestApiHandler, \
+    RestApiServer
+from patroni.dcs import Cluster, Failover, Leader, Member
+from patroni.exceptions import PostgresConnectionException
+from patroni.metrics import Histogram
+from patroni.zookeeper import ZooKeeper
 from six import BytesIO as IO
 from six.moves import BaseHTTPServer
 from six.moves.BaseHTTPServer import BaseHTTPRequestHandler
+from six.moves.http_client import HTTPConnection
+from six.moves.socketserver import TCPServer
 import socket
+from test_etcd import SleepException
+from test_ha import get_cluster_initialized_with_leader
 from test_postgresql import psycopg2_connect, MockCursor
+from test_zookeeper import MockKazooClient
+from threading import Event, Thread
 
 
 class MockPostgresql(object):
@@ -18,9 +31,10 @@ class MockPostgresql(object):
     role = 'master'
     server_version = '999999'
     scope = 'dummy'
+    events = {'promotions': 1, 'restarts': 0}
 
     @staticmethod
-    def connection():
+    def connect(**kwargs):
         return psycopg2_connect()
 
 
@@ -28,6 +42,11 @@ class MockHa(object):
 
     dcs = Mock()
     state_handler = MockPostgresql()
+    cycle_duration = Histogram()
+
+    @staticmethod
+    def async_action():
+        return 'restart', True
 
     @staticmethod
     def schedule_reinitialize():
@@ -53,6 +72,7 @@ class MockPatroni(object):
     dcs = Mock()
     tags = {}
     version = '0.00'
+    nap_time = 10
 
 
 class MockRequest(object):
@@ -63,6 +83,9 @@ class MockRequest(object):
     def makefile(self, *args, **kwargs):
         return IO(self.path)
 
+    def sendall(self, *args, **kwargs):
+        pass
+
 
 class MockRestApiServer(RestApiServer):
 
@@ -73,7 +96,10 @@ class MockRestApiServer(RestApiServer):
         MockRestApiServer._BaseServer__shutdown_request = True
         config = {'listen': '127.0.0.1:8008', 'auth': 'test:test', 'certfile': 'dumb'}
         super(MockRestApiServer, self).__init__(MockPatroni(), config)
-        Handler(MockRequest(path), ('0.0.0.0', 8080), self)
+        self.status.sample()  # what the thread of the sampler does
+        handler = Handler(MockRequest(path), ('0.0.0.0', 8080), self)
+        if handler.handover:  # emulate the thread of the lane
+            handler.resume(*handler.handover)
 
 
 @patch('ssl.wrap_socket', Mock(return_value=0))
@@ -81,20 +107,102 @@ class TestRestApiHandler(unittest.TestCase):
 
     def test_do_GET(self):
         MockRestApiServer(RestApiHandler, b'GET /replica')
-        with patch.object(RestApiHandler, 'get_postgresql_status', Mock(return_value={})):
+        with patch.object(RestApiServer, 'get_postgresql_status', Mock(return_value={})):
             MockRestApiServer(RestApiHandler, b'GET /replica')
-        with patch.object(RestApiHandler, 'get_postgresql_status', Mock(return_value={'role': 'master'})):
+        with patch.object(RestApiServer, 'get_postgresql_status', Mock(return_value={'role': 'master'})):
             MockRestApiServer(RestApiHandler, b'GET /replica')
         MockRestApiServer(RestApiHandler, b'GET /master')
         MockPatroni.dcs.cluster.leader.name = MockPostgresql.name
         MockRestApiServer(RestApiHandler, b'GET /replica')
         MockPatroni.dcs.cluster = None
-        with patch.object(RestApiHandler, 'get_postgresql_status', Mock(return_value={'role': 'master'})):
+        with patch.object(RestApiServer, 'get_postgresql_status', Mock(return_value={'role': 'master'})):
             MockRestApiServer(RestApiHandler, b'GET /master')
         with patch.object(MockHa, 'restart_scheduled', Mock(return_value=True)):
             MockRestApiServer(RestApiHandler, b'GET /master')
         self.assertIsNotNone(MockRestApiServer(RestApiHandler, b'GET /master'))
 
+    @patch.object(RestApiHandler, 'write_response')
+    def test_do_GET_replica_lag(self, mock_write_response):
+        status = {'state': 'running', 'role': 'replica', 'xlog': {'received_location': 200, 'replayed_location': 100,
+                  'replayed_timestamp': '2016-01-01 00:00:00.000 UTC', 'paused': False}}
+        cluster = Mock(last_leader_operation=1000)
+        cluster.leader.name = 'leader'
+
+        def status_code(path):
+            MockRestApiServer(RestApiHandler, b'GET ' + path)
+            return mock_write_response.call_args[0][0]
+
+        with patch.object(RestApiServer, 'get_postgresql_status', Mock(return_value=status)), \
+                patch.object(MockPatroni.dcs, 'cluster', cluster):
+            self.assertEqual(status_code(b'/replica'), 200)
+            self.assertEqual(status_code(b'/read-only'), 200)
+            self.assertEqual(status_code(b'/replica?lag=1000'), 200)
+            self.assertEqual(status_code(b'/read-only?lag=899'), 503)
+            self.assertEqual(status_code(b'/replica?lag=foo'), 503)
+            self.assertEqual(status_code(b'/replica?replay_delay=60'), 503)
+            status['xlog']['received_location'] = 100  # everything is replayed, the master is idle
+            self.assertEqual(status_code(b'/replica?replay_delay=60'), 200)
+            status.update(role='master', xlog={'location': 1000})
+            with patch.object(MockPostgresql, 'name', 'leader'):
+                self.assertEqual(status_code(b'/read-only?lag=0'), 200)
+                self.assertEqual(status_code(b'/replica'), 503)
+
+    @patch('patroni.zookeeper.KazooClient', MockKazooClient)
+    @patch.object(RestApiHandler, 'write_response')
+    def test_do_GET_replica_lag_zookeeper(self, mock_write_response):
+        # ZooKeeper doesn't read the optime key, the location of the leader is taken from its member key
+        def get(client, path, watch=None):
+            if path.endswith('/members/foo'):
+                return b'{"conn_url":"postgres://foo","xlog_location":1000}', ZnodeStat(0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+            return mock_get(client, path, watch)
+
+        mock_get = MockKazooClient.get
+        zk = ZooKeeper('bar', {'hosts': ['localhost:2181'], 'scope': 'test'})
+        with patch.object(MockKazooClient, 'get', get):
+            cluster = zk.get_cluster()
+        self.assertEqual((cluster.last_leader_operation, cluster.leader.name), (0, 'foo'))
+
+        status = {'state': 'running', 'role': 'replica', 'xlog': {'replayed_location': 100}}
+        with patch.object(RestApiServer, 'get_postgresql_status', Mock(return_value=status)), \
+                patch.object(MockPatroni.dcs, 'cluster', cluster):
+            MockRestApiServer(RestApiHandler, b'GET /replica?lag=899')
+            self.assertEqual(mock_write_response.call_args[0][0], 503)
+            MockRestApiServer(RestApiHandler, b'GET /replica?lag=900')
+            self.assertEqual(mock_write_response.call_args[0][0], 200)
+
+    @patch.object(RestApiHandler, 'write_response')
+    @patch.object(PostgresStatusSampler, 'sample', Mock())  # the sampler is stuck
+    def test_do_GET_without_status(self, mock_write_response):
+        with patch.object(MockPatroni.dcs, 'cluster', None), \
+                patch.object(RestApiServer, 'get_postgresql_status') as mock_get_postgresql_status:
+            MockRestApiServer(RestApiHandler, b'GET /replica')
+        mock_write_response.assert_called_once_with(503, b'{"state": "unknown"}', 'application/json')
+        self.assertFalse(mock_get_postgresql_status.called)
+
+    def test_poll_failover_result(self):
+        handler = RestApiHandler.__new__(RestApiHandler)
+        handler.server = Mock()
+        wait = handler.server.patroni.dcs.wait_for_cluster_change
+        old = Cluster(True, Leader(0, 0, Member(0, 'foo', 30, {})), 0, [], Failover(0, 'foo', None, None))
+        new = Cluster(True, Leader(1, 0, Member(0, 'bar', 30, {})), 0, [], None)
+
+        wait.side_effect = [None, old, new]
+        status, message = handler.poll_failover_result('foo', 'bar')
+        self.assertEqual(status, 200)
+        self.assertTrue(message.startswith(b'Successfully failed over to bar in '))
+        wait.side_effect = [new]
+        self.assertTrue(handler.poll_failover_result('foo', 'baz')[1].startswith(b'Failed over to "bar" instead'))
+        # the first snapshot was loaded before the failover key had been written
+        without_failover = old._replace(failover=None)
+        wait.side_effect = [without_failover, old, without_failover]
+        self.assertTrue(handler.poll_failover_result('foo', 'bar')[1].startswith(b'Failover failed after '))
+        wait.side_effect = None
+        wait.return_value = without_failover
+        with patch.object(RestApiHandler, 'FAILOVER_TIMEOUT', 0.01):
+            self.assertEqual(handler.poll_failover_result('foo', 'bar'), (503, b'Failover status unknown'))
+        with patch.object(RestApiHandler, 'FAILOVER_TIMEOUT', 0):
+            self.assertEqual(handler.poll_failover_result('foo', 'bar'), (503, b'Failover status unknown'))
+
     def test_do_OPTIONS(self):
         self.assertIsNotNone(MockRestApiServer(RestApiHandler, b'OPTIONS / HTTP/1.0'))
 
@@ -109,9 +217,45 @@ class TestRestApiHandler(unittest.TestCase):
             makefile.return_value.flush = Mock(side_effect=socket.error('foo'))
             MockRestApiServer(RestApiHandler, b'OPTIONS / HTTP/1.0')
 
+    def test_do_GET_events(self):
+        with patch.object(EventStream, 'subscribe') as mock_subscribe:
+            self.assertIsNotNone(MockRestApiServer(RestApiHandler, b'GET /events HTTP/1.1'))
+            self.assertTrue(mock_subscribe.called)
+
+    def test_do_GET_cluster(self):
+        with patch.object(ClusterStatusCache, 'get', Mock(return_value=b'{}')):
+            self.assertIsNotNone(MockRestApiServer(RestApiHandler, b'GET /cluster'))
+        with patch.object(ClusterStatusCache, 'get', Mock(return_value=None)):
+            self.assertIsNotNone(MockRestApiServer(RestApiHandler, b'GET /cluster'))
+
     def test_do_GET_patroni(self):
         self.assertIsNotNone(MockRestApiServer(RestApiHandler, b'GET /patroni'))
 
+    def test_do_GET_dcs(self):
+        with patch.object(MockPatroni.dcs, 'get_metrics', Mock(return_value={'endpoint': None, 'operations': {}})), \
+                patch.object(RestApiHandler, 'resume') as mock_resume:
+            self.assertIsNotNone(MockRestApiServer(RestApiHandler, b'GET /dcs'))
+            self.assertFalse(mock_resume.called)  # answered by the worker, not in the status lane
+
+    @patch.object(RestApiHandler, 'write_response')
+    def test_do_GET_metrics(self, mock_write_response):
+        status = {'state': 'running', 'role': 'replica', 'xlog': {'received_location': 2, 'replayed_location': 1,
+                  'replayed_timestamp': '2016-01-01 00:00:00.000 UTC', 'paused': False}}
+        dcs_metrics = {'last_seen': None, 'operations': {'get_cluster': dict(Histogram().snapshot(), errors=1,
+                       failures=0, retries=0, bytes_sent=0, bytes_received=10)}}
+        with patch.object(RestApiServer, 'get_postgresql_status', Mock(return_value=status)), \
+                patch.object(MockPatroni.dcs, 'get_metrics', Mock(return_value=dcs_metrics)), \
+                patch.object(RestApiHandler, 'resume', Mock(side_effect=Exception)):  # not in the status lane
+            MockRestApiServer(RestApiHandler, b'GET /metrics')
+        body = mock_write_response.call_args[0][1].decode('utf-8')
+        self.assertIn('patroni_postgres_role{role="replica"} 1\n', body)
+        self.assertIn('patroni_xlog_replayed_location 1\n', body)
+        self.assertIn('patroni_xlog_replay_lag_seconds ', body)
+        self.assertIn('patroni_async_action_in_progress{action="restart"} 1\n', body)
+        self.assertIn('patroni_postgres_promotions_total 1\n', body)
+        self.assertIn('patroni_dcs_errors_total{operation="get_cluster"} 1\n', body)
+        self.assertIn('patroni_dcs_operation_duration_seconds_count{operation="get_cluster"} 0\n', body)
+
     def test_basicauth(self):
         self.assertIsNotNone(MockRestApiServer(RestApiHandler, b'POST /restart HTTP/1.0'))
         MockRestApiServer(RestApiHandler, b'POST /restart HTTP/1.0\nAuthorization:')
@@ -124,7 +268,7 @@ class TestRestApiHandler(unittest.TestCase):
 
     @patch.object(MockHa, 'dcs')
     def test_do_POST_reinitialize(self, dcs):
-        cluster = dcs.get_cluster.return_value
+        cluster = dcs.cluster
         request = b'POST /reinitialize HTTP/1.0\nAuthorization: Basic dGVzdDp0ZXN0'
         MockRestApiServer(RestApiHandler, request)
         cluster.is_unlocked.return_value = False
@@ -132,19 +276,27 @@ class TestRestApiHandler(unittest.TestCase):
         with patch.object(MockHa, 'schedule_reinitialize', Mock(return_value=None)):
             MockRestApiServer(RestApiHandler, request)
         cluster.leader.name = 'test'
+        MockRestApiServer(RestApiHandler, request)
+        dcs.cluster = None
         self.assertIsNotNone(MockRestApiServer(RestApiHandler, request))
 
     @patch('time.sleep', Mock())
     def test_RestApiServer_query(self):
         with patch.object(MockCursor, 'execute', Mock(side_effect=psycopg2.OperationalError)):
             self.assertIsNotNone(MockRestApiServer(RestApiHandler, b'GET /patroni'))
-        with patch.object(MockPostgresql, 'connection', Mock(side_effect=psycopg2.OperationalError)):
+        with patch.object(MockPostgresql, 'connect', Mock(side_effect=psycopg2.OperationalError)):
             self.assertIsNotNone(MockRestApiServer(RestApiHandler, b'GET /patroni'))
 
     @patch('time.sleep', Mock())
     @patch.object(MockHa, 'dcs')
     def test_do_POST_failover(self, dcs):
-        cluster = dcs.get_cluster.return_value
+        cluster = dcs.cluster
+        MockRestApiServer(RestApiHandler, b'POST /failover HTTP/1.0\nContent-Length: foo\n\n')
+        with patch.object(RestApiHandler, 'send_error') as mock_send_error, \
+                patch.object(RestApiHandler, 'do_POST_failover') as mock_do_POST_failover:
+            MockRestApiServer(RestApiHandler, b'POST /failover HTTP/1.0\nContent-Length: 16385\n\n')
+            mock_send_error.assert_called_once_with(413, 'Request Entity Too Large')
+            self.assertFalse(mock_do_POST_failover.called)
 
         request = b'POST /failover HTTP/1.0\nAuthorization: Basic dGVzdDp0ZXN0\n' +\
                   b'Content-Length: 0\n\n'
@@ -169,7 +321,7 @@ class TestRestApiHandler(unittest.TestCase):
                            Member(0, 'postgresql2', 30, {'api_url': 'http'})]
         MockRestApiServer(RestApiHandler, request)
         with patch.object(MockPatroni, 'dcs') as d:
-            cluster = d.get_cluster.return_value
+            cluster = d.cluster
             cluster.leader.name = 'postgresql0'
             MockRestApiServer(RestApiHandler, request)
             cluster.leader.name = 'postgresql2'
@@ -177,12 +329,14 @@ class TestRestApiHandler(unittest.TestCase):
             cluster.leader.name = 'postgresql1'
             cluster.failover = None
             MockRestApiServer(RestApiHandler, request)
-            d.get_cluster = Mock(side_effect=Exception)
+            d.cluster = None
             MockRestApiServer(RestApiHandler, request)
             d.manual_failover.return_value = False
             MockRestApiServer(RestApiHandler, request)
         with patch.object(MockHa, 'fetch_nodes_statuses', Mock(return_value=[])):
             MockRestApiServer(RestApiHandler, request)
+        dcs.cluster = None
+        MockRestApiServer(RestApiHandler, request)
 
         # Valid future date
         request = b'POST /failover HTTP/1.0\nAuthorization: Basic dGVzdDp0ZXN0\nContent-Length: 103\n\n{"leader": ' +\
@@ -203,3 +357,347 @@ class TestRestApiHandler(unittest.TestCase):
         request = b'POST /failover HTTP/1.0\nAuthorization: Basic dGVzdDp0ZXN0\nContent-Length: 103\n\n{"leader": ' +\
                   b'"postgresql1", "member": "postgresql2", "scheduled_at": "2010-02-29T18:13:30.568224+01:00"}'
         self.assertIsNotNone(MockRestApiServer(RestApiHandler, request))
+
+
+class TestClusterStatus(unittest.TestCase):
+
+    @patch('ssl.wrap_socket', Mock(return_value=0))
+    def setUp(self):
+        self.server = MockRestApiServer(RestApiHandler, b'GET /')
+
+    def test_get_cluster_status(self):
+        members = [Member(0, 'test', 30, {'api_url': 'http://test/patroni', 'role': 'master'}),
+                   Member(0, 'foo', 30, {'api_url': 'http://foo/patroni'}),
+                   Member(0, 'bar', 30, {'api_url': 'http://bar/patroni', 'role': 'replica', 'state': 'running'}),
+                   Member(0, 'baz', 30, {})]
+        cluster = Cluster(True, Leader(0, 30, members[0]), 100, members, Failover(0, 'test', 'foo', None))
+
+        def requests_get(url, **kwargs):
+            self.assertTrue(url.endswith('/read-only'))  # peers answer it from memory, without SQL
+            if 'bar' in url:
+                raise Exception
+            status = {'role': 'replica', 'state': 'running', 'xlog': {'replayed_location': 60}}
+            return Mock(json=Mock(return_value=status))
+
+        master = {'state': 'running', 'role': 'master', 'xlog': {'location': 100}}
+        with patch.object(MockPatroni.dcs, 'cluster', cluster), patch('requests.get', requests_get), \
+                patch.object(RestApiServer, 'get_postgresql_status', Mock(return_value=master)):
+            self.server.status.sample()
+            status = json.loads(self.server.get_cluster_status().decode('utf-8'))
+            pool = self.server._fetch_pool
+            self.server.get_cluster_status()
+            self.assertIs(self.server._fetch_pool, pool)  # threads are reused
+            self.assertEqual(pool._processes, RestApiServer.FETCH_WORKERS)
+        self.assertEqual(status['leader'], 'test')
+        self.assertEqual(status['failover']['candidate'], 'foo')
+        test, foo, bar, baz = status['members']
+        self.assertTrue(test['leader'])
+        self.assertEqual(foo['lag'], 40)
+        self.assertEqual((bar['reachable'], bar['role'], bar['state']), (False, 'replica', 'running'))
+        self.assertFalse(baz['reachable'])
+
+        with patch.object(MockPatroni.dcs, 'cluster', None):
+            self.assertIsNone(self.server.get_cluster_status())
+
+    def test_get_stale_cluster_status(self):
+        cluster = get_cluster_initialized_with_leader()
+        with patch.object(MockPatroni.dcs, 'cached_cluster', cluster), \
+                patch.object(MockPatroni.dcs, 'last_seen', None), patch('requests.get') as mock_get:
+            status = json.loads(self.server.get_stale_cluster_status().decode('utf-8'))
+            self.assertFalse(mock_get.called)
+            self.assertTrue(status['stale'])
+            self.assertEqual(status['leader'], 'leader')
+            self.assertEqual([m['reachable'] for m in status['members']], [None, None])
+            with patch.object(MockPatroni.dcs, 'last_seen', 1):  # the cluster has been read from DCS
+                self.assertIsNone(self.server.get_stale_cluster_status())
+
+    def test_ttl(self):
+        self.assertEqual(self.server.cluster_status.ttl, 10)  # loop_wait
+        for ttl, expected in ((1, 10), (30, 30)):
+            server = LoopRestApiServer(cluster_status_ttl=ttl)
+            self.assertEqual(server.cluster_status.ttl, expected)
+            server.server_close()
+
+    def test_cache(self):
+        started, finish = Event(), Event()
+
+        def fan_out():
+            started.set()
+            finish.wait()
+            return b'{}'
+
+        cache = ClusterStatusCache(Mock(side_effect=fan_out), 10)
+        results = []
+        threads = [Thread(target=lambda: results.append(cache.get())) for _ in range(3)]
+        threads[0].start()
+        started.wait()
+        for t in threads[1:]:
+            t.start()
+        finish.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [b'{}'] * 3)
+        self.assertEqual(cache.get(), b'{}')
+        self.assertEqual(cache._fan_out.call_count, 1)
+
+        cache.ttl = 0
+        cache._fan_out.side_effect = Exception
+        self.assertRaises(Exception, cache.get)
+
+
+class TestPostgresStatusSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Mock()
+        self.server.get_status.return_value = {'role': 'master'}
+        self.sampler = PostgresStatusSampler(self.server, 1, 3)
+
+    def test_get(self):
+        self.assertEqual(self.sampler.get(), PostgresStatusSampler.UNKNOWN)
+        self.sampler.sample()
+        self.assertEqual(self.sampler.get(), ({'role': 'master'}, b'{"role": "master"}'))
+        self.server.get_status.return_value = {'role': 'replica'}
+        self.assertEqual(self.sampler.get()[0], {'role': 'master'})
+
+        # the snapshot is too old, the request doesn't query Postgres
+        with patch('time.time', Mock(return_value=time.time() + 4)):
+            self.assertEqual(self.sampler.get()[0], {'state': 'unknown'})
+        self.assertEqual(self.server.get_status.call_count, 1)
+
+    @patch('time.sleep', Mock(side_effect=[None, SleepException]))
+    def test_run(self):
+        self.server.get_status.side_effect = [Exception, {'role': 'replica'}]
+        self.assertRaises(SleepException, self.sampler.run)
+        self.assertEqual(self.sampler.get()[0], {'role': 'replica'})
+
+    @patch('ssl.wrap_socket', Mock(return_value=0))
+    @patch.object(PostgresStatusSampler, 'start')
+    @patch.object(Thread, 'start')
+    def test_start(self, mock_thread_start, mock_sampler_start):
+        MockRestApiServer(RestApiHandler, b'GET /').start()
+        mock_sampler_start.assert_called_once_with()
+
+
+class TestEventStream(unittest.TestCase):
+
+    def setUp(self):
+        self.events = EventStream()
+        self.client, server = socket.socketpair()
+        self.addCleanup(self.client.close)
+        self.events._process('leader', {'leader': 'foo'})
+        self.events._process(None, server)
+
+    def read(self):
+        return self.client.recv(4096).decode('utf-8')
+
+    def test_process(self):
+        self.assertEqual(self.read(), 'id: 1\nevent: leader\ndata: {"leader": "foo"}\n\n')
+        self.events._process('leader', {'leader': 'foo'})  # the same value isn't sent
+        self.events._process('failover', None)
+        self.assertEqual(self.read(), 'id: 2\nevent: failover\ndata: null\n\n')
+
+        self.client.close()
+        self.events._process('leader', {'leader': None})
+        self.assertEqual(self.events._subscribers, [])
+
+    @patch.object(EventStream, 'KEEPALIVE_INTERVAL', 0.01)
+    def test_run(self):
+        self.read()
+        self.events.start()
+        self.assertEqual(self.read(), ': keepalive\n\n')
+        self.events.publish('member', {'role': 'master'})
+        self.assertIn('data: {"role": "master"}', self.read())
+
+    def test_subscribe(self):
+        self.events._last.clear()
+        client, server = socket.socketpair()
+        self.events.subscribe(server)
+        self.events._process(*self.events._queue.get())
+        self.assertEqual(client.recv(4096), b': ok\n\n')
+        client.close()
+
+
+class LoopRestApiServer(RestApiServer):
+
+    def __init__(self, **config):
+        self.socket = 0
+        config.update(listen='127.0.0.1:0', status_interval=3600)
+        with patch.object(BaseHTTPServer.HTTPServer, '__init__', Mock()):
+            super(LoopRestApiServer, self).__init__(MockPatroni(), config)
+        self.status.sample()
+        TCPServer.__init__(self, ('127.0.0.1', 0), RestApiHandler)
+
+    def connect(self, request=None):
+        conn = socket.create_connection(self.server_address, timeout=5)
+        if request:
+            conn.sendall(request)
+        return conn
+
+
+class TestRestApiServerLoop(unittest.TestCase):
+
+    def run_server(self, **config):
+        server = LoopRestApiServer(**config)
+        server.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def test_request(self):
+        server = self.run_server()
+        conn = server.connect(b'GET /master HTTP/1.0\r\n\r\n')
+        response = conn.makefile('rb').read()  # HTTP/1.0 connection is closed after the response
+        self.assertTrue(response.startswith(b'HTTP/1.1 '))
+        self.assertIn(b'Connection: close', response)
+        conn.close()
+
+    def test_keepalive(self):
+        server = self.run_server(keepalive_requests=3, auth='test:test')
+        conn = HTTPConnection(*server.server_address, timeout=5)
+        sockets = []
+        for i in range(2):
+            conn.request('GET', '/master')
+            response = conn.getresponse()
+            self.assertIn(b'"state": "running"', response.read())
+            self.assertIsNone(response.getheader('Connection'))
+            sockets.append(conn.sock)
+        self.assertIs(sockets[0], sockets[1])
+        conn.request('POST', '/restart', '{}', {'Authorization': 'Basic Zm9vOmJhcg=='})
+        response = conn.getresponse()
+        self.assertEqual(response.status, 401)
+        self.assertEqual(response.read(), b'not authenticated')
+        self.assertEqual(response.getheader('Connection'), 'close')  # keepalive_requests
+        conn.close()
+
+    def test_pipelining(self):
+        server = self.run_server()
+        conn = server.connect(b'OPTIONS / HTTP/1.1\r\n\r\nGET /patroni HTTP/1.1\r\nConnection: close\r\n\r\n')
+        response = conn.makefile('rb').read()
+        self.assertEqual(response.count(b'HTTP/1.1 '), 2)
+        self.assertIn(b'Content-Length: 0\r\n', response)
+        conn.close()
+
+    def test_events(self):
+        server = self.run_server()
+        conn = server.connect(b'GET /events HTTP/1.1\r\n\r\n')
+        response = conn.makefile('rb')
+        self.assertEqual(response.readline(), b'HTTP/1.1 200 OK\r\n')
+        while response.readline() != b'\r\n':
+            pass
+        self.assertEqual(response.readline() + response.readline(), b': ok\n\n')
+        server.events.publish('leader', {'leader': 'foo'})
+        self.assertEqual(response.readline(), b'id: 1\n')
+        conn.close()
+
+    def test_keepalive_timeout(self):
+        server = self.run_server(keepalive_timeout=0.1)
+        conn = server.connect(b'GET /master HTTP/1.1\r\n\r\n')
+        response = conn.makefile('rb').read()  # returns after the idle connection is closed by the server
+        self.assertTrue(response.endswith(b'}'))
+        conn.close()
+
+    def test_idle_connection(self):
+        server = self.run_server(request_timeout=0.1)
+        conn = server.connect()
+        self.assertEqual(conn.recv(1), b'')  # closed by the server
+        conn.close()
+
+    def test_lanes(self):
+        server = self.run_server(lanes={'control': {'max_queued_requests': 1, 'queue_timeout': 0.2}})
+        restarting, finish = Event(), Event()
+
+        def restart():
+            restarting.set()
+            finish.wait()
+            return True, 'restarted'
+
+        request = b'POST /restart HTTP/1.1\r\nAuthorization: Basic dGVzdDp0ZXN0\r\nConnection: close\r\n\r\n'
+        with patch.object(MockHa, 'restart', Mock(side_effect=restart)):
+            running = server.connect(request)
+            self.assertTrue(restarting.wait(5))
+            queued = server.connect(request)
+            time.sleep(0.1)  # the request must be queued before the next one
+            rejected = server.connect(request)
+            self.assertTrue(rejected.makefile('rb').read().startswith(b'HTTP/1.1 503 '))
+
+            # health checks are answered while the control lane is busy
+            health = server.connect(b'GET /master HTTP/1.0\r\n\r\n')
+            self.assertIn(b'"state": "running"', health.makefile('rb').read())
+            time.sleep(0.2)
+            finish.set()
+            self.assertTrue(running.makefile('rb').read().endswith(b'restarted'))
+            response = queued.makefile('rb').read()
+            self.assertTrue(response.startswith(b'HTTP/1.1 503 '))  # has waited longer than queue_timeout
+            self.assertIn(b'Retry-After: 1\r\n', response)
+        for conn in (running, queued, rejected, health):
+            conn.close()
+
+    def test_slow_request(self):
+        server = self.run_server(request_timeout=0.3)
+        conn = server.connect(b'GET /master HTTP/1.1\r\n')
+        conn.settimeout(0.05)
+        response = None
+        end_time = time.time() + 5
+        while response is None and time.time() < end_time:
+            try:
+                conn.sendall(b'X')  # every recv() of the worker gets data before the timeout of the socket
+                response = conn.recv(4096)
+            except socket.timeout:
+                pass
+            except socket.error:
+                response = b''
+        self.assertEqual(response, b'')  # closed by the server without response
+        conn.close()
+
+    def test_too_many_requests(self):
+        server = self.run_server(workers=0, max_queued_requests=1)
+        queued = server.connect(b'GET /master HTTP/1.0\r\n\r\n')
+        rejected = server.connect(b'GET /master HTTP/1.0\r\n\r\n')
+        self.assertEqual(rejected.recv(1), b'')
+        queued.close()
+        rejected.close()
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.connect = Mock(side_effect=psycopg2_connect)
+        self.pool = ConnectionPool(self.connect, 1)
+
+    def test_query(self):
+        self.assertEqual(self.pool.query('SELECT pg_is_in_recovery()'), [(False,)])
+        self.assertEqual(self.pool.query('SELECT pg_is_in_recovery()'), [(False,)])
+        self.assertEqual(self.connect.call_count, 1)
+        self.assertRaises(psycopg2.OperationalError, self.pool.query, 'blabla')
+        self.assertEqual(self.connect.call_count, 1)
+
+    @patch.object(ConnectionPool, 'WAIT_TIMEOUT', 0.01)
+    def test_exhausted(self):
+        conn, _ = self.pool._checkout()
+        self.assertRaises(PostgresConnectionException, self.pool.query, 'SELECT 1')
+        self.pool._release(conn)
+        self.assertIsNotNone(self.pool.query('SELECT 1'))
+
+    def test_reconnect(self):
+        self.pool.query('SELECT 1')
+        self.pool._idle[0].closed = 2
+        self.assertIsNotNone(self.pool.query('SELECT 1'))
+        self.assertEqual(self.connect.call_count, 2)
+
+        # Postgres has been restarted while the connection was idle
+        conn = self.pool._idle[0]
+
+        def execute(cursor, sql, *params):
+            if cursor.connection is conn:
+                conn.closed = 2
+                raise psycopg2.OperationalError
+
+        with patch.object(MockCursor, 'execute', execute):
+            self.assertEqual(self.pool.query('SELECT 1'), [])
+        self.assertEqual(self.connect.call_count, 3)
+        self.assertEqual(self.pool._open, 1)
+
+        self.connect.side_effect = psycopg2.OperationalError
+        self.pool.close()
+        self.assertRaises(PostgresConnectionException, self.pool.query, 'SELECT 1')
+        self.assertEqual(self.pool._open, 0)
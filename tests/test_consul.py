@@ -0,0 +1,284 @@
+import base64
+import json
+import threading
+import time
+import unittest
+import uuid
+
+from mock import patch
+from patroni.consul import Consul, ConsulError, ConsulInternalError
+from patroni.dcs import get_dcs_class
+from requests.exceptions import RequestException
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import TCPServer, ThreadingMixIn
+from six.moves.urllib_parse import parse_qs, urlparse
+
+
+class MockConsulHandler(BaseHTTPRequestHandler):
+
+    """Emulates the subset of Consul HTTP API used by `patroni.consul`"""
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code, body=None, index=None):
+        body = (body if isinstance(body, str) else json.dumps(body)).encode('utf-8') if body is not None else b''
+        self.send_response(code)
+        self.send_header('Content-Length', len(body))
+        self.send_header('X-Consul-Index', index or self.server.index)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _parse(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        return url.path, params, self.rfile.read(length).decode('utf-8') if length else ''
+
+    def _kv_nodes(self, key, recurse):
+        return [dict(Key=k, Value=base64.b64encode(v['Value'].encode('utf-8')).decode('utf-8'),
+                     ModifyIndex=v['ModifyIndex'], Session=v['Session']) for k, v in sorted(self.server.kv.items())
+                if (k.startswith(key) if recurse else k == key)]
+
+    def do_GET(self):
+        path, params, _ = self._parse()
+        key = path[len('/v1/kv/'):]
+        recurse = 'recurse' in params
+        with self.server.cond:
+            if 'index' in params:
+                end_time = time.time() + float(params.get('wait', '1s')[:-2]) / 1000.0
+                while max([n['ModifyIndex'] for n in self._kv_nodes(key, recurse)] or [0]) <= int(params['index'])\
+                        and self.server.deleted_index <= int(params['index']) and time.time() < end_time:
+                    self.server.cond.wait(end_time - time.time())
+            nodes = self._kv_nodes(key, recurse)
+            index = max([n['ModifyIndex'] for n in nodes] + [self.server.deleted_index]) if 'index' in params else None
+        self._reply(200, nodes, index) if nodes else self._reply(404, index=index)
+
+    def do_PUT(self):
+        path, params, body = self._parse()
+        server = self.server
+        if server.fail:
+            return self._reply(500, 'rpc error: No cluster leader')
+        if path == '/v1/session/create':
+            session = str(uuid.uuid4())
+            server.sessions[session] = json.loads(body)
+            return self._reply(200, {'ID': session})
+        if path.startswith('/v1/session/renew/'):
+            session = path[len('/v1/session/renew/'):]
+            return self._reply(200, [server.sessions[session]]) if session in server.sessions else self._reply(404)
+
+        key = path[len('/v1/kv/'):]
+        with server.cond:
+            node = server.kv.get(key)
+            if 'cas' in params and (int(params['cas']) == 0 and node is not None or
+                                    int(params['cas']) != 0 and (node is None or
+                                                                 node['ModifyIndex'] != int(params['cas']))):
+                return self._reply(200, 'false')
+            session = node and node['Session']
+            if 'acquire' in params:
+                if params['acquire'] not in server.sessions or session and session != params['acquire']:
+                    return self._reply(200, 'false')
+                session = params['acquire']
+            elif 'release' in params:
+                if session != params['release']:
+                    return self._reply(200, 'false')
+                session = None
+                body = node['Value']
+            server.set(key, body, session)
+        self._reply(200, 'true')
+
+    def do_DELETE(self):
+        path, params, _ = self._parse()
+        key = path[len('/v1/kv/'):]
+        with self.server.cond:
+            self.server.delete([k for k in self.server.kv if (k.startswith(key) if 'recurse' in params else k == key)])
+        self._reply(200, 'true')
+
+
+class MockConsul(ThreadingMixIn, HTTPServer, threading.Thread):
+
+    daemon_threads = True
+
+    def __init__(self):
+        # HTTPServer.__init__ is replaced with Mock in test_api
+        TCPServer.__init__(self, ('127.0.0.1', 0), MockConsulHandler)
+        threading.Thread.__init__(self, target=self.serve_forever)
+        self.daemon = True
+        self.cond = threading.Condition()
+        self.kv = {}
+        self.sessions = {}
+        self.index = 1
+        self.deleted_index = 0
+        self.fail = False
+
+    def set(self, key, value, session=None):
+        self.index += 1
+        self.kv[key] = {'Value': value, 'ModifyIndex': self.index, 'Session': session}
+        self.cond.notify_all()
+
+    def delete(self, keys):
+        self.index += 1
+        for k in keys:
+            self.kv.pop(k, None)
+            self.deleted_index = self.index
+        self.cond.notify_all()
+
+    def invalidate(self, session):
+        """Emulates expiration of the session with behavior `delete`"""
+        with self.cond:
+            self.sessions.pop(session)
+            self.delete([k for k, v in self.kv.items() if v['Session'] == session])
+
+    @property
+    def url(self):
+        return '{0}:{1}'.format(*self.server_address)
+
+
+class TestConsul(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = MockConsul()
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.server.kv.clear()
+        self.server.sessions.clear()
+        self.c = Consul('foo', {'ttl': 30, 'host': self.server.url, 'scope': 'test'})
+        self.c2 = Consul('bar', {'ttl': 30, 'host': self.server.url, 'scope': 'test'})
+
+    def test_get_dcs_class(self):
+        self.assertEqual(get_dcs_class('consul'), Consul)
+
+    def test_session(self):
+        self.assertEqual(self.c._session_ttl, 15)
+        self.assertFalse(self.c.update_leader())
+        self.c.ensure_session()
+        self.assertEqual(self.server.sessions[self.c._session]['LockDelay'], '0s')
+        self.c.get_cluster()
+        self.assertFalse(self.c.update_leader())  # doesn't hold the lock
+        self.assertTrue(self.c.attempt_to_acquire_leader())
+
+        # the session is renewed only once per HA cycle
+        with patch.object(self.c, 'renew_session', wraps=self.c.renew_session) as mock_renew:
+            leader = self.c.get_cluster().leader
+            self.assertTrue(self.c.touch_member('postgres://foo'))
+            self.assertTrue(self.c.touch_member_status('[]'))
+            with patch.object(self.c, '_request') as mock_request:
+                self.assertTrue(self.c.update_leader())
+                self.assertFalse(mock_request.called)  # the leader key isn't written, watches aren't woken up
+            self.assertEqual(mock_renew.call_count, 1)
+        self.assertEqual(self.c.get_cluster().leader.index, leader.index)
+
+        # the session has expired, touch_member creates a new one, but the lock is gone
+        self.server.invalidate(self.c._session)
+        self.c.get_cluster()
+        self.assertTrue(self.c.touch_member('postgres://foo'))
+        self.assertFalse(self.c.update_leader())
+
+    def test_get_cluster(self):
+        cluster = self.c.get_cluster()
+        self.assertIsNone(cluster.leader)
+        self.assertEqual(cluster.members, [])
+
+        self.assertTrue(self.c.initialize(sysid='12345'))
+        self.assertFalse(self.c.initialize(sysid='54321'))
+        self.assertTrue(self.c.initialize(create_new=False, sysid='54321'))
+        self.assertTrue(self.c.touch_member('postgres://foo'))
+        self.assertTrue(self.c2.touch_member('postgres://bar'))
+        self.assertTrue(self.c2.touch_member_status('[1,"running","replica",1]'))
+        self.assertTrue(self.c.attempt_to_acquire_leader())
+        self.assertFalse(self.c2.attempt_to_acquire_leader())
+        self.assertTrue(self.c.write_leader_optime('1234'))
+        self.assertTrue(self.c.manual_failover('foo', 'bar'))
+
+        cluster = self.c2.get_cluster()
+        self.assertEqual(cluster.initialize, '54321')
+        self.assertEqual(cluster.leader.name, 'foo')
+        self.assertEqual(cluster.leader.member.conn_url, 'postgres://foo')
+        self.assertEqual(cluster.last_leader_operation, 1234)
+        self.assertEqual(sorted(m.name for m in cluster.members), ['bar', 'foo'])
+        self.assertEqual(cluster.get_member('bar').data['role'], 'replica')
+        self.assertEqual(cluster.failover.candidate, 'bar')
+        self.assertEqual(self.c2._cluster_index, self.server.index)
+        metrics = self.c2.get_metrics()
+        self.assertEqual(metrics['endpoint'], 'http://{0}/v1/'.format(self.server.url))
+        self.assertGreater(metrics['operations']['get_cluster']['bytes_received'], 0)
+        self.assertFalse(self.c.manual_failover('', '', index=cluster.failover.index + 100))
+        self.assertTrue(self.c.manual_failover('', '', index=cluster.failover.index))
+
+        # the session of the leader expires, leader and member keys disappear
+        self.server.invalidate(self.c._session)
+        cluster = self.c2.get_cluster()
+        self.assertIsNone(cluster.leader)
+        self.assertEqual([m.name for m in cluster.members], ['bar'])
+        self.assertTrue(self.c2.take_leader())
+
+        self.assertTrue(self.c.cancel_initialization())
+        self.assertIsNone(self.c.get_cluster().initialize)
+        self.assertTrue(self.c.delete_cluster())
+        self.assertEqual(self.server.kv, {})
+
+    def test_get_clusters(self):
+        other = Consul('foo', {'host': self.server.url, 'scope': 'other'})
+        self.c.attempt_to_acquire_leader()
+        other.touch_member('postgres://other')
+        clusters = self.c2.get_clusters(['test', 'other', 'missing'])
+        self.assertEqual(clusters['test'].leader.name, 'foo')
+        self.assertEqual(clusters['other'].members[0].conn_url, 'postgres://other')
+        self.assertIsNone(clusters['missing'].leader)
+        with patch.object(Consul, '_kv_get', side_effect=RequestException):
+            self.assertRaises(ConsulError, self.c.get_clusters, ['test', 'other'])
+
+    def test_delete_leader(self):
+        self.assertFalse(self.c.delete_leader())
+        self.c.attempt_to_acquire_leader()
+        self.assertFalse(self.c2.delete_leader())
+        self.assertTrue(self.c.delete_leader())
+        self.assertIsNone(self.c2.get_cluster().leader)
+        self.assertTrue(self.c2.attempt_to_acquire_leader())
+
+    def test_load_cluster(self):
+        with patch.object(Consul, '_kv_get', side_effect=RequestException):
+            self.assertRaises(ConsulError, self.c.get_cluster)
+        with patch.object(Consul, '_request', side_effect=ConsulInternalError):
+            self.assertFalse(self.c.touch_member(''))
+
+    def test_internal_error(self):
+        c = Consul('foo', {'host': self.server.url, 'scope': 'test'})
+        with patch.object(self.server, 'fail', True):
+            self.assertRaises(ConsulInternalError, c.create_session)
+
+    def test_watch(self):
+        self.assertFalse(self.c2.watch(0))
+        self.c.attempt_to_acquire_leader()
+        self.c2.get_cluster()
+
+        # leader key doesn't change
+        start = time.time()
+        self.assertFalse(self.c2.watch(1))
+        self.assertGreaterEqual(time.time() - start, 0.9)
+
+        # leader key changes while replica is waiting
+        threading.Timer(0.2, self.c.delete_leader).start()
+        start = time.time()
+        self.assertTrue(self.c2.watch(5))
+        self.assertLess(time.time() - start, 4)
+
+        # the leader doesn't watch its own key
+        self.c.attempt_to_acquire_leader()
+        self.c.get_cluster()
+        with patch('patroni.dcs.AbstractDCS.watch', return_value=False) as mock_watch:
+            self.assertFalse(self.c.watch(1))
+            mock_watch.assert_called_once_with(1)
+
+        self.c2.get_cluster()
+        with patch.object(Consul, '_kv_get', side_effect=RequestException), \
+                patch('patroni.dcs.AbstractDCS.watch', return_value=False) as mock_watch:
+            self.assertFalse(self.c2.watch(1))
+            self.assertTrue(mock_watch.called)
@@ -310,6 +310,9 @@ leader''')
         m = get_any_member(get_cluster_initialized_with_leader(), role='master')
         self.assertEquals(m.name, 'leader')
 
+        m = get_any_member(get_cluster_initialized_with_leader(), member='other')
+        self.assertEquals(m.name, 'other')
+
     def test_get_all_members(self):
         self.assertEquals(list(get_all_members(get_cluster_initialized_without_leader(), role='master')), [])
 
@@ -329,6 +332,23 @@ leader''')
         result = self.runner.invoke(members, ['alpha'])
         assert result.exit_code == 0
 
+        result = self.runner.invoke(members, ['alpha', '--cached'])
+        assert result.exit_code == 1
+
+        with patch('patroni.ctl.load_cached_cluster', Mock(return_value=get_cluster_initialized_with_leader())):
+            result = self.runner.invoke(members, ['alpha', '--cached'])
+            assert result.exit_code == 0
+
+        clusters = {'alpha': get_cluster_initialized_with_leader(), 'beta': get_cluster_initialized_without_leader()}
+        with patch('patroni.etcd.Etcd.get_clusters', Mock(return_value=clusters)) as mock_get_clusters:
+            result = self.runner.invoke(members, ['alpha', 'beta'])
+            assert result.exit_code == 0
+            mock_get_clusters.assert_called_once_with(['alpha', 'beta'])
+
+        with patch('patroni.etcd.Etcd._load_clusters', Mock(side_effect=NotImplementedError)):
+            result = self.runner.invoke(members, ['alpha', 'beta'])
+            assert result.exit_code == 0
+
     def test_configure(self):
         result = self.runner.invoke(configure, ['--dcs', 'abc', '-c', 'dummy', '-n', 'bla'])
         assert result.exit_code == 0
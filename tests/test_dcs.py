@@ -0,0 +1,213 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mock import Mock, patch
+from patroni.dcs import AbstractDCS, ClusterSnapshot, Member, get_dcs, get_dcs_class
+from patroni.ctl import load_cached_cluster
+from patroni.exceptions import PatroniCtlException
+from patroni.sqlite import SQLite
+from test_ha import get_cluster_initialized_with_leader, get_cluster_initialized_without_leader
+
+
+class TestClusterSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.snapshot = ClusterSnapshot.from_config({'snapshot_dir': self.tmpdir}, 'test')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_from_config(self):
+        self.assertIsNone(ClusterSnapshot.from_config({}, 'test'))
+        self.assertEqual(self.snapshot.path, os.path.join(self.tmpdir, 'test.json'))
+
+    def test_save_load(self):
+        self.assertEqual(self.snapshot.load(), (None, None))
+        cluster = get_cluster_initialized_with_leader()
+        self.assertTrue(self.snapshot.save(10, cluster))
+        self.assertFalse(self.snapshot.save(10, cluster))  # not changed
+        self.assertFalse(self.snapshot.save(10, get_cluster_initialized_without_leader()))  # the same index
+        with patch('patroni.dcs.logger.warning') as mock_warning:
+            self.assertFalse(self.snapshot.save(9, get_cluster_initialized_without_leader()))  # stale read
+            self.assertFalse(self.snapshot.save(8, get_cluster_initialized_without_leader()))
+            self.assertEqual(mock_warning.call_count, 1)
+
+        index, loaded = ClusterSnapshot(self.snapshot.path).load()
+        self.assertEqual(index, 10)
+        self.assertEqual(loaded.leader.name, cluster.leader.name)
+        self.assertEqual([m.name for m in loaded.members], [m.name for m in cluster.members])
+        self.assertEqual(os.listdir(self.tmpdir), ['test.json'])
+
+    def test_save_reset_index(self):
+        self.assertTrue(self.snapshot.save(5000, get_cluster_initialized_with_leader()))
+        # DCS has been restored from a backup
+        self.assertTrue(self.snapshot.save(5000 - ClusterSnapshot.MAX_INDEX_LAG - 1,
+                                           get_cluster_initialized_without_leader()))
+        # DCS has been replaced with another one
+        snapshot = ClusterSnapshot.from_config({'snapshot_dir': self.tmpdir}, 'test', 'zookeeper')
+        self.assertEqual(snapshot.load()[0], 3999)
+        self.assertTrue(snapshot.save(10, get_cluster_initialized_with_leader()))
+        self.assertEqual(ClusterSnapshot(snapshot.path).load()[0], 10)
+
+    @patch('os.rename', Mock(side_effect=OSError))
+    def test_save_failed(self):
+        self.assertFalse(self.snapshot.save(1, get_cluster_initialized_with_leader()))
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_load_invalid(self):
+        with open(self.snapshot.path, 'w') as f:
+            f.write('{"version": 0}')
+        self.assertEqual(self.snapshot.load(), (None, None))
+        with open(self.snapshot.path, 'w') as f:
+            f.write('{')
+        self.assertEqual(self.snapshot.load(), (None, None))
+
+    def test_get_dcs(self):
+        config = {'sqlite': {'scope': 'test', 'path': os.path.join(self.tmpdir, 'dcs.sqlite'),
+                             'snapshot_dir': '/nonexistent'}, 'snapshot_dir': self.tmpdir}
+        self.assertEqual(get_dcs('foo', config)._snapshot.path, self.snapshot.path)
+        # patronictl reads the same file
+        self.assertIsNone(load_cached_cluster(config, 'test'))
+
+    def test_load_cached_cluster(self):
+        self.assertRaises(PatroniCtlException, load_cached_cluster, {}, 'test')
+        self.assertIsNone(load_cached_cluster({'snapshot_dir': self.tmpdir}, 'test'))
+        self.snapshot.save(None, get_cluster_initialized_with_leader())
+        self.assertIsNotNone(load_cached_cluster({'snapshot_dir': self.tmpdir}, 'test'))
+
+
+class MockEntryPoint(object):
+
+    name = 'mock'
+
+    @staticmethod
+    def load():
+        return Mock
+
+
+@patch('pkg_resources.iter_entry_points', Mock(return_value=[MockEntryPoint()]))
+class TestGetDcs(unittest.TestCase):
+
+    def test_get_dcs_class(self):
+        self.assertEqual(get_dcs_class('zookeeper').__name__, 'ZooKeeper')
+        self.assertEqual(get_dcs_class('mock'), Mock)
+        self.assertIsNone(get_dcs_class('foo'))
+
+    def test_get_dcs(self):
+        self.assertIsInstance(get_dcs('foo', {'mock': {'scope': 'test'}}), Mock)
+        self.assertRaises(Exception, get_dcs, 'foo', {'foo': {}})
+        with patch.dict('sys.modules', {'pkg_resources': None}):
+            self.assertRaises(Exception, get_dcs, 'foo', {'mock': {'scope': 'test'}})
+
+
+class TestPublishMember(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config = {'ttl': 30, 'scope': 'test', 'path': os.path.join(self.tmpdir, 'dcs.sqlite')}
+        self.data = {'conn_url': 'postgres://foo', 'api_url': 'http://foo', 'tags': {},
+                     'state': 'running', 'role': 'master', 'xlog_location': 1}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_json(self):
+        dcs = SQLite('foo', self.config)
+        self.assertTrue(dcs.publish_member(self.data))
+        self.assertEqual(dcs.get_cluster().members[0].data, self.data)
+
+    def test_compact(self):
+        self.config['compact_member_data'] = True
+        dcs = SQLite('foo', self.config)
+        with patch.object(SQLite, 'touch_member', wraps=dcs.touch_member) as mock_touch_member:
+            self.assertTrue(dcs.publish_member(self.data))
+            member = dcs.get_cluster().members[0]
+            self.assertEqual(member.data, self.data)
+            for xlog_location in (2, 3):
+                self.data['xlog_location'] = xlog_location
+                self.assertTrue(dcs.publish_member(self.data))
+            self.assertEqual(mock_touch_member.call_count, 1)
+            member = dcs.get_cluster().members[0]
+            self.assertEqual(member.data['xlog_location'], 3)
+            self.assertEqual(member.conn_url, 'postgres://foo')
+
+            # static data has changed, or the member key has to be refreshed
+            self.data['tags'] = {'nofailover': True}
+            self.assertTrue(dcs.publish_member(self.data))
+            dcs._static_member_written_at = 0
+            self.assertTrue(dcs.publish_member(self.data))
+            self.assertEqual(mock_touch_member.call_count, 3)
+
+            mock_touch_member.side_effect = [False]
+            self.data['tags'] = {}
+            self.assertFalse(dcs.publish_member(self.data))
+
+        # old readers and writers
+        dcs.touch_member('postgres://bar@host/postgres?application_name=http://bar')
+        self.assertEqual(Member.from_node(1, 'foo', None, '{}', '[1,"running",null,5]').data,
+                         {'state': 'running', 'xlog_location': 5})
+        self.assertEqual(dcs.get_cluster().members[0].api_url, 'http://bar')
+
+    @patch.object(SQLite, 'touch_member_status', AbstractDCS.__dict__['touch_member_status'])
+    def test_not_implemented(self):
+        self.config['compact_member_data'] = True
+        dcs = SQLite('foo', self.config)
+        self.assertTrue(dcs.publish_member(self.data))  # the whole data is written into the member key
+        self.assertEqual(dcs.get_cluster().members[0].data, self.data)
+
+    def test_refresh(self):
+        self.config.update(compact_member_data=True, ttl=20)
+        dcs = SQLite('foo', self.config)
+        with patch('time.time', Mock(return_value=100)):
+            self.assertTrue(dcs.publish_member(self.data))
+            dcs.get_cluster()
+        with patch.object(SQLite, 'touch_member', Mock(return_value=True)) as mock_touch_member:
+            # with loop_wait 10 the next chance to refresh the key would be too late
+            for now, written in ((106, False), (110, True)):
+                with patch('time.time', Mock(return_value=now)):
+                    self.assertTrue(dcs.publish_member(self.data))
+                self.assertEqual(mock_touch_member.called, written)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dcs = SQLite('foo', {'ttl': 30, 'scope': 'test', 'path': os.path.join(self.tmpdir, 'dcs.sqlite')})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_operations(self):
+        self.dcs.get_cluster()
+        self.assertTrue(self.dcs.attempt_to_acquire_leader())
+        self.assertTrue(self.dcs.take_leader())
+        self.assertFalse(self.dcs.initialize(create_new=False))
+        with patch.object(SQLite, '_load_cluster', Mock(side_effect=Exception)):
+            self.assertRaises(Exception, self.dcs.get_cluster)
+        self.dcs.watch(0)
+
+        metrics = self.dcs.get_metrics()
+        self.assertEqual(metrics['backend'], 'sqlite')
+        self.assertEqual(metrics['endpoint'], os.path.join(self.tmpdir, 'dcs.sqlite'))
+        self.assertIsNotNone(metrics['last_seen'])
+        operations = metrics['operations']
+        self.assertEqual(operations['get_cluster']['count'], 2)
+        self.assertEqual(operations['get_cluster']['errors'], 1)
+        self.assertEqual(operations['initialize']['failures'], 1)
+        self.assertEqual(operations['take_leader']['count'], 1)
+        # SQLite.watch calls AbstractDCS.watch, it is measured only once
+        self.assertEqual(operations['watch']['count'], 1)
+        self.assertEqual(operations['watch']['buckets'][-1], ('+Inf', 1))
+
+    def test_wait_for_cluster_change(self):
+        cluster = self.dcs.get_cluster()
+        self.assertIs(self.dcs.wait_for_cluster_change(cluster, 0.01), cluster)
+        threading.Timer(0.1, self.dcs.get_cluster).start()
+        new_cluster = self.dcs.wait_for_cluster_change(cluster, 5)
+        self.assertIsNot(new_cluster, cluster)
+        self.assertIsNotNone(new_cluster)
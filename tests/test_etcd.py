@@ -1,8 +1,10 @@
 import etcd
 import json
 import requests
+import shutil
 import urllib3
 import socket
+import tempfile
 import unittest
 
 from dns.exception import DNSException
@@ -80,7 +82,7 @@ def etcd_read(self, key, **kwargs):
     elif key == '/service/nocluster/':
         raise etcd.EtcdKeyNotFound
 
-    response = {"action": "get", "node": {"key": "/service/batman5", "dir": True, "nodes": [
+    cluster = {"key": "/service/batman5", "dir": True, "nodes": [
                 {"key": "/service/batman5/failover", "value": "",
                  "modifiedIndex": 1582, "createdIndex": 1582},
                 {"key": "/service/batman5/initialize", "value": "postgresql0",
@@ -103,8 +105,10 @@ def etcd_read(self, key, **kwargs):
                         "?application_name=http://127.0.0.1:8008/patroni",
                      "expiration": "2015-05-15T09:11:09.611860899Z", "ttl": 30,
                      "modifiedIndex": 20730, "createdIndex": 20730}],
-                 "modifiedIndex": 1581, "createdIndex": 1581}], "modifiedIndex": 1581, "createdIndex": 1581}}
-    return etcd.EtcdResult(**response)
+                 "modifiedIndex": 1581, "createdIndex": 1581}], "modifiedIndex": 1581, "createdIndex": 1581}
+    if key == '/service':
+        cluster = {"key": "/service", "dir": True, "nodes": [cluster]}
+    return etcd.EtcdResult(action='get', node=cluster)
 
 
 class SleepException(Exception):
@@ -215,8 +219,34 @@ class TestEtcd(unittest.TestCase):
         self.etcd._base_path = '/service/noleader'
         self.assertRaises(EtcdError, self.etcd.get_cluster)
 
+    def test_snapshot(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            config = {'ttl': 30, 'host': 'localhost:2379', 'scope': 'test', 'snapshot_dir': tmpdir}
+            with patch.object(Client, 'machines') as mock_machines:
+                mock_machines.__get__ = Mock(return_value=['http://localhost:2379', 'http://localhost:4001'])
+                self.assertIsNone(Etcd('foo', config).cluster)
+                Etcd('foo', config).get_cluster()
+                etcd = Etcd('foo', config)
+                self.assertIsNone(etcd.cluster)  # the snapshot is never used as the state of the cluster
+                self.assertEqual(etcd.cached_cluster.leader.name, 'postgresql1')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_get_clusters(self):
+        self.etcd._namespace = '/service'
+        clusters = self.etcd.get_clusters(['batman5', 'test'])
+        self.assertEqual(clusters['batman5'].leader.name, 'postgresql1')
+        self.assertEqual(len(clusters['batman5'].members), 2)
+        self.assertEqual(clusters['test'].members, [])
+        self.etcd._namespace = '/service/nocluster/'
+        self.assertEqual(self.etcd.get_clusters(['batman5', 'test'])['test'].members, [])
+        self.etcd._namespace = '/service/noleader/'
+        self.assertRaises(EtcdError, self.etcd.get_clusters, ['batman5', 'test'])
+
     def test_touch_member(self):
         self.assertFalse(self.etcd.touch_member('', ''))
+        self.assertFalse(self.etcd.touch_member_status(''))
 
     def test_take_leader(self):
         self.assertFalse(self.etcd.take_leader())
@@ -233,6 +263,14 @@ class TestEtcd(unittest.TestCase):
     def test_update_leader(self):
         self.assertTrue(self.etcd.update_leader())
 
+    def test_retry(self):
+        func = Mock(side_effect=[etcd.EtcdConnectionFailed, 'ok'])
+        with patch.object(self.etcd._retry, 'sleep_func', Mock()):
+            self.assertEqual(self.etcd.retry(func), 'ok')
+        metrics = self.etcd.get_metrics()
+        self.assertEqual(metrics['endpoint'], self.etcd._client._base_uri)
+        self.assertEqual(metrics['operations']['other']['retries'], 1)
+
     def test_initialize(self):
         self.assertFalse(self.etcd.initialize())
 
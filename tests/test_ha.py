@@ -43,7 +43,7 @@ def get_cluster_initialized_with_leader(failover=None):
 
 def get_cluster_initialized_with_only_leader(failover=None):
     l = get_cluster_initialized_without_leader(leader=True, failover=failover).leader
-    return get_cluster(True, l, [l], failover)
+    return get_cluster(True, l, [l.member], failover)
 
 
 class MockPatroni(object):
@@ -111,6 +111,8 @@ class TestHa(unittest.TestCase):
     def test_start_as_replica(self):
         self.p.is_healthy = false
         self.assertEquals(self.ha.run_cycle(), 'starting as a secondary')
+        self.assertEquals(self.ha.cycle_duration.snapshot()['count'], 1)
+        self.ha.patroni.api.events.publish.assert_any_call('leader', {'leader': None})
 
     def test_recover_replica_failed(self):
         self.p.controldata = lambda: {'Database cluster state': 'in production'}
@@ -262,6 +264,7 @@ class TestHa(unittest.TestCase):
     def test_restart_in_progress(self):
         self.ha._async_executor.schedule('restart', True)
         self.assertTrue(self.ha.restart_scheduled())
+        self.assertEquals(self.ha.async_action(), ('restart', True))
         self.assertEquals(self.ha.run_cycle(), 'not healthy enough for leader race')
 
         self.ha.cluster = get_cluster_initialized_with_leader()
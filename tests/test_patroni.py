@@ -68,6 +68,8 @@ class TestPatroni(unittest.TestCase):
 
     @patch('time.sleep', Mock(side_effect=SleepException()))
     def test_run(self):
+        self.p.api.serve_forever = Mock()
+        self.p.api.status.start = Mock()
         self.p.ha.dcs.watch = Mock(side_effect=SleepException())
         self.assertRaises(SleepException, self.p.run)
 
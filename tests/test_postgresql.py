@@ -228,6 +228,7 @@ class TestPostgresql(unittest.TestCase):
         self.p.is_running = false
         self.assertFalse(self.p.restart())
         self.assertEquals(self.p.state, 'restart failed (restarting)')
+        self.assertEquals(self.p.events['restarts'], 1)
 
     @patch.object(builtins, 'open', MagicMock())
     def test_write_pgpass(self):
@@ -341,6 +342,7 @@ class TestPostgresql(unittest.TestCase):
         self.p._role = 'replica'
         self.assertTrue(self.p.promote())
         self.assertTrue(self.p.promote())
+        self.assertEquals(self.p.events['promotions'], 1)
 
     def test_last_operation(self):
         self.assertEquals(self.p.last_operation(), '0')
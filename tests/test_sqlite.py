@@ -0,0 +1,114 @@
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from mock import Mock, patch
+from patroni.dcs import get_dcs
+from patroni.sqlite import SQLite, SQLiteError
+
+
+class TestSQLite(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        config = {'ttl': 30, 'scope': 'test', 'path': self.tmpdir + '/dcs.sqlite'}
+        self.s = get_dcs('foo', {'sqlite': config})
+        self.s2 = SQLite('bar', config)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_cluster(self):
+        cluster = self.s.get_cluster()
+        self.assertIsNone(cluster.leader)
+        self.assertEqual(cluster.members, [])
+
+        self.assertFalse(self.s.initialize(create_new=False, sysid='12345'))
+        self.assertTrue(self.s.initialize(sysid='12345'))
+        self.assertFalse(self.s2.initialize(sysid='54321'))
+        self.assertTrue(self.s.touch_member('postgres://foo'))
+        self.assertTrue(self.s2.touch_member('postgres://bar'))
+        self.assertTrue(self.s.attempt_to_acquire_leader())
+        self.assertFalse(self.s2.attempt_to_acquire_leader())
+        self.assertTrue(self.s.update_leader())
+        self.assertFalse(self.s2.update_leader())
+        self.assertTrue(self.s.write_leader_optime('1234'))
+        self.assertTrue(self.s.manual_failover('foo', 'bar'))
+
+        cluster = self.s2.get_cluster()
+        self.assertEqual(cluster.initialize, '12345')
+        self.assertEqual(cluster.leader.name, 'foo')
+        self.assertEqual(cluster.leader.member.conn_url, 'postgres://foo')
+        self.assertEqual(cluster.last_leader_operation, 1234)
+        self.assertEqual(sorted(m.name for m in cluster.members), ['bar', 'foo'])
+        self.assertEqual(cluster.failover.candidate, 'bar')
+        self.assertFalse(self.s.manual_failover('', '', index=cluster.failover.index + 1))
+        self.assertTrue(self.s.manual_failover('', '', index=cluster.failover.index))
+
+        self.assertFalse(self.s2.delete_leader())
+        self.assertTrue(self.s.delete_leader())
+        self.assertTrue(self.s2.take_leader())
+        self.assertEqual(self.s.get_cluster().leader.name, 'bar')
+
+        self.assertTrue(self.s.cancel_initialization())
+        self.assertIsNone(self.s.get_cluster().initialize)
+        self.assertTrue(self.s.delete_cluster())
+        self.assertEqual(self.s.get_cluster().members, [])
+
+    def test_get_clusters(self):
+        other = SQLite('foo', {'ttl': 30, 'scope': 'other', 'path': self.tmpdir + '/dcs.sqlite'})
+        self.s.attempt_to_acquire_leader()
+        self.s.touch_member('postgres://foo')
+        other.touch_member('postgres://other')
+        self.assertEqual(list(self.s.get_clusters(['test'])), ['test'])
+        clusters = self.s2.get_clusters(['test', 'other', 'missing'])
+        self.assertEqual(clusters['test'].leader.name, 'foo')
+        self.assertEqual(clusters['other'].members[0].conn_url, 'postgres://other')
+        self.assertEqual(clusters['missing'].members, [])
+        with patch.object(SQLite, '_transaction', Mock(side_effect=sqlite3.OperationalError)):
+            self.assertRaises(SQLiteError, self.s.get_clusters, ['test', 'other'])
+
+    def test_ttl(self):
+        self.s.attempt_to_acquire_leader()
+        self.s.touch_member('postgres://foo')
+        with patch('time.time', Mock(return_value=time.time() + 31)):
+            cluster = self.s2.get_cluster()
+            self.assertIsNone(cluster.leader)
+            self.assertEqual(cluster.members, [])
+            self.assertFalse(self.s.update_leader())
+            self.assertTrue(self.s2.attempt_to_acquire_leader())
+
+    def test_errors(self):
+        with patch.object(SQLite, '_transaction', Mock(side_effect=sqlite3.OperationalError)):
+            self.assertRaises(SQLiteError, self.s.get_cluster)
+            self.assertFalse(self.s.touch_member(''))
+        with patch.object(SQLite, '_set', Mock(side_effect=ValueError)):
+            self.assertRaises(ValueError, self.s.touch_member, '')
+        self.assertEqual(self.s.get_cluster().members, [])
+
+    def test_watch(self):
+        self.assertFalse(self.s2.watch(0))
+        self.s.attempt_to_acquire_leader()
+        self.s2.get_cluster()
+
+        # leader key doesn't change
+        self.assertFalse(self.s2.watch(0.3))
+
+        # leader key changes while replica is waiting
+        threading.Timer(0.2, self.s.update_leader).start()
+        start = time.time()
+        self.assertTrue(self.s2.watch(5))
+        self.assertLess(time.time() - start, 4)
+
+        # the leader doesn't watch its own key
+        self.s.get_cluster()
+        with patch('patroni.dcs.AbstractDCS.watch', Mock(return_value=False)) as mock_watch:
+            self.assertFalse(self.s.watch(1))
+            mock_watch.assert_called_once_with(1)
+
+        self.s2.get_cluster()
+        with patch.object(SQLite, '_transaction', Mock(side_effect=sqlite3.OperationalError)):
+            self.assertFalse(self.s2.watch(0.2))